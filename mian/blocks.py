@@ -430,3 +430,68 @@ BLOCK_TYPES = {
     '\xfd': [UNUSED_NAME],
     '\xfe': [UNUSED_NAME],
     '\xff': [UNUSED_NAME]}
+
+# Block types counted together with --blocks @<category>, by hex ID. More can
+# be defined in a configuration file, see mian.load_categories().
+BLOCK_CATEGORIES = {
+    'ores': [
+        '\x0e', '\x0f', '\x10', '\x15', '\x38', '\x49', '\x4a'],
+    'liquids': [
+        '\x08', '\x09', '\x0a', '\x0b'],
+    'plants': [
+        '\x06', '\x11', '\x12', '\x1f', '\x20', '\x25', '\x26', '\x27',
+        '\x28', '\x3b', '\x51', '\x53', '\x56', '\x63', '\x64', '\x67',
+        '\x68', '\x69', '\x6a', '\x6f', '\x73'],
+    # Mostly placed by players, but villages, dungeons and strongholds have
+    # some of them too
+    'placed': [
+        '\x05', '\x14', '\x16', '\x17', '\x19', '\x1a', '\x1b', '\x1c',
+        '\x1d', '\x21', '\x22', '\x23', '\x29', '\x2a', '\x2b', '\x2c',
+        '\x2d', '\x2e', '\x2f', '\x32', '\x35', '\x36', '\x37', '\x39',
+        '\x3a', '\x3c', '\x3d', '\x3e', '\x3f', '\x40', '\x41', '\x42',
+        '\x43', '\x44', '\x45', '\x46', '\x47', '\x48', '\x4b', '\x4c',
+        '\x4d', '\x54', '\x55', '\x5b', '\x5c', '\x5d', '\x5e', '\x60',
+        '\x65', '\x66', '\x6b', '\x6c', '\x74', '\x75', '\x76'],
+}
+
+#: Biome IDs of the chunk Biomes array, from
+#: http://www.minecraftwiki.net/wiki/Data_values#Biome_IDs
+BIOME_NAMES = {
+    0: 'Ocean',
+    1: 'Plains',
+    2: 'Desert',
+    3: 'Extreme Hills',
+    4: 'Forest',
+    5: 'Taiga',
+    6: 'Swampland',
+    7: 'River',
+    8: 'Hell',
+    9: 'Sky',
+    10: 'Frozen Ocean',
+    11: 'Frozen River',
+    12: 'Ice Plains',
+    13: 'Ice Mountains',
+    14: 'Mushroom Island',
+    15: 'Mushroom Island Shore',
+    16: 'Beach',
+    17: 'Desert Hills',
+    18: 'Forest Hills',
+    19: 'Taiga Hills',
+    20: 'Extreme Hills Edge',
+    21: 'Jungle',
+    22: 'Jungle Hills',
+    # Not computed yet, and every column of chunks without a Biomes array
+    255: 'Unknown biome',
+}
+
+#: Blocks which don't hide the faces of their neighbors: air, liquids and the
+#: blocks which aren't full cubes or can be seen through
+TRANSPARENT_BLOCKS = [
+    '\x00', '\x06', '\x08', '\x09', '\x0a', '\x0b', '\x12', '\x14', '\x1a',
+    '\x1b', '\x1c', '\x1e', '\x1f', '\x20', '\x25', '\x26', '\x27', '\x28',
+    '\x2c', '\x32', '\x33', '\x34', '\x35', '\x37', '\x3b', '\x3f', '\x40',
+    '\x41', '\x42', '\x43', '\x44', '\x45', '\x46', '\x47', '\x48', '\x4b',
+    '\x4c', '\x4d', '\x4e', '\x4f', '\x51', '\x53', '\x55', '\x5a', '\x5c',
+    '\x5d', '\x5e', '\x60', '\x65', '\x66', '\x68', '\x69', '\x6a', '\x6b',
+    '\x6c', '\x6d', '\x6f', '\x71', '\x72', '\x73', '\x74', '\x75', '\x76',
+    '\x77']
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of the region files of a world, with the coordinates, size and
+modification time of every file in one NumPy record array.
+
+A region directory is listed in one scandir pass, which gets the sizes and
+times along with the names, so the region files are looked up by coordinates
+instead of formatting or parsing their paths. Minecraft rewrites region files
+in place, so the catalog is listed anew every run rather than cached.
+
+Catalogs of archives are built from the member list, which is in memory
+anyway.
+"""
+
+import os
+import re
+
+import numpy as np
+
+import storage
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Backport for Python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#: Region file names, with the region coordinates
+REGION_NAME = re.compile(r'^r\.(-?\d+)\.(-?\d+)\.mcr$')
+
+#: One region file
+CATALOG_DTYPE = np.dtype([
+    ('x', np.int32),
+    ('z', np.int32),
+    ('size', np.int64),
+    ('mtime', np.float64),
+])
+
+class RegionCatalog(object):
+    """
+    Region files by position, like a list of their paths.
+
+    Positions are the file numbers of chunk manifests.
+    """
+
+    def __init__(self, paths, regions):
+        """
+        @param paths: Region file paths.
+        @param regions: Array of CATALOG_DTYPE in the same order.
+        """
+        self.paths = paths
+        self.regions = regions
+        self.indexes = dict(
+            (region, index) for index, region in enumerate(self.coordinates()))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __getitem__(self, index):
+        return self.paths[index]
+
+    def coords(self, index):
+        """Region coordinates of a file."""
+        return int(self.regions['x'][index]), int(self.regions['z'][index])
+
+    def coordinates(self):
+        """Region coordinates of all the files."""
+        return zip(self.regions['x'].tolist(), self.regions['z'].tolist())
+
+    def find(self, region):
+        """Position of the file of a region, or None if there is none."""
+        return self.indexes.get(region)
+
+    def select(self, selected):
+        """
+        Some of the files.
+
+        @param selected: Boolean array or positions.
+        @return: RegionCatalog.
+        """
+        positions = np.arange(len(self.paths))[selected]
+        return RegionCatalog(
+            [self.paths[index] for index in positions],
+            self.regions[positions])
+
+    def signatures(self):
+        """Dictionary of region coordinates to (size, mtime)."""
+        return dict(zip(self.coordinates(), zip(
+            self.regions['size'].tolist(), self.regions['mtime'].tolist())))
+
+
+def region_coords(name):
+    """
+    Region coordinates from a file name.
+
+    >>> region_coords('r.-1.2.mcr')
+    (-1, 2)
+
+    @return: Region X and Z, or None if it isn't a region file name.
+    """
+
+    match = REGION_NAME.match(name)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def build_catalog(paths, names, stats):
+    """
+    @param paths: Region file paths.
+    @param names: Their file names.
+    @param stats: Their (size, mtime) pairs.
+    @return: RegionCatalog.
+    """
+
+    regions = np.empty(len(paths), dtype=CATALOG_DTYPE)
+    if paths:
+        regions['x'], regions['z'] = zip(*[region_coords(name) for name in names])
+        regions['size'], regions['mtime'] = zip(*stats)
+    return RegionCatalog(list(paths), regions)
+
+
+def from_paths(mcr_files):
+    """
+    Catalog of some region file paths, in the same order.
+
+    Every file is stat'ed, so this is for short lists and archives.
+
+    @param mcr_files: Region file paths, or a RegionCatalog which is returned
+    as is.
+    """
+
+    if isinstance(mcr_files, RegionCatalog):
+        return mcr_files
+    names = [os.path.basename(mcr_file) for mcr_file in mcr_files]
+    return build_catalog(
+        mcr_files, names, [storage.stat(mcr_file) for mcr_file in mcr_files])
+
+
+def list_directory(region_dir):
+    """
+    Catalog of a region directory in row by row order.
+
+    @param region_dir: Directory path, not in an archive.
+    """
+
+    names = []
+    stats = []
+    if scandir is not None:
+        for entry in scandir(region_dir):
+            if REGION_NAME.match(entry.name) and entry.is_file():
+                result = entry.stat()
+                names.append(entry.name)
+                stats.append((result.st_size, result.st_mtime))
+    else:
+        for name in os.listdir(region_dir):
+            path = os.path.join(region_dir, name)
+            if REGION_NAME.match(name) and os.path.isfile(path):
+                result = os.stat(path)
+                names.append(name)
+                stats.append((result.st_size, result.st_mtime))
+
+    catalog = build_catalog(
+        [os.path.join(region_dir, name) for name in names], names, stats)
+    return catalog.select(np.lexsort(
+        (catalog.regions['x'], catalog.regions['z'])))
+
+
+def read_catalog(region_dir):
+    """
+    Catalog of a region directory.
+
+    @param region_dir: Directory or archive directory path.
+    @return: RegionCatalog, in archive order in archives and row by row order
+    otherwise.
+    """
+
+    if storage.split_path(region_dir)[0] is not None:
+        return from_paths([
+            mcr_file
+            for mcr_file in storage.glob(os.path.join(region_dir, '*.mcr'))
+            if REGION_NAME.match(os.path.basename(mcr_file))])
+
+    if not os.path.isdir(region_dir):
+        return build_catalog([], [], [])
+    return list_directory(region_dir)
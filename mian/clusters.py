@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Connected components of blocks, like ore veins, across a whole world.
+
+Blocks are connected to all 26 neighbors, including diagonals. Each chunk is
+labeled on its own with NumPy. Components touching a chunk border are then
+merged with those of the neighboring chunks in a union-find structure, using
+only the labels on the four sides of each chunk. The sides are dropped once all
+the neighboring chunks have been added.
+
+A component is final once no chunk with unfinished neighbors has it on its
+sides. Final components only go into a histogram of sizes and a short list of
+the largest ones, and their labels are dropped, so memory use depends on the
+chunks waiting for neighbors, which are the edges of the world and the row
+being scanned, rather than on the number of blocks or components.
+"""
+
+import heapq
+
+import numpy as np
+
+#: Neighbors in other columns as (X, Z, Y) offsets
+COLUMN_NEIGHBORS = [
+    (dx, dz, dy)
+    for dx in (-1, 0, 1)
+    for dz in (-1, 0, 1)
+    for dy in (-1, 0, 1)
+    if (dx, dz) != (0, 0)]
+
+#: Horizontal offsets of the neighboring chunks
+CHUNK_NEIGHBORS = [
+    (dx, dz) for dx in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dz) != (0, 0)]
+
+
+def run_pairs(runs, starts):
+    """
+    Find the pairs of touching runs in neighboring columns.
+
+    Two runs touch if and only if one of them has a neighbor in the other
+    next to its first element, so only the first elements are checked.
+
+    @param runs: 3D array of run numbers along the last axis, -1 outside runs.
+    @param starts: 3D boolean array, True at the first element of every run.
+    @return: Two arrays of run numbers.
+    """
+
+    padded = np.pad(runs, 1, 'constant', constant_values=-1)
+    coordinates = np.nonzero(starts)
+    start_runs = runs[coordinates]
+    firsts = []
+    seconds = []
+    for offset in COLUMN_NEIGHBORS:
+        neighbors = padded[tuple(
+            coordinate + 1 + delta
+            for coordinate, delta in zip(coordinates, offset))]
+        touching = neighbors >= 0
+        firsts.append(start_runs[touching])
+        seconds.append(neighbors[touching])
+
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def label_components(mask):
+    """
+    Label the 26-connected components of a 3D mask.
+
+    >>> mask = np.zeros((4, 4, 4), dtype=bool)
+    >>> mask[0, 0, 0] = mask[1, 1, 1] = mask[3, 3, 3] = True
+    >>> labels, count = label_components(mask)
+    >>> count, labels[0, 0, 0], labels[1, 1, 1], labels[3, 3, 3]
+    (2, 1, 1, 2)
+
+    @return: int32 array of labels 1 to count, 0 outside the mask, and the
+    number of components.
+    """
+
+    # Runs of elements along the last axis are connected already, so the
+    # nodes of the graph are the runs
+    starts = mask.copy()
+    starts[..., 1:] &= ~mask[..., :-1]
+    runs = np.cumsum(starts).reshape(mask.shape) - 1
+    run_count = runs.flat[-1] + 1 if runs.size else 0
+    runs[~mask] = -1
+
+    firsts, seconds = run_pairs(runs, starts)
+
+    # Hook the higher of every pair of roots onto the lower and shortcut
+    # until no pair has different roots
+    parents = np.arange(run_count)
+    while True:
+        first_roots = parents[firsts]
+        second_roots = parents[seconds]
+        different = first_roots != second_roots
+        if not different.any():
+            break
+        lower = np.minimum(first_roots, second_roots)[different]
+        np.minimum.at(parents, first_roots[different], lower)
+        np.minimum.at(parents, second_roots[different], lower)
+        while True:
+            grandparents = parents[parents]
+            if np.array_equal(grandparents, parents):
+                break
+            parents = grandparents
+
+    roots, component = np.unique(parents, return_inverse=True)
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    labels[mask] = component[runs[mask]] + 1
+
+    return labels, len(roots)
+
+
+def touching_labels(ours, theirs):
+    """
+    Find the pairs of labels which touch across a chunk border.
+
+    @param ours: 2D array of labels along the border, one row per block
+    along the border and one column per layer. 0 is no label.
+    @param theirs: Same, on the other side of the border.
+    @return: Unique pairs of labels as an (n, 2) array.
+    """
+
+    rows, layers = ours.shape
+    pairs = []
+    for drow in (-1, 0, 1) if rows > 1 else (0,):
+        for dlayer in (-1, 0, 1):
+            first = ours[
+                max(0, -drow):rows - max(0, drow),
+                max(0, -dlayer):layers - max(0, dlayer)]
+            second = theirs[
+                max(0, drow):rows - max(0, -drow),
+                max(0, dlayer):layers - max(0, -dlayer)]
+            both = (first > 0) & (second > 0)
+            pairs.append(np.column_stack((first[both], second[both])))
+
+    pairs = np.concatenate(pairs)
+    if not len(pairs):
+        return pairs
+    return np.unique(pairs.view([('', pairs.dtype)] * 2)).view(
+        pairs.dtype).reshape(-1, 2)
+
+
+class ClusterFinder(object):
+    """Merge chunk components into world components."""
+
+    def __init__(self, largest=10):
+        """
+        @param largest: Number of the largest components to locate.
+        """
+        self.largest = largest
+        self.next_label = 1
+        #: Union-find parents of the labels of the open components, which may
+        #: still grow
+        self.parents = {}
+        #: Size, location, labels and number of referring chunks by root label
+        self.sizes = {}
+        self.locations = {}
+        self.members = {}
+        self.references = {}
+        #: Labels on the sides of chunks with unfinished neighbors, by chunk
+        #: coordinates, as dictionaries of side to (indexes, labels)
+        self.sides = {}
+        #: Number of added neighbors of the chunks in sides
+        self.added_neighbors = {}
+        #: One label of each component a chunk in sides refers to
+        self.referred = {}
+        #: Number of final components by size
+        self.size_counts = {}
+        #: Heap of (size, number, location) of the largest final components
+        self.top = []
+        self.final_count = 0
+
+    def find(self, label):
+        """Root label of a component, compressing the path."""
+        root = label
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[label] != root:
+            self.parents[label], label = root, self.parents[label]
+        return root
+
+    def union(self, first, second):
+        """Merge two components."""
+        first = self.find(first)
+        second = self.find(second)
+        if first == second:
+            return
+        if len(self.members[first]) < len(self.members[second]):
+            first, second = second, first
+        self.parents[second] = first
+        self.sizes[first] += self.sizes.pop(second)
+        self.references[first] += self.references.pop(second)
+        self.members[first].extend(self.members.pop(second))
+        del self.locations[second]
+
+    def add_final(self, size, location):
+        """Count a component which can't grow anymore."""
+        self.size_counts[size] = self.size_counts.get(size, 0) + 1
+        self.final_count += 1
+        entry = (size, self.final_count, location)
+        if len(self.top) < self.largest:
+            heapq.heappush(self.top, entry)
+        elif self.top and entry > self.top[0]:
+            heapq.heapreplace(self.top, entry)
+
+    def finish(self, root):
+        """Count an open component as final and forget its labels."""
+        for label in self.members.pop(root):
+            del self.parents[label]
+        del self.references[root]
+        self.add_final(self.sizes.pop(root), self.locations.pop(root))
+
+    def add_chunk(self, chunk_xz, mask):
+        """
+        Add the components of a chunk.
+
+        @param chunk_xz: Global chunk coordinates.
+        @param mask: (16, 16, 128) boolean array indexed by local X, Z and Y.
+        """
+
+        local_labels, count = label_components(mask)
+
+        # Global labels
+        base = self.next_label - 1
+        self.next_label += count
+        labels = np.where(local_labels > 0, local_labels + base, 0)
+        sizes = np.bincount(local_labels.ravel(), minlength=count + 1).tolist()
+        # The first block of each component in (X, Z, Y) order
+        values, firsts = np.unique(local_labels.ravel(), return_index=True)
+        firsts = firsts[values > 0]
+        x, z, y = np.unravel_index(firsts, mask.shape)
+        locations = zip(
+            (x + chunk_xz[0] * mask.shape[0]).tolist(),
+            y.tolist(),
+            (z + chunk_xz[1] * mask.shape[1]).tolist())
+
+        sides = {
+            (-1, 0): labels[0],
+            (1, 0): labels[-1],
+            (0, -1): labels[:, 0],
+            (0, 1): labels[:, -1],
+        }
+
+        # Components off the sides are final already
+        border_labels = np.unique(np.concatenate(
+            [side.ravel() for side in sides.itervalues()]))
+        border_labels = border_labels[border_labels > 0].tolist()
+        on_side = np.zeros(count + 1, dtype=bool)
+        on_side[np.array(border_labels, dtype=int) - base] = True
+        for local_label in np.flatnonzero(~on_side[1:]) + 1:
+            self.add_final(sizes[local_label], locations[local_label - 1])
+        for label in border_labels:
+            self.parents[label] = label
+            self.sizes[label] = sizes[label - base]
+            self.locations[label] = locations[label - base - 1]
+            self.members[label] = [label]
+            self.references[label] = 0
+
+        added_neighbors = 0
+        finished = []
+        for dx, dz in CHUNK_NEIGHBORS:
+            neighbor = (chunk_xz[0] + dx, chunk_xz[1] + dz)
+            if neighbor not in self.sides:
+                continue
+            added_neighbors += 1
+
+            theirs = self.side_labels(neighbor, mask.shape)
+            if dx and dz:
+                # Only the corner columns touch
+                ours = sides[(dx, 0)][[0 if dz < 0 else -1]]
+                theirs = theirs[(-dx, 0)][[-1 if dz < 0 else 0]]
+            else:
+                ours = sides[(dx, dz)]
+                theirs = theirs[(-dx, -dz)]
+            for first, second in touching_labels(ours, theirs):
+                self.union(first, second)
+
+            self.added_neighbors[neighbor] += 1
+            if self.added_neighbors[neighbor] == len(CHUNK_NEIGHBORS):
+                finished.append(neighbor)
+
+        if added_neighbors < len(CHUNK_NEIGHBORS):
+            # Keep the sides, even without labels, to know the chunk is there
+            self.sides[chunk_xz] = dict(
+                (side, (np.flatnonzero(side_labels), side_labels[side_labels > 0]))
+                for side, side_labels in sides.iteritems())
+            self.added_neighbors[chunk_xz] = added_neighbors
+            self.refer(chunk_xz, border_labels)
+
+        # Components no chunk with unfinished neighbors refers to are final
+        roots = set(self.find(label) for label in border_labels)
+        for neighbor in finished:
+            del self.sides[neighbor]
+            del self.added_neighbors[neighbor]
+            for label in self.referred.pop(neighbor):
+                root = self.find(label)
+                self.references[root] -= 1
+                roots.add(root)
+        for root in roots:
+            if self.references[root] == 0:
+                self.finish(root)
+
+    def refer(self, chunk_xz, labels):
+        """Make a chunk refer to the components of some labels once each."""
+        referred = {}
+        for label in labels:
+            referred.setdefault(self.find(label), label)
+        for root in referred:
+            self.references[root] += 1
+        self.referred[chunk_xz] = referred.values()
+
+    def side_labels(self, chunk_xz, shape):
+        """Dense side labels of a chunk from the sparse copy in sides."""
+        sides = {}
+        for side, (indexes, labels) in self.sides[chunk_xz].iteritems():
+            rows = shape[1] if side[0] else shape[0]
+            side_labels = np.zeros((rows, shape[2]), dtype=np.int32)
+            side_labels.flat[indexes] = labels
+            sides[side] = side_labels
+        return sides
+
+    def components(self):
+        """
+        Get the merged components, once all the chunks have been added.
+
+        Components along the chunks with missing neighbors are final then.
+
+        @return: Dictionary of component sizes to numbers of components, and
+        list of the sizes and (X, Y, Z) coordinates of a block of the largest
+        components, largest first.
+        """
+
+        for root in [
+                label for label, parent in self.parents.items()
+                if parent == label]:
+            self.finish(root)
+        self.sides.clear()
+        self.added_neighbors.clear()
+        self.referred.clear()
+
+        return self.size_counts, [
+            (size, location)
+            for size, _, location in sorted(self.top, reverse=True)]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Exposed and enclosed blocks, like ores visible from caves, across a whole
+world.
+
+A block is exposed if any of its six neighbors is transparent, like air or a
+liquid, or if it is in the top layer, below the sky. Neighbors within a chunk
+are found by shifting a mask of the transparent blocks along each axis.
+Selected blocks on a chunk side which aren't exposed yet wait for the chunk
+on the other side, and the sides of every chunk are kept until all four
+neighboring chunks have been added, like in clusters.ClusterFinder. Blocks
+next to missing chunks count as enclosed.
+"""
+
+import numpy as np
+
+#: Horizontal offsets of the chunks sharing a side
+SIDES = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+#: Whether a block is exposed, as the first histogram index
+ENCLOSED = 0
+EXPOSED = 1
+
+#: Chunks counted with one bincount, like mian.CHUNK_BATCH
+CHUNK_BATCH = 64
+
+
+def side_index(side):
+    """
+    Index of the blocks on a side of a chunk.
+
+    @param side: Offset of the chunk on the other side, one of SIDES.
+    @return: Index into an array indexed by X, Z and Y, which gives an array
+    indexed by the horizontal coordinate along the side and Y.
+    """
+
+    dx, dz = side
+    if dx:
+        return 0 if dx < 0 else -1
+    return slice(None), 0 if dz < 0 else -1
+
+
+def exposed_mask(transparent):
+    """
+    Find the blocks with a transparent neighbor in the same chunk.
+
+    >>> transparent = np.zeros((2, 2, 3), dtype=bool)
+    >>> transparent[0, 0, 0] = True
+    >>> exposed_mask(transparent)[:, :, 0].tolist()
+    [[False, True], [True, False]]
+
+    @param transparent: Boolean array indexed by X, Z and Y.
+    @return: Boolean array of the same shape, True in the top layer.
+    """
+
+    exposed = np.zeros_like(transparent)
+    exposed[1:] |= transparent[:-1]
+    exposed[:-1] |= transparent[1:]
+    exposed[:, 1:] |= transparent[:, :-1]
+    exposed[:, :-1] |= transparent[:, 1:]
+    exposed[:, :, 1:] |= transparent[:, :, :-1]
+    exposed[:, :, :-1] |= transparent[:, :, 1:]
+    exposed[:, :, -1] = True
+    return exposed
+
+
+class ExposureCounter(object):
+    """Count blocks as exposed or enclosed, chunk by chunk."""
+
+    def __init__(self, shape):
+        """
+        @param shape: Shape of the histogram of each chunk, see add_chunk().
+        """
+        #: Counts of the enclosed and the exposed blocks, see flush()
+        self.histogram = np.zeros((2,) + tuple(shape), dtype=np.int64)
+        #: Histogram indexes of the chunks not counted yet
+        self.batch = []
+        #: Transparent blocks on the sides of chunks with unfinished
+        #: neighbors, by chunk coordinates, as dictionaries of side to mask
+        self.sides = {}
+        #: Number of added neighbors of the chunks in sides
+        self.added_neighbors = {}
+        #: Selected blocks waiting for a neighboring chunk, by chunk
+        #: coordinates, as X, Z and Y arrays and histogram indexes
+        self.pending = {}
+
+    def add_chunk(self, chunk_xz, transparent, selected, bins):
+        """
+        Add the blocks of a chunk.
+
+        @param chunk_xz: Global chunk coordinates.
+        @param transparent: (16, 16, 128) boolean array indexed by local X, Z
+        and Y.
+        @param selected: Same, True for the blocks whose counts matter across
+        chunk sides.
+        @param bins: Same shape, flat index of every block in the histogram of
+        one chunk.
+        """
+
+        exposed = exposed_mask(transparent)
+        neighbors = []
+        edge = np.zeros_like(selected)
+        for dx, dz in SIDES:
+            neighbor = (chunk_xz[0] + dx, chunk_xz[1] + dz)
+            if neighbor in self.sides:
+                exposed[side_index((dx, dz))] |= \
+                    self.sides[neighbor][(-dx, -dz)]
+                neighbors.append(((dx, dz), neighbor))
+            else:
+                edge[side_index((dx, dz))] = True
+
+        self.batch.append((bins + exposed * self.histogram[0].size).ravel())
+        if len(self.batch) == CHUNK_BATCH:
+            self.flush()
+
+        sides = dict(
+            (side, transparent[side_index(side)]) for side in SIDES)
+        for side, neighbor in neighbors:
+            self.resolve(neighbor, (-side[0], -side[1]), sides[side])
+            self.added_neighbors[neighbor] += 1
+            if self.added_neighbors[neighbor] == len(SIDES):
+                # The rest of its blocks are enclosed for good
+                del self.sides[neighbor]
+                del self.added_neighbors[neighbor]
+                self.pending.pop(neighbor, None)
+
+        if len(neighbors) < len(SIDES):
+            self.sides[chunk_xz] = sides
+            self.added_neighbors[chunk_xz] = len(neighbors)
+            waiting = selected & edge & ~exposed
+            if waiting.any():
+                x, z, y = np.nonzero(waiting)
+                self.pending[chunk_xz] = x, z, y, bins[waiting]
+
+    def flush(self):
+        """Count the chunks added since the last flush in histogram."""
+        if self.batch:
+            self.histogram.ravel()[:] += np.bincount(
+                np.concatenate(self.batch), minlength=self.histogram.size)
+            self.batch = []
+
+    def resolve(self, chunk_xz, side, transparent):
+        """
+        Expose the waiting blocks of a chunk next to a new chunk.
+
+        @param side: Offset of the new chunk.
+        @param transparent: Transparent blocks on the side of the new chunk
+        facing this one, indexed by the coordinate along the side and Y.
+        """
+
+        if chunk_xz not in self.pending:
+            return
+        x, z, y, bins = self.pending[chunk_xz]
+        dx, dz = side
+        if dx:
+            on_side = x == (0 if dx < 0 else transparent.shape[0] - 1)
+            along = z
+        else:
+            on_side = z == (0 if dz < 0 else transparent.shape[0] - 1)
+            along = x
+        hit = on_side & transparent[along, y]
+        if not hit.any():
+            return
+
+        np.subtract.at(self.histogram[ENCLOSED].ravel(), bins[hit], 1)
+        np.add.at(self.histogram[EXPOSED].ravel(), bins[hit], 1)
+        if hit.all():
+            del self.pending[chunk_xz]
+        else:
+            self.pending[chunk_xz] = x[~hit], z[~hit], y[~hit], bins[~hit]
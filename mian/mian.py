@@ -12,7 +12,9 @@ Options:
 
 -b, --blocks    Specify block types to include as a comma-separated list, using
                 either the block types or hex values from the list.  Specify ALL 
-                to add all block types.
+                to add all block types.  Append :<data value> to count only
+                that variant (e.g. wool:14), or :* for all 16 variants.
+                @<category> counts a category like @ores as one.
 -l, --list      List available block types and their names (from
                 <http://www.minecraftwiki.net/wiki/Data_values>).
 -n, --nether    Graph The Nether instead of the ordinary world.
@@ -35,6 +37,24 @@ Ditto, showing only the specified block types.
 $ mian -b 56,57,58,59,5a,5b -n ~/.minecraft/saves/World1
 Graph all the materials new to The Nether.
 
+$ mian -b wool:14,wool:11,wool:4 ~/.minecraft/saves/World1
+Graph red, blue and yellow wool separately.
+
+$ mian -b @ores,@liquids,@placed ~/.minecraft/saves/World1
+Graph all ores, all liquids and most player placed blocks as three lines.
+
+$ mian -b diamond -p colormap diff ~/backups/World1 ~/.minecraft/saves/World1
+Map where diamond ore was mined or generated since the backup.
+
+$ mian -p entities-map --entity-ids MobSpawner ~/.minecraft/saves/World1
+Map of the monster spawners per chunk.
+
+$ mian -b diamond -k 50 top ~/.minecraft/saves/World1
+List the 50 chunks with the most diamond ore.
+
+$ mian ~/backups/World1.tar.gz
+Read the world straight from a zip or tar backup, without extracting it.
+
 $ mian --list
 Show a list of block types which can be searched for.
 """
@@ -49,37 +69,47 @@ __url__ = 'https://github.com/l0b0/mian/wiki'
 __version__ = '0.9.4'
 
 from binascii import unhexlify
+import calendar
+import cPickle as pickle
+import mmap
+from collections import deque, namedtuple, OrderedDict
+from ConfigParser import RawConfigParser, Error as ConfigError
 from getopt import getopt, GetoptError
-from glob import glob
 from gzip import GzipFile
+from hashlib import sha1
+import heapq
+import json
+from multiprocessing import Pool
 from operator import itemgetter
 import os.path
+import shutil
 SUPPORT_SIGNALS = True
 try:
-    from signal import signal, SIGPIPE, SIG_DFL
+    from signal import signal, SIGINT, SIGPIPE, SIG_DFL, SIG_IGN
 except ImportError:
     SUPPORT_SIGNALS = False
 from StringIO import StringIO
 import struct
 import sys
+import time
 import warnings
 import zlib
 from optparse import OptionParser
-try:
-    import matplotlib as mpl
-    from mpl_toolkits.mplot3d import Axes3D
-    from matplotlib import cm
-except ImportError:
-    sys.stderr.write("Error: mian requires MatPlotlib. See http://matplotlib.sourceforge.net/users/installing.html.")
-    sys.exit(1)
 try:
     import numpy as np
 except ImportError:
     sys.stderr.write("Error: mian requires NumPy. See http://www.scipy.org/Installing_SciPy.")
-    sys.exit(1)
+    raise
 
 
-from blocks import BLOCK_TYPES, UNUSED_NAME
+from blocks import BIOME_NAMES, BLOCK_CATEGORIES, BLOCK_TYPES, \
+    TRANSPARENT_BLOCKS, UNUSED_NAME
+import catalog
+import clusters
+import exposure
+import nbtscan
+import storage
+import tiles
 
 #: For binascii.unhexlify()
 HEX_DIGITS = '0123456789abcdef'
@@ -124,14 +154,120 @@ CHUNK_SIZE_Z = 16
 #: Width
 CHUNK_SIZE_X = CHUNK_SIZE_Y * CHUNK_SIZE_Z
 
+#: Chunks per region side
+REGION_SIZE = 32
+
+#: Blocks per region side
+REGION_BLOCKS = REGION_SIZE * CHUNK_SIZE_Z
+
+#: Blocks in a chunk
+CHUNK_BLOCKS = CHUNK_SIZE_X * CHUNK_SIZE_Z
+
+#: Possible block IDs
+BLOCK_IDS = 256
+
+#: Possible data values, stored as nibbles in the Data array
+DATA_VALUES = 16
+
+#: Look up table of the block IDs which don't hide their neighbors
+TRANSPARENT_TABLE = np.zeros(BLOCK_IDS, dtype=bool)
+TRANSPARENT_TABLE[[ord(bt_hex) for bt_hex in TRANSPARENT_BLOCKS]] = True
+
+#: Separates the block type from the data value in --blocks
+DATA_VALUE_SEPARATOR = ':'
+
+#: Data value wildcard in --blocks
+DATA_VALUE_WILDCARD = '*'
+
+#: Marks a block category in --blocks, like @ores
+CATEGORY_PREFIX = '@'
+
+#: User defined block categories, see load_categories()
+CATEGORIES_PATH = os.path.join('~', '.mian.cfg')
+CATEGORIES_SECTION = 'categories'
+
+#: Chunks counted per NumPy call
+CHUNK_BATCH = 64
+
+#: Rows of read_chunk_manifest(). file is the position in the list of region
+#: files, index the position of the chunk in the region and offset and
+#: sectors its location in the file.
+CHUNK_MANIFEST_DTYPE = np.dtype([
+    ('file', '<i4'),
+    ('region_x', '<i4'),
+    ('region_z', '<i4'),
+    ('index', '<i2'),
+    ('offset', '<i4'),
+    ('sectors', 'u1'),
+    ('timestamp', '<u4')])
+
+#: Formats of --since and --until
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+
+#: Default seconds between checkpoints
+CHECKPOINT_INTERVAL = 60
+
+#: Work units per worker process when counting in parallel, so that workers
+#: which finish early pick up more
+JOB_PARTS = 4
+
+#: Records written by --export-points. The data value is only set when some
+#: of the block types have one.
+POINT_DTYPE = np.dtype([
+    ('x', '<i4'),
+    ('y', '<i2'),
+    ('z', '<i4'),
+    ('id', 'u1'),
+    ('data', 'u1')])
+
+#: <http://docs.scipy.org/doc/numpy/neps/npy-format.html>
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+NPY_HEADER_BYTES = 256
+
 #: Plot X axis
 LABEL_X = 'Layer'
 
+#: Plot X axis with --depth
+LABEL_X_DEPTH = 'Depth below surface'
+
+#: Row label of the surface plot modes
+SURFACE_NAME = 'Surface'
+
+#: Surface heights in the chunk height maps, CHUNK_SIZE_Y above a full column
+SURFACE_HEIGHTS = CHUNK_SIZE_Y + 1
+
+#: Plot modes drawn like another one
+PLOT_MODE_STYLES = {
+    'surface': 'normal',
+    'surface-table': 'table',
+    'surface-map': 'colormap',
+    'entities': 'normal',
+    'entities-table': 'table',
+    'entities-map': 'colormap',
+    'biomes': 'normal',
+    'biomes-table': 'table',
+    'exposure': 'normal',
+    'exposure-table': 'table',
+}
+
 #: Plot Y axis
 LABEL_Y = 'Count'
 
+#: Largest clusters listed by the clusters plot mode
+LARGEST_CLUSTERS = 10
+
+#: Most block types in the legend of the normal plot mode
+MAX_LEGEND_ROWS = 20
+
+#: Seconds between checks for Ctrl-C while waiting for worker processes
+POOL_POLL_SECONDS = 0.1
+
+#: Default --max-cells, which draws about 256 regions unreduced
+MAX_CELLS = 2 ** 18
+
 #: <http://www.minecraftwiki.net/wiki/Beta_Level_Format#Structure>
 KIBIBYTE = 2 ** 10
+MEBIBYTE = 2 ** 20
 UNSIGNED_LONG_BYTES = 4
 UNSIGNED_LONG_FORMAT = '>L'
 UNSIGNED_CHAR_BYTES = 1
@@ -139,6 +275,15 @@ UNSIGNED_CHAR_FORMAT = '>B'
 SECTOR_BYTES = 4 * KIBIBYTE
 SECTOR_INTS = SECTOR_BYTES / UNSIGNED_LONG_BYTES
 
+#: Memory of a process before it reads any chunks, mostly Python and NumPy
+PROCESS_BYTES = 32 * MEBIBYTE
+
+#: Share of --max-memory for --chunk-cache, as a divisor
+CHUNK_CACHE_SHARE = 4
+
+#: Engines which can run in several processes
+PARALLEL_ENGINES = ('layers', 'top')
+
 #: <http://www.minecraftwiki.net/wiki/Beta_Level_Format#Chunk_Location>
 LOCATION_OFFSET_BYTES = 3
 SECTOR_COUNT_BYTES = 1
@@ -149,6 +294,10 @@ LOCATION_PADDING = '\x00' * (struct.calcsize(LOCATION_FORMAT) - LOCATION_BYTES)
 #: <http://www.minecraftwiki.net/wiki/Beta_Level_Format#Chunk_Timestamps>
 TIMESTAMP_BYTES = UNSIGNED_LONG_BYTES
 
+#: Uncompressed chunk: block IDs, data values, the two light arrays, the
+#: height map and some room for entities
+UNCOMPRESSED_CHUNK_BYTES = CHUNK_BLOCKS * 5 / 2 + 4 * KIBIBYTE
+
 #: <http://www.minecraftwiki.net/wiki/Beta_Level_Format#Chunk_Data>
 CHUNK_LENGTH_BYTES = UNSIGNED_LONG_BYTES
 COMPRESSION_BYTES = 1
@@ -156,10 +305,110 @@ COMPRESSION_GZIP = 1
 COMPRESSION_DEFLATE = 2
 
 BLOCKS_NBT_TAG = "Blocks"
+DATA_NBT_TAG = "Data"
+HEIGHTMAP_PATH = ('Level', 'HeightMap')
+BIOMES_NBT_TAG = "Biomes"
+
+#: Biome of the columns of chunks without a Biomes array, like all McRegion
+#: chunks
+UNKNOWN_BIOME = 255
+
+#: <http://www.minecraftwiki.net/wiki/Chunk_format#Entity_format>
+ENTITY_PATHS = [('Level', 'Entities'), ('Level', 'TileEntities')]
+#: Entities have their position in Pos, tile entities in x, y and z
+ENTITY_FIELDS = ('id', 'Pos', 'y')
+
+#: <http://www.minecraftwiki.net/wiki/NBT_Format>
+TAG_BYTE_ARRAY = '\x07'
+TAG_NAME_LENGTH_FORMAT = '>H'
+TAG_LENGTH_FORMAT = '>l'
+TAG_LENGTH_BYTES = 4
+
+#: Plot modes which write text, so they don't need MatPlotlib
+TEXT_PLOT_MODES = (
+    'table', 'surface-table', 'entities-table', 'biomes-table',
+    'exposure-table', 'clusters', 'stats', 'top')
+
+#: What scan_world() computes:
+#: layers: Counts per block type and layer.
+#: chunks: Dictionary of region coordinates to counts per chunk of the first
+#: block type, see count_region_chunks().
+#: surface: Surface height histogram and dictionary of region coordinates to
+#: heights per chunk, see count_region_surface().
+#: entities: Dictionary of entity and tile entity IDs to counts per layer, and
+#: dictionary of region coordinates to counts per chunk, see
+#: count_region_entities().
+#: biomes: Dictionary of biome IDs to counts per block type and layer, see
+#: count_region_biomes().
+#: exposure: Counts per block type and layer of the enclosed and of the exposed
+#: blocks, indexed by exposure.ENCLOSED and exposure.EXPOSED, see
+#: exposure.ExposureCounter.
+#: top: Count and coordinates of the chunks or regions with the most blocks
+#: of the selected types, most first, see TopQuery.
+#: clusters: Number of clusters per size, and sizes and locations of the
+#: largest clusters, see clusters.ClusterFinder.
+#: stats: World statistics, see world_stats().
+ENGINES = (
+    'layers', 'chunks', 'surface', 'entities', 'biomes', 'exposure', 'top',
+    'clusters', 'stats')
+
+#: Engine of each plot mode
+PLOT_MODE_ENGINES = {
+    'normal': 'layers',
+    'table': 'layers',
+    'heatmap': 'layers',
+    'colormap': 'chunks',
+    'wireframe': 'chunks',
+    'surface': 'surface',
+    'surface-table': 'surface',
+    'surface-map': 'surface',
+    'entities': 'entities',
+    'entities-table': 'entities',
+    'entities-map': 'entities',
+    'biomes': 'biomes',
+    'biomes-table': 'biomes',
+    'exposure': 'exposure',
+    'exposure-table': 'exposure',
+    'top': 'top',
+    'clusters': 'clusters',
+    'stats': 'stats',
+}
 
-#: Avoid 'Broken pipe' message when canceling piped command
-if SUPPORT_SIGNALS:
-    signal(SIGPIPE, SIG_DFL)
+#: Engines which can compare two worlds, see diff_events()
+DIFF_ENGINES = ('layers', 'chunks')
+
+#: Kinds of ScanEvent
+EVENT_START = 'start'
+EVENT_PROGRESS = 'progress'
+EVENT_DONE = 'done'
+
+#: Yielded by scan_world_events().
+#: kind: EVENT_START once the chunks are known, EVENT_PROGRESS after each
+#: region file or, with several jobs, each part of the world, and EVENT_DONE
+#: at the end.
+#: step, total_steps: Region files or parts done and in total.
+#: chunks_done, total_chunks, elapsed: Chunks done and in total, and seconds
+#: since the start.
+#: region: Region coordinates of an EVENT_PROGRESS, None for a part.
+#: result: The partial result of the region or part, in the same form as the
+#: result of the engine, or the final result for EVENT_DONE. None if there
+#: is no partial result.
+ScanEvent = namedtuple('ScanEvent', [
+    'kind', 'step', 'total_steps', 'chunks_done', 'total_chunks', 'elapsed',
+    'region', 'result'])
+
+#: What the top engine ranks.
+#: size: Number of chunks or regions to keep.
+#: regions: Rank regions instead of chunks.
+#: layers: Lowest and one past the highest layer to count, or None for all.
+TopQuery = namedtuple('TopQuery', ['size', 'regions', 'layers'])
+
+#: How a scan fits in --max-memory, see plan_memory().
+#: jobs: Number of processes.
+#: parts: Number of parts of the chunk manifest for the processes, which
+#: bounds the results waiting for the main process.
+#: batch: Chunks counted at a time by each process.
+MemoryPlan = namedtuple('MemoryPlan', ['jobs', 'parts', 'batch'])
 
 
 def lookup_block_type(block_type):
@@ -171,6 +420,10 @@ def lookup_block_type(block_type):
     if you specify `-b be` you'll get the block with hex value 'be', not
     bedrock.
 
+    A data value can be appended after a colon, like `wool:14`. The result is
+    then the hex ID followed by the data value as a second character. `wool:*`
+    returns all 16 data values.
+
     @param block_type: Name or hex ID of a block type.
     @return: Hex IDs of matching blocks.
     """
@@ -179,6 +432,20 @@ def lookup_block_type(block_type):
         warnings.warn('Empty block type')
         return []
 
+    if DATA_VALUE_SEPARATOR in block_type:
+        block_type, data_value = block_type.rsplit(DATA_VALUE_SEPARATOR, 1)
+        if data_value == DATA_VALUE_WILDCARD:
+            data_values = [chr(value) for value in xrange(DATA_VALUES)]
+        elif data_value.isdigit() and int(data_value) < DATA_VALUES:
+            data_values = [chr(int(data_value))]
+        else:
+            warnings.warn('Invalid data value %s' % data_value)
+            return []
+        return [
+            block_hex + value
+            for block_hex in lookup_block_type(block_type)
+            for value in data_values]
+
     block_type = block_type.lower()
 
     if [char in HEX_DIGITS for char in block_type] == [True, True]:
@@ -197,14 +464,134 @@ def lookup_block_type(block_type):
     return result
 
 
-def print_block_types():
-    """Print the block block_names and hexadecimal IDs"""
+def lookup_block_types(block_type_names, categories=BLOCK_CATEGORIES):
+    """
+    Look up several block types.
+
+    ALL stands for all known block types, and ALL:* for all their variants.
+    @<name> stands for a category of block types, which are counted together.
+
+    @param block_type_names: Block type names or hex IDs, see
+    lookup_block_type(), or category names.
+    @param categories: Dictionary of category names to hex IDs, see
+    load_categories().
+    @return: Hex IDs and BlockCategory instances without duplicates.
+    """
+
+    block_type_hexes = []
+    for block_type_name in block_type_names:
+        if block_type_name.startswith(CATEGORY_PREFIX):
+            name = block_type_name[len(CATEGORY_PREFIX):].lower()
+            if name not in categories:
+                warnings.warn('Unknown block category %s' % name)
+            elif not categories[name]:
+                warnings.warn('Empty block category %s' % name)
+            else:
+                category = BlockCategory(name, categories[name])
+                if category not in block_type_hexes:
+                    block_type_hexes.append(category)
+            continue
+
+        if block_type_name.upper() == 'ALL':
+            # FIXME ugly: we now add names of known block, only to later convert them back to hex codes.
+            found_names = [BLOCK_TYPES[chr(i)][0] for i in xrange(0,256) if BLOCK_TYPES[chr(i)] != [UNUSED_NAME]]
+        elif block_type_name.upper() == 'ALL' + DATA_VALUE_SEPARATOR + DATA_VALUE_WILDCARD:
+            # Every data value of every known block
+            found_names = ['%02x' % i + DATA_VALUE_SEPARATOR + DATA_VALUE_WILDCARD
+                for i in xrange(0,256) if BLOCK_TYPES[chr(i)] != [UNUSED_NAME]]
+        else:
+            found_names = [block_type_name]
+
+        for found_name in found_names:
+            for found_hex in lookup_block_type(found_name):
+                if found_hex not in block_type_hexes:  # Avoid duplicates
+                    block_type_hexes.append(found_hex)
+
+    return block_type_hexes
+
+
+def load_categories(path=None):
+    """
+    Get the built-in block categories and those of a configuration file.
+
+    The file has a [categories] section with a comma-separated list of block
+    types per category, as for --blocks:
+
+    [categories]
+    valuables = gold ore, diamond ore, lapis lazuli ore
+    red wool = wool:14
+
+    Categories in the file replace built-in ones with the same name.
+
+    @param path: Configuration file path, or None for CATEGORIES_PATH if it
+    exists.
+    @return: Dictionary of category names to hex IDs.
+    @raise Usage: If the file can't be read.
+    """
+
+    categories = dict(BLOCK_CATEGORIES)
+    if path is None:
+        path = os.path.expanduser(CATEGORIES_PATH)
+        if not os.path.isfile(path):
+            return categories
+
+    config = RawConfigParser()
+    try:
+        if not config.read(path):
+            raise Usage('Can\'t read the categories file {0}'.format(path))
+        items = []
+        if config.has_section(CATEGORIES_SECTION):
+            items = config.items(CATEGORIES_SECTION)
+    except ConfigError as error:
+        raise Usage('Invalid categories file {0}: {1}'.format(path, error))
+
+    for name, block_type_names in items:
+        categories[name.lower()] = lookup_block_types(
+            [block_type_name.strip()
+                for block_type_name in block_type_names.split(',')],
+            {})
+
+    return categories
+
+
+def print_block_types(categories=BLOCK_CATEGORIES):
+    """Print the block block_names and hexadecimal IDs, and the categories"""
     for block_hex, block_names in sorted(
         BLOCK_TYPES.iteritems(),
         key=itemgetter(0)):
         if block_names != [UNUSED_NAME]:
             sys.stdout.write(hex(ord(block_hex))[2:].upper().zfill(2) + ' ')
             sys.stdout.write(', '.join(block_names) + '\n')
+    for name, block_type_hexes in sorted(categories.iteritems()):
+        sys.stdout.write(CATEGORY_PREFIX + name + ' ')
+        sys.stdout.write(', '.join(
+            block_type_name(bt_hex) for bt_hex in block_type_hexes) + '\n')
+
+
+def block_type_name(block_type_hex):
+    """
+    Get the display name of a block type.
+
+    @param block_type_hex: Hex ID, optionally followed by a data value, or a
+    BlockCategory.
+    @return: Canonical block name, with ":<data value>" if qualified, or the
+    category name.
+    """
+    if isinstance(block_type_hex, BlockCategory):
+        return CATEGORY_PREFIX + block_type_hex.name
+    name = BLOCK_TYPES[block_type_hex[0]][0]
+    if len(block_type_hex) > 1:
+        name += DATA_VALUE_SEPARATOR + str(ord(block_type_hex[1]))
+    return name
+
+
+def needs_data_values(block_type_hexes):
+    """Whether any of the block types is qualified with a data value."""
+    return any(
+        needs_data_values(block_type_hex)
+        if isinstance(block_type_hex, BlockCategory)
+        else len(block_type_hex) > 1
+        for block_type_hex in block_type_hexes)
 
 
 def compute_totals(block_counts):
@@ -214,7 +601,8 @@ def compute_totals(block_counts):
     for i, layers in enumerate(block_counts):
         counts[i] = sum(layers)
     summ = sum(counts)
-    relpercents = [(i * 100.0 / summ) for i in counts]
+    # Changes from diff can add up to nothing
+    relpercents = [(i * 100.0 / summ) if summ else 0.0 for i in counts]
 
     out = {
         'counts': counts,
@@ -223,23 +611,38 @@ def compute_totals(block_counts):
     return out
 
 
-def plot(counts, block_type_hexes, title, options):
+def plot(counts, names, title, options, browser=None):
     """
     Actual plotting of data.
 
     @param counts: Integer counts per layer.
-    @param block_type_hexes: Subset of BLOCK_TYPES.keys().
+    @param names: Label of each row of counts.
+    @param browser: ChunkBrowser to show the layers of a chunk clicked in the
+    colormap plot mode, or None.
     """
     o = options
-    if o.save_path:
-        mpl.use('Agg')
-
-    import matplotlib.pyplot as plt
-
-    if o.plot_mode == 'normal':
-        labels = ['' for i in counts]
-        for i in range(len(counts)):
-            labels[i] = BLOCK_TYPES[block_type_hexes[i]][0]
+    plot_mode = PLOT_MODE_STYLES.get(o.plot_mode, o.plot_mode)
+    label_x = LABEL_X
+    if o.depth:
+        label_x = LABEL_X_DEPTH
+    if o.plot_mode not in TEXT_PLOT_MODES:
+        # Only imported when plotting, so that scanning works without it
+        try:
+            import matplotlib as mpl
+            if o.save_path:
+                mpl.use('Agg')
+            import matplotlib.pyplot as plt
+            from matplotlib import cm
+            from matplotlib.collections import LineCollection
+            from mpl_toolkits.mplot3d import Axes3D
+        except ImportError:
+            raise Usage('The {0} plot mode requires MatPlotlib. See '\
+                'http://matplotlib.sourceforge.net/users/installing.html.'.format(
+                    o.plot_mode))
+
+    if plot_mode == 'normal' or plot_mode == 'heatmap':
+        counts = np.asarray(counts)
+        labels = list(names)
 
         # reformat labels with computed totals + relpercents
         if o.totals:
@@ -255,43 +658,123 @@ def plot(counts, block_type_hexes, title, options):
 
         fig = plt.figure()
         fig.canvas.set_window_title(title)
+        ax = fig.add_subplot(111)
+
+    if plot_mode == 'normal':
+        # One artist for all the lines, so that hundreds of block types
+        # don't mean hundreds of artists to draw and pick from
+        layers = np.arange(counts.shape[1])
+        colors = mpl.colors.to_rgba_array(
+            [style['color'] for style in mpl.rcParams['axes.prop_cycle']])
+        colors = colors[np.arange(len(counts)) % len(colors)]
+        lines = LineCollection(
+            [np.column_stack((layers, block_counts))
+                for block_counts in counts],
+            colors=colors,
+            linewidths=1,
+            picker=3,
+            animated=o.save_path is None)
+        ax.add_collection(lines)
 
         if o.log:
-            for index, block_counts in enumerate(counts):
-                plt.semilogy(
-                    block_counts,
-                    label=labels[index],
-                    linewidth=1,
-                    nonposy='clip',
-                    picker=3)
-        else:
-            for index, block_counts in enumerate(counts):
-                plt.plot(
-                    block_counts,
-                    label=labels[index],
-                    linewidth=1,
-                    picker=3)
+            ax.set_yscale('log', nonposy='clip')
+            ax.set_ylim(max(counts.min(), 1), max(counts.max(), 10))
+        ax.autoscale_view(scaley=not o.log)
 
-        def on_pick(pickevent):
-            thisline = pickevent.artist
-            print "Toggeling", thisline.get_label()
-            if thisline.get_alpha() == None or thisline.get_alpha() == 1:
-                thisline.set_alpha(0.3)
-            else:
-                thisline.set_alpha(1)
+        # Only the lines are redrawn when toggling, on top of a copy of
+        # everything else
+        background = [None]
 
-            fig.canvas.draw()
+        def blit_lines():
+            fig.canvas.restore_region(background[0])
+            ax.draw_artist(lines)
+            fig.canvas.blit(ax.bbox)
 
-        fig.canvas.mpl_connect('pick_event', on_pick)
+        def on_draw(drawevent):
+            background[0] = fig.canvas.copy_from_bbox(ax.bbox)
+            blit_lines()
 
-        plt.legend(prop={'size': 10, 'family': 'monospace'})
-        plt.xlabel(LABEL_X)
-        plt.ylabel(LABEL_Y)
+        def on_pick(pickevent):
+            if pickevent.artist is not lines:
+                return
+            for index in pickevent.ind:
+                print "Toggeling", labels[index]
+                if colors[index, 3] == 1:
+                    colors[index, 3] = 0.3
+                else:
+                    colors[index, 3] = 1
+            lines.set_color(colors)
+
+            blit_lines()
+
+        if o.save_path is None:
+            fig.canvas.mpl_connect('draw_event', on_draw)
+            fig.canvas.mpl_connect('pick_event', on_pick)
+
+        legend_rows = range(len(counts))
+        if len(counts) > MAX_LEGEND_ROWS:
+            # A legend of every block type would be taller than the plot
+            legend_rows = np.argsort(
+                -counts.sum(axis=1), kind='mergesort')[:MAX_LEGEND_ROWS]
+        handles = [
+            mpl.lines.Line2D([], [], color=colors[index], linewidth=1)
+            for index in legend_rows]
+        legend = ax.legend(
+            handles, [labels[index] for index in legend_rows],
+            prop={'size': 10, 'family': 'monospace'})
+        if len(counts) > MAX_LEGEND_ROWS:
+            legend.set_title(
+                '{0} most common of {1}, see -p heatmap for all'.format(
+                    MAX_LEGEND_ROWS, len(counts)))
+        ax.set_xlabel(label_x)
+        ax.set_ylabel(LABEL_Y)
         if o.xticks:
-            plt.xticks(np.arange(0, CHUNK_SIZE_Y + 1, o.xticks))
+            ax.set_xticks(np.arange(0, CHUNK_SIZE_Y + 1, o.xticks))
+
+    elif plot_mode == 'heatmap':
+        # Most common blocks on top
+        order = np.argsort(-counts.sum(axis=1), kind='mergesort')
+        matrix = np.ma.masked_equal(counts[order], 0)
+
+        norm = None
+        if matrix.count():
+            norm = mpl.colors.LogNorm()
+        image = ax.imshow(
+            matrix,
+            aspect='auto',
+            interpolation='nearest',
+            cmap=cm.jet,
+            norm=norm)
+        fig.colorbar(image, label=LABEL_Y)
+
+        ax.set_yticks(np.arange(len(order)))
+        ax.set_yticklabels(
+            [labels[index] for index in order],
+            size=max(4, min(10, 600 / len(order))),
+            family='monospace')
+        ax.set_xlabel(label_x)
+        ax.set_title(title)
+        if o.xticks:
+            ax.set_xticks(np.arange(0, CHUNK_SIZE_Y + 1, o.xticks))
+
+        def heatmap_formatter(x, y):
+            row = int(round(y))
+            layer = int(round(x))
+            if not (0 <= row < len(order) and 0 <= layer < counts.shape[1]):
+                return ''
+            return '%s, %s %d: %d' % (
+                names[order[row]],
+                label_x,
+                layer,
+                counts[order[row], layer])
+
+        ax.format_coord = heatmap_formatter
+        # Make room for the block names
+        fig.tight_layout()
 
-    elif o.plot_mode == 'colormap' or o.plot_mode == 'wireframe':
-        X, Z, min_chunk_x, min_chunk_z, max_chunk_x, max_chunk_z, Data = counts
+    elif plot_mode == 'colormap' or plot_mode == 'wireframe':
+        # Only regions which exist are in the grid, see count_region_chunks()
+        grid = counts
 
         # North is -Z since Minecraft-1.0 (actually, MinecraftBeta-1.9pre4)
         lbl_x = 'X axis (towards East)'
@@ -301,35 +784,137 @@ def plot(counts, block_type_hexes, title, options):
         def coords_formatter(x):
             return '%d' % np.floor(x)
 
-        if o.plot_mode == 'colormap':
-            im = plt.imshow(Data,
-                cmap=cm.jet,
-                extent=(min_chunk_x, max_chunk_x, max_chunk_z, min_chunk_z))
-            # Don't use interpolation, chunk as pixels
-            im.set_interpolation('nearest')
-            plt.colorbar()
-            lbl_units = 'blocks'
+        fig = plt.figure()
+        fig.canvas.set_window_title(title)
 
-        elif o.plot_mode == 'wireframe':
-            fig = plt.figure()
+        if o.old_world_dir is not None:
+            # NaN where neither world has a chunk
+            grid = dict(
+                (region, np.ma.masked_invalid(tile))
+                for region, tile in grid.iteritems())
+        else:
+            grid = dict(
+                (region, np.ma.masked_less(tile, 0))
+                for region, tile in grid.iteritems())
+
+        # Chunks per cell and per tile side
+        factor = 1
+        span = REGION_SIZE
+        if o.max_cells:
+            factor = pool_factor(len(grid) * REGION_SIZE ** 2, o.max_cells)
+        if factor > 1:
+            grid, span = pool_grid(grid, factor, o.pool)
+            print "Reduced %d regions to %d cells, each the %s of %dx%d chunks" % (
+                len(counts), sum(tile.size for tile in grid.itervalues()),
+                o.pool, factor, factor)
+
+        limit = max([1] + [
+            np.abs(tile).max() for tile in grid.itervalues() if tile.count()])
+        if o.old_world_dir is not None:
+            # Diverging around no change
+            norm = mpl.colors.Normalize(-limit, limit)
+            cmap = cm.RdBu_r
+        else:
+            norm = mpl.colors.Normalize(0, limit)
+            cmap = cm.jet
+
+        if plot_mode == 'colormap':
+            ax = fig.add_subplot(111)
+            images = []
+            tile_blocks = span * CHUNK_SIZE_Z
+            for (tile_x, tile_z), tile in grid.iteritems():
+                min_block_x = tile_x * tile_blocks
+                min_block_z = tile_z * tile_blocks
+                images.append(ax.imshow(
+                    tile,
+                    cmap=cmap,
+                    norm=norm,
+                    # Don't use interpolation, chunk as pixels
+                    interpolation='nearest',
+                    extent=(
+                        min_block_x, min_block_x + tile_blocks,
+                        min_block_z + tile_blocks, min_block_z)))
+            fig.colorbar(images[0], ax=ax)
+            lbl_units = 'blocks'
+            scale = tile_blocks
+
+            def on_click(mouseevent):
+                # Not while zooming or panning
+                if mouseevent.inaxes is not ax or mouseevent.button != 1 \
+                    or (fig.canvas.toolbar is not None
+                        and fig.canvas.toolbar.mode):
+                    return
+                chunk_xz = (
+                    int(np.floor(mouseevent.xdata / CHUNK_SIZE_Z)),
+                    int(np.floor(mouseevent.ydata / CHUNK_SIZE_Z)))
+                chunk_counts = browser.chunk_counts(chunk_xz)
+                if chunk_counts is None:
+                    print "No chunk at %d, %d" % chunk_xz
+                    return
+
+                chunk_fig = plt.figure()
+                chunk_title = 'Chunk %d, %d' % chunk_xz
+                chunk_fig.canvas.set_window_title(chunk_title)
+                chunk_ax = chunk_fig.add_subplot(111)
+                for name, layer_counts in zip(names, chunk_counts):
+                    chunk_ax.plot(layer_counts, label=name)
+                chunk_ax.legend(prop={'size': 10, 'family': 'monospace'})
+                chunk_ax.set_xlabel(label_x)
+                chunk_ax.set_ylabel(LABEL_Y)
+                chunk_ax.set_title(chunk_title)
+                chunk_fig.show()
+
+                # Read the neighbors once the chunk is shown, so that
+                # clicking around doesn't wait for them
+                timer = chunk_fig.canvas.new_timer(interval=10)
+                timer.single_shot = True
+                timer.add_callback(browser.prefetch, chunk_xz)
+                timer.start()
+
+            if browser is not None and o.save_path is None:
+                fig.canvas.mpl_connect('button_press_event', on_click)
+
+        elif plot_mode == 'wireframe':
             ax = Axes3D(fig)
-            ax.plot_wireframe(X, Z, Data, rstride=1, cstride=1)
+            for (tile_x, tile_z), tile in grid.iteritems():
+                X, Z = np.meshgrid(
+                    np.arange(tile.shape[1]) * factor + tile_x * span,
+                    np.arange(tile.shape[0]) * factor + tile_z * span)
+                # To properly show zones without chunks
+                ax.plot_wireframe(
+                    X, Z, tile.filled(-10 if o.old_world_dir is None else 0),
+                    rstride=1, cstride=1)
             lbl_units = 'chunks'
+            scale = span
 
-        plt.xlabel(lbl_x + ', ' + lbl_units)
-        plt.ylabel(lbl_y + ', ' + lbl_units)
-        plt.title(title)
+        regions = np.array(grid.keys())
+        ax.set_xlim(
+            regions[:, 0].min() * scale, (regions[:, 0].max() + 1) * scale)
+        ax.set_ylim(
+            (regions[:, 1].max() + 1) * scale, regions[:, 1].min() * scale)
+
+        ax.set_xlabel(lbl_x + ', ' + lbl_units)
+        ax.set_ylabel(lbl_y + ', ' + lbl_units)
+        ax.set_title(title)
 
         # use custom formatter for mouse hover
-        ax = plt.subplot(111)
         ax.fmt_xdata = coords_formatter
         ax.fmt_ydata = coords_formatter
 
-    if o.plot_mode == 'table':
-        output = "Block\t" + "\t".join([str(i) for i in xrange(128)]) + "\n"
-        for index, block_counts in enumerate(counts):
-            output += BLOCK_TYPES[block_type_hexes[index]][0] + "\t"
-            output += "\t".join([str(i) for i in block_counts]) + "\n"
+    if plot_mode in ('table', 'clusters', 'stats', 'top'):
+        if plot_mode == 'clusters':
+            output = cluster_report(*counts)
+        elif plot_mode == 'top':
+            output = top_report(counts, o.top_regions, o.json)
+        elif plot_mode == 'stats':
+            output = ''.join('%s\t%s\n' % row for row in counts)
+        else:
+            layers = len(counts[0]) if len(counts) else CHUNK_SIZE_Y
+            output = "Block\t" + "\t".join(
+                [str(i) for i in xrange(layers)]) + "\n"
+            for index, block_counts in enumerate(counts):
+                output += names[index] + "\t"
+                output += "\t".join([str(i) for i in block_counts]) + "\n"
         if o.save_path == None:
             sys.stdout.write(output)
         else:
@@ -345,6 +930,115 @@ def plot(counts, block_type_hexes, title, options):
         plt.savefig(o.save_path, dpi = o.dpi)
 
 
+def cluster_report(size_counts, largest):
+    """
+    Text report of the clusters plot mode.
+
+    @param size_counts: Dictionary of cluster sizes to numbers of clusters.
+    @param largest: Sizes and (X, Y, Z) coordinates of a block of the largest
+    clusters in decreasing size order.
+    @return: Tab separated number of clusters per size, followed by the
+    largest clusters.
+    """
+
+    output = "Size\tClusters\n"
+    for size in sorted(size_counts):
+        output += "%d\t%d\n" % (size, size_counts[size])
+
+    output += "\nSize\tX\tY\tZ\n"
+    for size, location in largest:
+        output += "%d\t%d\t%d\t%d\n" % ((size,) + tuple(location))
+
+    return output
+
+
+def pool_factor(cells, max_cells):
+    """
+    Chunks per side of the cells of a reduced colormap or wireframe.
+
+    >>> pool_factor(4 * 1024, 1024)
+    2
+    >>> pool_factor(1000, 1024)
+    1
+
+    @param cells: Number of chunk cells.
+    @param max_cells: Most cells to draw.
+    @return: Smallest power of two, which reduces cells to at most max_cells
+    when pooling factor x factor cells into one.
+    """
+
+    factor = 1
+    while cells > max_cells * factor ** 2:
+        factor *= 2
+    return factor
+
+
+def pool_grid(grid, factor, method='sum'):
+    """
+    Reduce the chunk grid of the colormap and wireframe plot modes.
+
+    @param grid: Dictionary of region coordinates to REGION_SIZE x REGION_SIZE
+    masked arrays, masked where there is no chunk.
+    @param factor: Chunks per side of each reduced cell, a power of two.
+    @param method: 'sum' or 'max' of the chunks in each cell.
+    @return: Dictionary of tile coordinates to masked arrays of the reduced
+    cells, and the number of chunks per tile side. A tile is a region, or
+    for factors above REGION_SIZE a single cell covering several regions.
+    Cells without chunks are masked.
+    """
+
+    region_factor = min(factor, REGION_SIZE)
+    region_cells = REGION_SIZE / region_factor
+    span = max(factor, REGION_SIZE)
+    regions_per_tile = span / REGION_SIZE
+
+    tiles = {}
+    for (region_x, region_z), tile in grid.iteritems():
+        cells = tile.reshape(
+            region_cells, region_factor, region_cells, region_factor)
+        tiles.setdefault(
+            (region_x // regions_per_tile, region_z // regions_per_tile),
+            []).append(getattr(cells, method)(axis=(1, 3)))
+
+    return dict(
+        (tile, getattr(np.ma.stack(parts), method)(axis=0))
+        for tile, parts in tiles.iteritems()), span
+
+
+def top_report(top, regions=False, as_json=False):
+    """
+    Text report of the top command.
+
+    @param top: Result of the top engine.
+    @param regions: Whether the coordinates are of regions.
+    @param as_json: JSON list of objects instead of tab separated rows.
+    """
+
+    if regions:
+        keys = ('region_x', 'region_z')
+        labels = ('Region X', 'Region Z')
+    else:
+        keys = ('chunk_x', 'chunk_z', 'block_x', 'block_z')
+        labels = ('Chunk X', 'Chunk Z', 'Block X', 'Block Z')
+
+    rows = []
+    for count, (x, z) in top:
+        row = OrderedDict([('count', count), (keys[0], x), (keys[1], z)])
+        if not regions:
+            # The north west corner
+            row['block_x'] = x * CHUNK_SIZE_Z
+            row['block_z'] = z * CHUNK_SIZE_Z
+        rows.append(row)
+
+    if as_json:
+        return json.dumps(rows, indent=2) + "\n"
+
+    output = "Rank\tCount\t" + "\t".join(labels) + "\n"
+    for rank, row in enumerate(rows, 1):
+        output += "%d\t%s\n" % (rank, "\t".join(str(i) for i in row.values()))
+    return output
+
+
 def mian(world_dir, block_type_hexes, options):
     """
     Runs through the MCR files and gets the layer counts for the plot.
@@ -358,324 +1052,2513 @@ def mian(world_dir, block_type_hexes, options):
 
     # apply dimensions magic :)
     title += DIMENSIONS[o.dimension]['title']
-    path_mcr = DIMENSIONS[o.dimension]['path_mcr']
-    worldfmt = DIMENSIONS[o.dimension]['worldfmt_craftbukkit']
+    world_dir, mcr_files = find_region_files(world_dir, o.dimension)
+
+    if o.plot_mode in ('colormap', 'wireframe', 'tiles'):
+        title += ' - map for block {0}'.format(
+            block_type_name(block_type_hexes[0]))
+    elif o.plot_mode == 'surface-map':
+        title += ' - {0} surface height map'.format(o.surface_stat)
+    elif o.plot_mode == 'entities-map':
+        title += ' - map of {0}'.format(
+            ','.join(o.entity_ids) if o.entity_ids else 'all entities')
+
+    if o.old_world_dir is not None:
+        title = os.path.basename(o.old_world_dir.rstrip(os.path.sep)) + \
+            ' to ' + title
+    title += ' - mian %s' % __version__
+
+    if o.old_world_dir is not None:
+        old_files = find_region_files(o.old_world_dir, o.dimension)[1]
+        regions = set(old_files.coordinates()).union(mcr_files.coordinates())
+        total_counts = report_events(
+            diff_events(old_files, mcr_files, block_type_hexes,
+                PLOT_MODE_ENGINES[o.plot_mode], o.depth),
+            len(regions))
+        names = [block_type_name(bt_hex) for bt_hex in block_type_hexes]
+        plot(total_counts, names, title, options)
+        return
+
+    if o.plot_mode == 'tiles':
+        generate_tiles(mcr_files, block_type_hexes[0], o.save_path, o.jobs)
+        return
+
+    max_memory = None
+    if o.max_memory:
+        max_memory = o.max_memory * MEBIBYTE
+
+    chunk_cache = None
+    if o.chunk_cache:
+        cache_bytes = None
+        if max_memory is not None:
+            cache_bytes = max_memory / CHUNK_CACHE_SHARE
+            max_memory -= cache_bytes
+        chunk_cache = LRUCache(o.chunk_cache, cache_bytes)
+
+    points = None
+    if o.points_path:
+        points = PointWriter(o.points_path, block_type_hexes)
+
+    checkpoint = None
+    if o.checkpoint_path:
+        checkpoint = Checkpoint(o.checkpoint_path, o.checkpoint_interval)
+
+    browser = None
+    if o.plot_mode == 'colormap' and o.save_path is None:
+        browse_memory = o.browse_memory * MEBIBYTE
+        if o.max_memory:
+            browse_memory = min(browse_memory, o.max_memory * MEBIBYTE)
+        browser = ChunkBrowser(mcr_files, block_type_hexes, browse_memory)
+
+    try:
+        total_counts = generate_graph_data(world_dir,
+                        mcr_files, block_type_hexes, o.plot_mode, chunk_cache,
+                        o.surface_stat, o.depth, points, o.jobs, checkpoint,
+                        o.since, o.until, o.entity_ids, o.top, max_memory)
+    finally:
+        if points is not None:
+            points.close()
+            print "Exported %d points to %s" % (points.length, o.points_path)
+
+    if o.plot_mode in ('surface', 'surface-table'):
+        names = [SURFACE_NAME]
+    elif o.plot_mode in ('entities', 'entities-table'):
+        names, total_counts = entity_rows(total_counts)
+    elif o.plot_mode in ('biomes', 'biomes-table'):
+        names, total_counts = biome_rows(total_counts, block_type_hexes)
+    elif o.plot_mode in ('exposure', 'exposure-table'):
+        names = []
+        for bt_hex in block_type_hexes:
+            names.append(block_type_name(bt_hex) + ' exposed')
+            names.append(block_type_name(bt_hex) + ' enclosed')
+        # Interleaved like the names
+        total_counts = np.column_stack((
+            total_counts[exposure.EXPOSED],
+            total_counts[exposure.ENCLOSED])).reshape(-1, CHUNK_SIZE_Y)
+    else:
+        names = [block_type_name(bt_hex) for bt_hex in block_type_hexes]
+
+    plot(total_counts, names, title, options, browser)
+
+
+def find_region_files(world_dir, dimension='overworld'):
+    """
+    Find the region files of a world.
+
+    @param world_dir: Path to existing Minecraft world directory.
+    @param dimension: Key of DIMENSIONS.
+    @return: World directory, which can differ for CraftBukkit worlds, and
+    catalog.RegionCatalog of the region files.
+    """
+
+    path_mcr = DIMENSIONS[dimension]['path_mcr']
+    worldfmt = DIMENSIONS[dimension]['worldfmt_craftbukkit']
+    if storage.is_archive(world_dir) \
+        and not storage.isdir(os.path.join(world_dir, path_mcr)):
+        # Backups usually contain the world directory rather than its contents
+        found = storage.glob(os.path.join(world_dir, '*', path_mcr, '*.mcr'))
+        if found:
+            world_dir = os.path.join(world_dir, os.path.relpath(
+                found[0], world_dir).split(os.path.sep)[0])
     # CraftBukkit uses this world-dimension layout:
     #   world/region
     #   world_nether/DIM-1/region
     #   world_the_end/DIM1/region
     # WARNING: 20120203 winex: world_dir could be modified here
-    if worldfmt and not os.path.isdir(os.path.join(world_dir, path_mcr)):
+    if worldfmt and not storage.isdir(os.path.join(world_dir, path_mcr)):
         world_dir = worldfmt.format(world_dir.rstrip(os.path.sep))
 
     # All world blocks are stored in .mcr files
-    mcr_files = glob(os.path.join(world_dir, path_mcr, '*.mcr'))
-
-    if o.plot_mode == 'colormap' or o.plot_mode == 'wireframe':
-        title += ' - map for block {0}'.format(
-            BLOCK_TYPES[block_type_hexes[0]][0])
-
-    title += ' - mian %s' % __version__
-
-    if not mcr_files:
+    mcr_files = catalog.read_catalog(os.path.join(world_dir, path_mcr))
+    if not len(mcr_files):
         raise Usage('Invalid savegame path.')
 
-    total_counts = generate_graph_data(world_dir,
-                    mcr_files, block_type_hexes, o.plot_mode)
+    return world_dir, mcr_files
 
-    plot(total_counts, block_type_hexes, title, options)
 
+def scan_world(world_dir, dimension='overworld', block_types=None,
+    engine='layers', jobs=None, chunk_cache=None, surface_stat='mean',
+    depth=False, points=None, checkpoint=None, since=None, until=None,
+    entity_ids=None, top=None, max_memory=None):
+    """
+    Analyze a world without any output.
 
-def generate_graph_data(world_dir, mcr_files, block_type_hexes, plot_mode):
-    if plot_mode == 'normal' or plot_mode == 'table':
-        print "There are %s regions in the savegame directory" % len(mcr_files)
+    @param world_dir: Path to existing Minecraft world directory.
+    @param dimension: Key of DIMENSIONS.
+    @param block_types: Block type names as for --blocks, as a list or a
+    comma-separated string, or None for DEFAULT_BLOCK_TYPES.
+    @param engine: One of ENGINES.
+    @param jobs: Number of processes for the layers engine, None or 1 to
+    count in this process.
+    @param chunk_cache: LRUCache, or None.
+    @param surface_stat: Height per chunk of the surface engine, mean or max.
+    @param depth: Count per depth below the surface in the layers engine.
+    @param points: PointWriter for the layers engine, or None.
+    @param checkpoint: Checkpoint to resume from and save to, or None.
+    @param since: Only read chunks saved at or after this Unix time, or None.
+    @param until: Only read chunks saved before this Unix time, or None.
+    @param entity_ids: Entity and tile entity IDs counted by the entities
+    engine, or None for all.
+    @param top: TopQuery of the top engine, or None for the 10 chunks with
+    the most blocks.
+    @param max_memory: Bytes which the scan should fit in, or None for no
+    limit. Fewer processes and smaller batches are used to fit, see
+    plan_memory().
+    @return: Result of the engine, see ENGINES.
+    """
 
-        # Create total_counts list and write a list of 128 zeros on it for
-        # every scanned block.
-        total_counts = [[] for i in xrange(len(block_type_hexes))]
-        for block_type_index in range(len(block_type_hexes)):
-            for layer in range(128):
-                total_counts[block_type_index].append(int(0))
+    for event in scan_world_events(
+        world_dir, dimension, block_types, engine, jobs, chunk_cache,
+        surface_stat, depth, points, checkpoint, since, until, entity_ids,
+        top, max_memory):
+        pass
 
-        total_mcr_files = len(mcr_files)
-        file_counter = 1
+    return event.result
 
-        for mcr_file in mcr_files:
 
-            print "Reading %# 5u / %u" % (file_counter, total_mcr_files)
+def scan_world_events(world_dir, dimension='overworld', block_types=None,
+    engine='layers', jobs=None, chunk_cache=None, surface_stat='mean',
+    depth=False, points=None, checkpoint=None, since=None, until=None,
+    entity_ids=None, top=None, max_memory=None):
+    """
+    Analyze a world step by step, see scan_world().
 
-            region_blocks = extract_region_blocks(mcr_file)
-            counts = count_blocks(region_blocks, block_type_hexes)
+    @return: Generator of ScanEvent.
+    """
 
-            # Sum up the results
-            for block_type_index in range(len(block_type_hexes)):
-                for layer in range(128):
-                    total_counts[block_type_index][layer] += \
-                        counts[block_type_index][layer]
+    if engine not in ENGINES:
+        raise Usage('The engine \'{0}\' is not recognized'.format(engine))
 
-            file_counter += 1
+    if isinstance(block_types, basestring):
+        block_types = block_types.split(',')
+    block_type_hexes = lookup_block_types(
+        block_types or DEFAULT_BLOCK_TYPES, load_categories())
+    if not block_type_hexes:
+        raise Usage('No proper blocks given!')
 
-        if total_counts == [[] for i in xrange(len(block_type_hexes))]:
-            raise Usage('No blocks were recognized.')
+    mcr_files = find_region_files(world_dir, dimension)[1]
 
-        print "Done!"
+    return scan_events(
+        mcr_files, block_type_hexes, engine, chunk_cache, surface_stat, depth,
+        points, jobs, checkpoint, since, until, entity_ids, top, max_memory)
 
-        return total_counts
 
-    elif plot_mode == 'colormap' or plot_mode == 'wireframe':
+def scan_events(mcr_files, block_type_hexes, engine, chunk_cache=None,
+    surface_stat='mean', depth=False, points=None, jobs=None, checkpoint=None,
+    since=None, until=None, entity_ids=None, top=None, max_memory=None):
+    """
+    Analyze some region files step by step.
+
+    @param mcr_files: Region file paths or catalog.RegionCatalog.
+    @param block_type_hexes: Subset of BLOCK_TYPES.keys(), optionally
+    followed by data values.
+    @param checkpoint: Checkpoint to resume from and save to, or None.
+    @param since: Only read chunks saved at or after this Unix time, or None.
+    @param until: Only read chunks saved before this Unix time, or None.
+    @return: Generator of ScanEvent, see scan_world() for the rest. With a
+    checkpoint, the progress only covers the work left.
+    """
 
-        # Find the maximun and minimun region coordinates
-        min_x = 0
-        min_z = 0
-        max_x = 0
-        max_z = 0
-
-        for mcr_file in mcr_files:
-            region_x, region_z = get_region_coords(mcr_file)
-            min_x = min(min_x, region_x)
-            min_z = min(min_z, region_z)
-            max_x = max(max_x, region_x)
-            max_z = max(max_z, region_z)
-
-        # Find the chunk coordinates of these region coordinates
-        min_chunk_x = min_x * 32
-        min_chunk_z = min_z * 32
-        max_chunk_x = max_x * 32 + 31
-        max_chunk_z = max_z * 32 + 31
-
-        # Find the block coordinates of these chunk coordinates
-        min_block_x = min_chunk_x * 16
-        min_block_z = min_chunk_z * 16
-        max_block_x = max_chunk_x * 16 + 15
-        max_block_z = max_chunk_z * 16 + 15
-
-        # Generate a grid for the graph using numpy
-        X = np.arange(min_chunk_x, max_chunk_x + 1)
-        Z = np.arange(min_chunk_z, max_chunk_z + 1)
-        X, Z = np.meshgrid(X, Z)
-
-        # Generate data
-        Data = np.zeros((X.shape[0]-1, X.shape[1]-1))
-
-        total_chunks = X.shape[0] * X.shape[1]
-        progress = 1
-        print "Scanning chunks... "
-
-        for index_x in xrange(abs(min_chunk_x) + abs(max_chunk_x)):
-            for index_z in xrange(abs(min_chunk_z) + abs(max_chunk_z)):
-
-                # be careful with the index in the np.array!
-                counts = count_chunk_blocks(world_dir,
-                    (X[index_z][index_x], Z[index_z][index_x]),
-                     block_type_hexes[0])
-                if counts < 0:
-                    # To properly show zones without chunks
-                    Data[index_z][index_x] = -10
+    start_time = time.time()
+    if engine == 'top':
+        if top is None:
+            top = TopQuery(10, False, None)
+        selection = block_type_mask(block_type_hexes)
+    windowed = since is not None or until is not None
+    if engine == 'stats':
+        # Nothing worth resuming
+        checkpoint = None
+
+    mcr_files = catalog.from_paths(mcr_files)
+    if since is not None:
+        # Files last written before the window have no chunks in it
+        mcr_files = mcr_files.select(mcr_files.regions['mtime'] >= since)
+
+    # The region headers tell how much work there is up front
+    manifest = read_chunk_manifest(mcr_files)
+    if windowed:
+        # Chunks without a timestamp are outside any window
+        timestamps = manifest['timestamp']
+        in_window = timestamps > 0
+        if since is not None:
+            in_window &= timestamps >= since
+        if until is not None:
+            in_window &= timestamps < until
+        manifest = manifest[in_window]
+    keys = manifest_keys(manifest)
+
+    histogram_bytes = 0
+    if engine in ('layers', 'biomes', 'exposure'):
+        histogram_bytes = np.prod(histogram_shape(
+            needs_data_values(block_type_hexes),
+            block_group_table(block_type_hexes))) * np.dtype(np.int64).itemsize
+    plan = plan_memory(
+        manifest, max_memory, jobs if engine in PARALLEL_ENGINES else None,
+        histogram_bytes, needs_data_values(block_type_hexes))
+    parallel = plan.jobs > 1
+
+    # Chunks already counted and everything the counts depend on
+    state = {}
+    done_keys = []
+    signatures = {}
+    if checkpoint is not None:
+        arguments = (engine, tuple(block_type_hexes), surface_stat, depth,
+            parallel, since, until,
+            None if entity_ids is None else tuple(entity_ids), top)
+        signatures = mcr_files.signatures()
+        saved = checkpoint.load(arguments)
+        if saved is not None:
+            for region, signature in saved['signatures'].iteritems():
+                if signatures.get(region) != signature:
+                    raise Usage('Region {0} changed since the checkpoint '\
+                        '{1} was saved.'.format(region, checkpoint.path))
+            state = saved['state']
+            done_keys = [saved['done']]
+            done = np.in1d(keys, saved['done'])
+            checkpoint.resumed = int(done.sum())
+            manifest = manifest[~done]
+            keys = keys[~done]
+
+    region_chunks = np.bincount(manifest['file'], minlength=len(mcr_files))
+    todo_files = [
+        file_index for file_index in xrange(len(mcr_files))
+        if region_chunks[file_index] or not (done_keys or windowed)]
+    total_chunks = len(manifest)
+    chunks_done = 0
+    file_chunks = dict(split_by_file(manifest))
+
+    def save_checkpoint(force=False):
+        """Save the state if it is time to."""
+        if checkpoint is not None and (force or checkpoint.due()):
+            done = np.concatenate(done_keys) if done_keys else keys[:0]
+            done_regions = set(np.unique(
+                done // (REGION_SIZE * REGION_SIZE)).tolist())
+            checkpoint.save(arguments, dict(
+                (region, signature)
+                for region, signature in signatures.iteritems()
+                if region_key(region) in done_regions), done, state)
+
+    yield ScanEvent(
+        EVENT_START, 0, len(todo_files), 0, total_chunks,
+        time.time() - start_time, None, None)
+
+    if windowed and not total_chunks:
+        raise Usage('No chunks were saved in the time window.')
+
+    if engine == 'top':
+        # The best chunks so far, and the totals of the few regions
+        state.setdefault('chunks', TopList(top.size))
+        state.setdefault('regions', {})
+
+    if engine == 'stats':
+        result = world_stats(manifest, mcr_files)
+
+    elif parallel:
+        data_values = needs_data_values(block_type_hexes)
+        groups = block_group_table(block_type_hexes)
+
+        # Split by compressed size rather than by region file, since
+        # regions can hold anything from one to 1024 chunks
+        parts = split_chunk_manifest(manifest, plan.parts)
+        files = [
+            dict((file_index, mcr_files[file_index])
+                for file_index in np.unique(part['file']).tolist())
+            for part in parts]
+        if engine == 'top':
+            worker = rank_manifest_chunks
+            pool_jobs = [
+                (part_files, part, selection, top.layers, top.size)
+                for part_files, part in zip(files, parts)]
+        else:
+            worker = count_manifest_chunks
+            pool_jobs = [
+                (part_files, part, data_values, depth, groups, plan.batch)
+                for part_files, part in zip(files, parts)]
+        # Parts are handed out one per process, so that stopping early only
+        # waits for the parts being counted
+        pool = Pool(plan.jobs, ignore_interrupts)
+        pending = deque()
+        pool_jobs = iter(pool_jobs)
+        try:
+            for step in xrange(1, len(parts) + 1):
+                while len(pending) < plan.jobs:
+                    job = next(pool_jobs, None)
+                    if job is None:
+                        break
+                    pending.append(pool.apply_async(worker, (job,)))
+                part_result = pending.popleft()
+                while not part_result.ready():
+                    # Waiting without a timeout can't be interrupted
+                    part_result.wait(POOL_POLL_SECONDS)
+                part_result = part_result.get()
+                part = part_result[-1]
+                if engine == 'top':
+                    part_chunks, part_regions = part_result[:2]
+                    state['chunks'].update(part_chunks)
+                    for region, count in part_regions.iteritems():
+                        state['regions'][region] = \
+                            state['regions'].get(region, 0) + count
+                    partial = part_chunks.items()
+                else:
+                    part_histogram = part_result[0]
+                    if 'histogram' not in state:
+                        state['histogram'] = part_histogram.copy()
+                    else:
+                        state['histogram'] += part_histogram
+                    partial = select_counts(
+                        part_histogram, block_type_hexes, groups)
+                chunks_done += len(part)
+                done_keys.append(manifest_keys(part))
+                save_checkpoint()
+                yield ScanEvent(
+                    EVENT_PROGRESS, step, len(parts), chunks_done, total_chunks,
+                    time.time() - start_time, None, partial)
+        finally:
+            # Terminating while a worker is sending a result deadlocks on
+            # Python 2.7, so the parts being counted are waited for first
+            for result in pending:
+                while not result.ready():
+                    result.wait(POOL_POLL_SECONDS)
+            pool.terminate()
+            pool.join()
 
+    else:
+        if engine in ('layers', 'biomes', 'exposure'):
+            data_values = needs_data_values(block_type_hexes)
+            groups = block_group_table(block_type_hexes)
+        if engine == 'biomes':
+            state.setdefault('histogram', {})
+        elif engine == 'exposure':
+            state.setdefault('counter', exposure.ExposureCounter(
+                histogram_shape(data_values, groups)))
+            selection = block_type_mask(block_type_hexes)
+            # Row by row, so that only about one row of regions of chunk
+            # sides is waiting for neighbors
+            todo_files.sort(
+                key=lambda file_index: mcr_files.coords(file_index)[::-1])
+        elif engine == 'chunks':
+            # Memory and time depend on the existing regions only, not on
+            # the area between them
+            state.setdefault('grid', {})
+        elif engine == 'surface':
+            state.setdefault('histogram', np.zeros(SURFACE_HEIGHTS, dtype=np.int64))
+            state.setdefault('grid', {})
+        elif engine == 'entities':
+            state.setdefault('histogram', {})
+            state.setdefault('grid', {})
+        elif engine == 'clusters':
+            state.setdefault('finder', clusters.ClusterFinder(LARGEST_CLUSTERS))
+            selection = block_type_mask(block_type_hexes)
+            # Row by row, so that only about one row of regions of chunk
+            # sides is waiting for neighbors
+            todo_files.sort(
+                key=lambda file_index: mcr_files.coords(file_index)[::-1])
+
+        for step, file_index in enumerate(todo_files, 1):
+            mcr_file = mcr_files[file_index]
+            region = mcr_files.coords(file_index)
+            partial = None
+            chunk_indexes = None
+            if windowed:
+                chunk_indexes = set(manifest['index'][
+                    file_chunks.get(file_index, slice(0, 0))].tolist())
+
+            if engine == 'layers':
+                region_histogram = count_region_blocks(
+                    mcr_file, data_values, chunk_cache, depth, points,
+                    chunk_indexes, groups, plan.batch, region)
+                partial = select_counts(
+                    region_histogram, block_type_hexes, groups)
+                # Sum up the results
+                if 'histogram' not in state:
+                    state['histogram'] = region_histogram
                 else:
-                    Data[index_z][index_x] = counts
+                    state['histogram'] += region_histogram
+            elif engine == 'chunks':
+                partial = state['grid'][region] = count_region_chunks(
+                    mcr_file, block_type_hexes[0], chunk_cache, chunk_indexes)
+            elif engine == 'surface':
+                region_histogram, heights = count_region_surface(
+                    mcr_file, surface_stat, chunk_indexes)
+                state['histogram'] += region_histogram
+                state['grid'][region] = heights
+                partial = region_histogram, {region: heights}
+            elif engine == 'entities':
+                region_histogram, counts = count_region_entities(
+                    mcr_file, entity_ids, chunk_indexes)
+                for entity_id, layers in region_histogram.iteritems():
+                    if entity_id in state['histogram']:
+                        state['histogram'][entity_id] += layers
+                    else:
+                        state['histogram'][entity_id] = layers.copy()
+                state['grid'][region] = counts
+                partial = region_histogram, {region: counts}
+            elif engine == 'exposure':
+                count_region_exposure(
+                    mcr_file, region, selection, state['counter'],
+                    data_values, chunk_indexes, groups)
+            elif engine == 'top':
+                region_top = TopList(top.size)
+                region_total = 0
+                for index, count in count_region_selection(
+                    mcr_file, selection, top.layers, chunk_indexes):
+                    chunk_z, chunk_x = divmod(index, REGION_SIZE)
+                    region_top.add(count, (
+                        region[0] * REGION_SIZE + chunk_x,
+                        region[1] * REGION_SIZE + chunk_z))
+                    region_total += count
+                state['chunks'].update(region_top)
+                state['regions'][region] = \
+                    state['regions'].get(region, 0) + region_total
+                partial = region_top.items()
+            elif engine == 'biomes':
+                region_histogram = count_region_biomes(
+                    mcr_file, data_values, chunk_indexes, groups, plan.batch)
+                for biome, histogram in region_histogram.iteritems():
+                    if biome in state['histogram']:
+                        state['histogram'][biome] += histogram
+                    else:
+                        state['histogram'][biome] = histogram
+                partial = dict(
+                    (biome, select_counts(histogram, block_type_hexes, groups))
+                    for biome, histogram in region_histogram.iteritems())
+            elif engine == 'clusters':
+                find_region_clusters(
+                    mcr_file, region, selection, state['finder'],
+                    chunk_indexes)
+
+            chunks_done += region_chunks[file_index]
+            done_keys.append(keys[file_chunks.get(file_index, slice(0, 0))])
+            save_checkpoint()
+            yield ScanEvent(
+                EVENT_PROGRESS, step, len(todo_files), chunks_done,
+                total_chunks, time.time() - start_time, region, partial)
+
+    if engine == 'layers':
+        histogram = state.get('histogram')
+        if histogram is None or not histogram.any():
+            raise Usage('No blocks were recognized.')
+        result = select_counts(
+            histogram, block_type_hexes, block_group_table(block_type_hexes))
+    elif engine == 'chunks':
+        result = state['grid']
+    elif engine in ('surface', 'entities'):
+        result = state['histogram'], state['grid']
+    elif engine == 'exposure':
+        groups = block_group_table(block_type_hexes)
+        result = tuple(
+            select_counts(histogram, block_type_hexes, groups)
+            for histogram in state['counter'].histogram)
+    elif engine == 'top':
+        if top.regions:
+            regions = TopList(top.size)
+            for region, count in state['regions'].iteritems():
+                regions.add(count, region)
+            result = regions.items()
+        else:
+            result = state['chunks'].items()
+    elif engine == 'biomes':
+        groups = block_group_table(block_type_hexes)
+        result = dict(
+            (biome, select_counts(histogram, block_type_hexes, groups))
+            for biome, histogram in state['histogram'].iteritems())
+    elif engine == 'clusters':
+        result = state['finder'].components()
+
+    save_checkpoint(True)
+    yield ScanEvent(
+        EVENT_DONE, len(todo_files), len(todo_files), chunks_done,
+        total_chunks, time.time() - start_time, None, result)
+
+
+def diff_worlds(old_world_dir, new_world_dir, dimension='overworld',
+    block_types=None, engine='layers', depth=False):
+    """
+    Compare two copies of a world, like a save and a backup of it.
 
-                progress += 1
-                if progress % 1000 == 0:
-                    print int(float(progress) / total_chunks * 100), "%"
+    @param old_world_dir: Path to the older world directory.
+    @param new_world_dir: Path to the newer world directory.
+    @param engine: layers or chunks, see diff_events().
+    @return: Result of the engine, new counts minus old counts.
+    """
 
-        print "100%... Done!"
+    if engine not in DIFF_ENGINES:
+        raise Usage('The engine \'{0}\' can\'t compare worlds'.format(engine))
 
-        return (X, Z, min_block_x, min_block_z, max_block_x, max_block_z, Data)
+    if isinstance(block_types, basestring):
+        block_types = block_types.split(',')
+    block_type_hexes = lookup_block_types(
+        block_types or DEFAULT_BLOCK_TYPES, load_categories())
+    if not block_type_hexes:
+        raise Usage('No proper blocks given!')
 
+    for event in diff_events(
+        find_region_files(old_world_dir, dimension)[1],
+        find_region_files(new_world_dir, dimension)[1],
+        block_type_hexes, engine, depth):
+        pass
 
-def extract_region_chunk_blocks(mcr_file, coordsXZ):
-    """ Takes a region file and a local chunk coordinates
-    and returns the blocks as a string.
+    return event.result
 
-    Returns None if the chunk is not in the region file,
-    or if the region file doesn't exist.
+
+def diff_events(old_files, new_files, block_type_hexes, engine, depth=False):
+    """
+    Compare two sets of region files step by step.
+
+    Regions are paired by their coordinates. Region files with the same
+    contents are skipped without reading any chunks, and so are chunks with
+    the same compressed data, so only the changed chunks are decompressed.
+
+    @param old_files: Region file paths or catalog.RegionCatalog of the
+    older world.
+    @param new_files: Same, of the newer world.
+    @param block_type_hexes: Subset of BLOCK_TYPES.keys(), optionally
+    followed by data values.
+    @param engine: layers for the change of the counts per block type and
+    layer, or chunks for a dictionary of region coordinates to the change of
+    the count of the first block type per chunk, as a float array which is
+    NaN where neither world has a chunk.
+    @param depth: Count per depth below the surface in the layers engine.
+    @return: Generator of ScanEvent, with one step per region.
     """
 
-    def location(coordsXZ):
-        return 4 * ((coordsXZ[0] % 32) + (coordsXZ[1] % 32) * 32)
+    start_time = time.time()
+    data_values = needs_data_values(block_type_hexes)
+    old_files = catalog.from_paths(old_files)
+    new_files = catalog.from_paths(new_files)
+    old_regions = dict(zip(old_files.coordinates(), old_files))
+    new_regions = dict(zip(new_files.coordinates(), new_files))
+    regions = sorted(set(old_regions).union(new_regions))
+
+    # Chunks in either world
+    total_chunks = len(np.union1d(
+        manifest_keys(read_chunk_manifest(old_files)),
+        manifest_keys(read_chunk_manifest(new_files))))
+    chunks_done = 0
+
+    if engine == 'layers':
+        shape = (BLOCK_IDS, CHUNK_SIZE_Y)
+        if data_values:
+            shape = (BLOCK_IDS, DATA_VALUES, CHUNK_SIZE_Y)
+        histogram = np.zeros(shape, dtype=np.int64)
+    else:
+        grid = {}
+
+    yield ScanEvent(
+        EVENT_START, 0, len(regions), 0, total_chunks,
+        time.time() - start_time, None, None)
+
+    for step, region in enumerate(regions, 1):
+        old_file = old_regions.get(region)
+        new_file = new_regions.get(region)
+        if old_file is not None and new_file is not None \
+            and same_file(old_file, new_file):
+            with storage.open_file(new_file) as file_pointer:
+                indexes = set(
+                    index for offset, index in
+                    read_chunk_locations(file_pointer))
+            old_chunks = new_chunks = {}
+        else:
+            old_chunks = read_chunk_payloads(old_file)
+            new_chunks = read_chunk_payloads(new_file)
+            indexes = set(old_chunks).union(new_chunks)
+        changed = sorted(
+            index for index in indexes
+            if old_chunks.get(index) != new_chunks.get(index))
+
+        old_payloads = [
+            (index, old_chunks[index]) for index in changed
+            if index in old_chunks]
+        new_payloads = [
+            (index, new_chunks[index]) for index in changed
+            if index in new_chunks]
+
+        if engine == 'layers':
+            partial = count_payloads(new_payloads, data_values, depth) - \
+                count_payloads(old_payloads, data_values, depth)
+            histogram += partial
+            partial = select_counts(partial, block_type_hexes)
+        else:
+            counts = np.empty(REGION_SIZE * REGION_SIZE)
+            counts.fill(np.nan)
+            counts[list(indexes)] = 0
+            for payloads, sign in ((new_payloads, 1), (old_payloads, -1)):
+                for index, (chunk_compression, chunk_raw) in payloads:
+                    counts[index] += sign * count_block_type(
+                        block_type_hexes[0], *extract_chunk_blocks(
+                            decompress(chunk_raw, chunk_compression),
+                            data_values))
+            partial = grid[region] = counts.reshape(REGION_SIZE, REGION_SIZE)
+
+        chunks_done += len(indexes)
+        yield ScanEvent(
+            EVENT_PROGRESS, step, len(regions), chunks_done, total_chunks,
+            time.time() - start_time, region, partial)
+
+    if engine == 'layers':
+        result = select_counts(histogram, block_type_hexes)
+    else:
+        result = grid
 
-    try:
-        file_pointer = open(mcr_file, 'rb')
-    except IOError:
-        return None
+    yield ScanEvent(
+        EVENT_DONE, len(regions), len(regions), chunks_done, total_chunks,
+        time.time() - start_time, None, result)
 
-    file_pointer.seek(location(coordsXZ))
 
-    # Locate sector
-    location_raw = file_pointer.read(LOCATION_BYTES)
-    location = struct.unpack(
-        LOCATION_FORMAT,
-        LOCATION_PADDING + location_raw)[0]
-    if location == 0:
-        return None
+def same_file(first_path, second_path):
+    """Whether two files have the same size and contents."""
 
-    # Get chunk and decompress
-    file_pointer.seek(location * SECTOR_BYTES)
-    chunk_length = struct.unpack(
-        UNSIGNED_LONG_FORMAT,
-        file_pointer.read(CHUNK_LENGTH_BYTES))[0]
-    chunk_compression = struct.unpack(
-        UNSIGNED_CHAR_FORMAT,
-        file_pointer.read(COMPRESSION_BYTES))[0]
-    chunk_raw = file_pointer.read(chunk_length)
-    chunk = decompress(chunk_raw, chunk_compression)
+    if storage.stat(first_path)[0] != storage.stat(second_path)[0]:
+        return False
 
-    # Extract the blocks of the chunk
-    index = chunk.find(BLOCKS_NBT_TAG)
-    blocks = chunk[
-        (index + len(BLOCKS_NBT_TAG)):(index + len(BLOCKS_NBT_TAG) + 32768)]
+    digests = []
+    for path in (first_path, second_path):
+        digest = sha1()
+        with storage.open_file(path) as file_pointer:
+            for block in iter(lambda: file_pointer.read(SECTOR_BYTES * 64), ''):
+                digest.update(block)
+        digests.append(digest.digest())
 
-    return blocks
+    return digests[0] == digests[1]
 
 
-def get_region_coords(mcr_file):
-    """ Takes the name of a file with or without the full path and
-    returns 2 integers with the coordinates of a region file """
+def read_chunk_payloads(mcr_file):
+    """
+    Read the compressed chunks of a region file into memory.
 
-    regionXZ = os.path.basename(mcr_file).lstrip('r.').split('.', 2)[:2]
-    return int(regionXZ[0]), int(regionXZ[1])
+    @param mcr_file: Path to the region file, or None.
+    @return: Dictionary of chunk index to compression method and compressed
+    chunk data, empty for None.
+    """
 
+    if mcr_file is None:
+        return {}
 
-def count_chunk_blocks(world_dir, chunkXZ, block_type):
-    """ Takes the global chunk coordinates, the world_dir
-    and the block type for count.
+    return dict(
+        (index, (chunk_compression, chunk_raw))
+        for index, chunk_compression, chunk_raw in read_region_chunks(mcr_file))
 
-    Returns the count of block or -1 if the chunk, or the
-    region file doesn't exist.
-    """
 
-    # Determine the propper region file.
-    rXZ = (chunkXZ[0] / 32, chunkXZ[1] / 32)
-    # TODO: 20120203 winex: use dimensions magic here
-    mcr_file = os.path.join(world_dir.rstrip(os.path.sep), 'region',
-        'r.{0}.{1}.mcr'.format(*rXZ))
+def count_payloads(payloads, data_values=False, depth=False):
+    """
+    Count the blocks per layer in some compressed chunks.
 
-    # Determine chunk coords in region file.
-    local_chunkXZ = (divmod(chunkXZ[0], 32)[1], + divmod(chunkXZ[1], 32)[1])
+    @param payloads: List of chunk index and (compression method, compressed
+    chunk data) pairs.
+    @return: Histogram from count_blocks().
+    """
 
-    blocks = extract_region_chunk_blocks(mcr_file, local_chunkXZ)
+    shape = (BLOCK_IDS, CHUNK_SIZE_Y)
+    if data_values:
+        shape = (BLOCK_IDS, DATA_VALUES, CHUNK_SIZE_Y)
+    histogram = np.zeros(shape, dtype=np.int64)
 
-    if blocks == None:
-        return -1
+    for start in xrange(0, len(payloads), CHUNK_BATCH):
+        chunks = [
+            extract_chunk_blocks(
+                decompress(chunk_raw, chunk_compression), data_values)
+            for index, (chunk_compression, chunk_raw)
+            in payloads[start:start + CHUNK_BATCH]]
+        histogram += count_blocks(
+            np.concatenate([blocks for blocks, data in chunks]),
+            np.concatenate([data for blocks, data in chunks])
+                if data_values else None,
+            depth)
 
-    count = blocks.count(block_type)
+    return histogram
 
-    return count
 
+def report_events(events, region_count, chunk_cache=None, checkpoint=None):
+    """
+    Print the progress of scan_events() or diff_events().
 
-def count_blocks(region_blocks, block_type_hexes):
+    @param region_count: Number of regions, for the start message.
+    @return: The final result.
     """
-    This function counts blocks per layer.
 
-    Returns a list with one element per scanned block.
-    Each element is a list with 128 elements the amount
-    of that block in that layer.
+    for event in events:
+        if event.kind == EVENT_START:
+            if checkpoint is not None and checkpoint.resumed:
+                print "Resuming from %s, %s chunks done and %s left" % (
+                    checkpoint.path, checkpoint.resumed, event.total_chunks)
+            else:
+                print "There are %s regions with %s chunks in the savegame directory" % (
+                    region_count, event.total_chunks)
+        elif event.kind == EVENT_PROGRESS:
+            progress = format_progress(
+                event.chunks_done, event.total_chunks, event.elapsed)
+            if event.region is None:
+                print "Counted %s" % progress
+            else:
+                print "Read %# 5u / %u, %s" % (
+                    event.step, event.total_steps, progress)
+        elif event.kind == EVENT_DONE:
+            print "Done!"
+            if chunk_cache is not None:
+                print "Chunk cache: %s" % chunk_cache.stats()
+
+    return event.result
+
+
+def generate_graph_data(world_dir, mcr_files, block_type_hexes, plot_mode,
+    chunk_cache=None, surface_stat='mean', depth=False, points=None,
+    jobs=None, checkpoint=None, since=None, until=None, entity_ids=None,
+    top=None, max_memory=None):
     """
+    Run scan_events() for a plot mode, printing the progress.
 
-    layers = [region_blocks[i::128] for i in range(128)]
-    counts = [[] for i in xrange(len(block_type_hexes))]
+    @return: The data for plot().
+    """
 
-    for block_type_index in range(len(block_type_hexes)):
-        bt_hex = block_type_hexes[block_type_index]
-        for layer in layers:
-            counts[block_type_index].append(layer.count(bt_hex))
+    events = scan_events(
+        mcr_files, block_type_hexes, PLOT_MODE_ENGINES[plot_mode], chunk_cache,
+        surface_stat, depth, points, jobs, checkpoint, since, until,
+        entity_ids, top, max_memory)
 
-    return counts
+    if plot_mode == 'stats':
+        for event in events:
+            pass
+        result = event.result
+    else:
+        result = report_events(
+            events, len(mcr_files), chunk_cache, checkpoint)
+
+    if plot_mode in ('surface', 'surface-table'):
+        return result[0].reshape(1, SURFACE_HEIGHTS)
+    elif plot_mode in ('entities', 'entities-table'):
+        return result[0]
+    elif plot_mode in ('surface-map', 'entities-map'):
+        return result[1]
+    return result
 
 
-def extract_region_blocks(mcr_file):
+def entity_rows(histogram):
     """
-    This function creates a string which contains
-    all blocks within the chunks in a given region file.
+    Rows for plot() from the histogram of the entities engine.
 
-    Returns a string with all the chunk blocks in NBT format
-    inside a region file concatenated.
+    @return: Entity IDs and counts per layer, most common first.
+    @raise Usage: If there are no entities.
     """
 
-    # Unpack block format
-    # <http://www.minecraftwiki.net/wiki/Beta_Level_Format>
+    if not histogram:
+        raise Usage('No entities were found.')
+    names = sorted(
+        histogram, key=lambda entity_id: (-histogram[entity_id].sum(), entity_id))
+    return names, np.array([histogram[entity_id] for entity_id in names])
+
 
-    locations = []
+def biome_rows(biome_counts, block_type_hexes):
+    """
+    Rows for plot() from the result of the biomes engine.
 
-    file_pointer = open(mcr_file, 'rb')
+    @return: Block type and biome names, and counts per layer of the block
+    types found in each biome, by biome ID and then in the order given.
+    @raise Usage: If none of the block types were found.
+    """
 
-    # Locations sector
-    while file_pointer.tell() < SECTOR_BYTES:
-        location_raw = file_pointer.read(LOCATION_BYTES)
-        location = struct.unpack(
-            LOCATION_FORMAT,
-            LOCATION_PADDING + location_raw)[0]
-        if location != 0:
-            locations.append(location)
+    names = []
+    rows = []
+    for biome in sorted(biome_counts):
+        biome_name = BIOME_NAMES.get(biome, 'Biome {0}'.format(biome))
+        for bt_hex, counts in zip(block_type_hexes, biome_counts[biome]):
+            if counts.any():
+                names.append('{0} in {1}'.format(
+                    block_type_name(bt_hex), biome_name))
+                rows.append(counts)
 
-    locations.sort()
+    if not rows:
+        raise Usage('No blocks were recognized.')
+    return names, np.array(rows)
 
-    region_blocks = ''
 
-    for offset in locations:
-        file_pointer.seek(offset * SECTOR_BYTES)
-        chunk_length = struct.unpack(
-            UNSIGNED_LONG_FORMAT,
-            file_pointer.read(CHUNK_LENGTH_BYTES))[0]
-        chunk_compression = struct.unpack(
-            UNSIGNED_CHAR_FORMAT,
-            file_pointer.read(COMPRESSION_BYTES))[0]
-        chunk_raw = file_pointer.read(chunk_length)
-        chunk = decompress(chunk_raw, chunk_compression)
+def scan_region_chunks(job):
+    """
+    count_region_chunks() for a process pool.
 
-        # Extract the blocks from the chunk
-        index = chunk.find(BLOCKS_NBT_TAG)
-        blocks = chunk[
-            (index + len(BLOCKS_NBT_TAG) + 4):(index +
-            len(BLOCKS_NBT_TAG) + 4 + 32768)]
-            # after the NBT tag there is always
-            # four bytes with \x00 \x00 \x80 \x00, ignore them!
-        region_blocks += blocks
+    @param job: Tuple of region file path, region coordinates and block type.
+    @return: Region coordinates and chunk counts.
+    """
 
-    return region_blocks
+    mcr_file, region, block_type = job
+    return region, count_region_chunks(mcr_file, block_type)
 
 
-def decompress(string, method):
+def generate_tiles(mcr_files, block_type, tiles_dir, processes):
     """
-    Decompress the given string with either of the
+    Write a map tile pyramid of the count of a block type per chunk.
+
+    Only region files which changed since the last run in tiles_dir are read,
+    and only the tiles covering them are rendered.
+
+    @param mcr_files: Region file paths or catalog.RegionCatalog.
+    @param block_type: Hex ID, optionally followed by a data value.
+    @param tiles_dir: Output directory.
+    @param processes: Number of worker processes, or None for one per CPU.
     """
 
-    assert(method in (COMPRESSION_GZIP, COMPRESSION_DEFLATE))
-    if method == COMPRESSION_GZIP:
-        with GzipFile(fileobj=StringIO(string)) as gzip_file:
-            return gzip_file.read()
+    if not os.path.isdir(tiles_dir):
+        os.makedirs(tiles_dir)
 
-    if method == COMPRESSION_DEFLATE:
-        return zlib.decompress(string)
+    manifest, grid = tiles.load_state(tiles_dir)
+    if isinstance(block_type, BlockCategory):
+        block_type_key = ','.join(bt_hex.encode('hex') for bt_hex in block_type)
+    else:
+        block_type_key = block_type.encode('hex')
+    if manifest.get('block_type') != block_type_key:
+        manifest = {}
+        grid = {}
+    old_signatures = manifest.get('regions', {})
+
+    mcr_files = catalog.from_paths(mcr_files)
+    signatures = {}
+    changed_files = []
+    for mcr_file, region, (size, mtime) in zip(
+        mcr_files, mcr_files.coordinates(),
+        mcr_files.regions[['size', 'mtime']].tolist()):
+        region_key = '%d_%d' % region
+        signatures[region_key] = [size, int(mtime)]
+        if old_signatures.get(region_key) != signatures[region_key]:
+            changed_files.append((mcr_file, region))
+
+    dirty_regions = set()
+    for region in grid.keys():
+        if '%d_%d' % region not in signatures:
+            dirty_regions.add(region)
+            del grid[region]
+
+    print "%d of %d regions changed since the last run" % (
+        len(changed_files), len(mcr_files))
+
+    pool = Pool(processes)
+    try:
+        file_counter = 1
+        for region, counts in pool.imap_unordered(
+            scan_region_chunks,
+            [(mcr_file, region, block_type)
+                for mcr_file, region in changed_files]):
+            print "Reading %# 5u / %u" % (file_counter, len(changed_files))
+            grid[region] = counts
+            dirty_regions.add(region)
+            file_counter += 1
+    finally:
+        pool.close()
+        pool.join()
 
+    layout = tiles.pyramid_layout(grid.iterkeys())
+    maximum = max(1, max(int(counts.max()) for counts in grid.itervalues()))
+    if manifest.get('layout') != layout or manifest.get('maximum') != maximum:
+        # Every tile changes
+        dirty_regions = None
+        for zoom in xrange(manifest.get('layout', {}).get('max_zoom', -1) + 1):
+            shutil.rmtree(os.path.join(tiles_dir, str(zoom)), True)
 
-class Usage(Exception):
-    """Command-line usage error"""
+    written = tiles.write_pyramid(
+        tiles_dir, grid, layout, maximum, dirty_regions, processes)
 
-    def __init__(self, msg):
-        super(Usage, self).__init__(msg)
-        self.msg = msg + '\nSee --help for more information.'
+    tiles.save_state(tiles_dir, {
+        'block_type': block_type_key,
+        'layout': layout,
+        'maximum': maximum,
+        'regions': signatures}, grid)
 
+    print "Wrote %d tiles to %s" % (written, tiles_dir)
 
-def main(argv=None):
-    """Argument handling."""
 
-    # things for --help and --version options
-    prog = os.path.basename(__file__)
-    description = 'mian: Mine analysis - Graph block types to altitude ' \
-        'in a Minecraft save game <http://github.com/l0b0/mian>'
-    usage = 'usage: %prog [options] <World directory>. %prog --help for options.'
-    version = __version__
+def extract_chunk_heightmap(chunk_compression, chunk_raw):
+    """
+    Get the surface height of each column of a compressed chunk.
 
-    # populating the parser
-    parser = OptionParser(usage = usage, version = version,
-        description = description, prog = prog)
+    Only the HeightMap tag is read, and decompression stops right after it.
 
-    parser.add_option("-b", "--blocks", dest="block_type_names", default = None,
+    @return: uint8 array of the lowest layer with full sky light, indexed by
+    local Z * 16 + X, or None if the chunk has no height map.
+    """
+
+    stream = nbtscan.ChunkStream(chunk_raw, chunk_compression)
+    heightmap = nbtscan.find_tags(stream, [HEIGHTMAP_PATH]).get(HEIGHTMAP_PATH)
+    if heightmap is None:
+        return None
+
+    return np.frombuffer(heightmap, dtype=np.uint8)
+
+
+def count_region_surface(mcr_file, surface_stat='mean', chunk_indexes=None):
+    """
+    Surface height statistics of a region file from the chunk height maps.
+
+    @param mcr_file: Path to the region file.
+    @param surface_stat: 'mean' or 'max' height per chunk.
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @return: Histogram of how many columns have each height, up to
+    CHUNK_SIZE_Y above a full column, and REGION_SIZE x REGION_SIZE array of the height per chunk, indexed by
+    local chunk Z and X coordinates. Chunks missing from the region are -1.
+    """
+
+    histogram = np.zeros(SURFACE_HEIGHTS, dtype=np.int64)
+    heights = np.empty(REGION_SIZE * REGION_SIZE)
+    heights.fill(-1)
+
+    for index, chunk_compression, chunk_raw in read_region_chunks(
+        mcr_file, chunk_indexes):
+        heightmap = extract_chunk_heightmap(chunk_compression, chunk_raw)
+        if heightmap is None:
+            continue
+
+        # Heights above a full column are invalid and count as full
+        histogram += np.bincount(
+            np.minimum(heightmap, CHUNK_SIZE_Y), minlength=SURFACE_HEIGHTS)
+        if surface_stat == 'max':
+            heights[index] = heightmap.max()
+        else:
+            heights[index] = heightmap.mean()
+
+    return histogram, heights.reshape(REGION_SIZE, REGION_SIZE)
+
+
+def extract_chunk_entities(chunk_compression, chunk_raw):
+    """
+    Get the entities and tile entities of a compressed chunk.
+
+    Only their IDs and heights are read, skipping inventories and the like,
+    and decompression stops right after both lists.
+
+    @return: List of ID and layer pairs. Layers outside the world are
+    clipped to the bottom and top layers.
+    """
+
+    stream = nbtscan.ChunkStream(chunk_raw, chunk_compression)
+    found = nbtscan.find_tags(
+        stream, ENTITY_PATHS,
+        lambda stream, tag_type: nbtscan.read_list_fields(
+            stream, tag_type, ENTITY_FIELDS))
+
+    entities = []
+    for path in ENTITY_PATHS:
+        for fields in found.get(path, []):
+            if 'y' in fields:
+                y = fields['y']
+            elif len(fields.get('Pos', [])) == 3:
+                y = fields['Pos'][1]
+            else:
+                continue
+            if not isinstance(fields.get('id'), str):
+                continue
+            layer = min(max(int(np.floor(y)), 0), CHUNK_SIZE_Y - 1)
+            entities.append((fields['id'], layer))
+
+    return entities
+
+
+def count_region_entities(mcr_file, entity_ids=None, chunk_indexes=None):
+    """
+    Count the entities and tile entities of a region file by ID.
+
+    @param mcr_file: Path to the region file.
+    @param entity_ids: IDs to count, matched regardless of case, or None for
+    all.
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @return: Dictionary of IDs to counts per layer, and REGION_SIZE x
+    REGION_SIZE array of the number of counted entities per chunk, indexed
+    by local chunk Z and X coordinates. Chunks missing from the region are -1.
+    """
+
+    wanted = None
+    if entity_ids is not None:
+        wanted = set(entity_id.lower() for entity_id in entity_ids)
+
+    histogram = {}
+    counts = np.empty(REGION_SIZE * REGION_SIZE, dtype=np.int64)
+    counts.fill(-1)
+
+    for index, chunk_compression, chunk_raw in read_region_chunks(
+        mcr_file, chunk_indexes):
+        counts[index] = 0
+        for entity_id, layer in extract_chunk_entities(
+            chunk_compression, chunk_raw):
+            if wanted is not None and entity_id.lower() not in wanted:
+                continue
+            if entity_id not in histogram:
+                histogram[entity_id] = np.zeros(CHUNK_SIZE_Y, dtype=np.int64)
+            histogram[entity_id][layer] += 1
+            counts[index] += 1
+
+    return histogram, counts.reshape(REGION_SIZE, REGION_SIZE)
+
+
+def extract_region_chunk_blocks(mcr_file, coordsXZ, data_values=False,
+    file_pointer=None):
+    """ Takes a region file and a local chunk coordinates
+    and returns the blocks and data values as uint8 arrays.
+
+    The data values are None unless data_values is set. An open file_pointer
+    or mmap of the region file is used instead of opening it, and left open.
+
+    Returns None if the chunk is not in the region file,
+    or if the region file doesn't exist.
+    """
+
+    def location(coordsXZ):
+        return 4 * ((coordsXZ[0] % 32) + (coordsXZ[1] % 32) * 32)
+
+    keep_open = file_pointer is not None
+    if not keep_open:
+        try:
+            file_pointer = storage.open_file(mcr_file)
+        except IOError:
+            return None
+
+    file_pointer.seek(location(coordsXZ))
+
+    # Locate sector
+    location_raw = file_pointer.read(LOCATION_BYTES)
+    location = struct.unpack(
+        LOCATION_FORMAT,
+        LOCATION_PADDING + location_raw)[0]
+    if location == 0:
+        if not keep_open:
+            file_pointer.close()
+        return None
+
+    # Get chunk and decompress
+    chunk_compression, chunk_raw = read_chunk(file_pointer, location)
+    chunk = decompress(chunk_raw, chunk_compression)
+    if not keep_open:
+        file_pointer.close()
+
+    return extract_chunk_blocks(chunk, data_values)
+
+
+def find_region_clusters(mcr_file, region, selection, finder,
+    chunk_indexes=None):
+    """
+    Add the chunks of a region file to a cluster search.
+
+    @param mcr_file: Path to the region file.
+    @param region: Region coordinates, see catalog.RegionCatalog.
+    @param selection: Look up table from block_type_mask().
+    @param finder: clusters.ClusterFinder.
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    """
+
+    # Data values only matter if some block ID is partly selected
+    data_values = (selection != selection[:, :1]).any()
+    region_x, region_z = region
+
+    for index, blocks, data in extract_region_blocks(
+        mcr_file, data_values, chunk_indexes):
+        if data_values:
+            mask = selection[blocks, data]
+        else:
+            mask = selection[blocks, 0]
+        local_z, local_x = divmod(index, REGION_SIZE)
+        finder.add_chunk(
+            (region_x * REGION_SIZE + local_x, region_z * REGION_SIZE + local_z),
+            mask.reshape(CHUNK_SIZE_Z, CHUNK_SIZE_Z, CHUNK_SIZE_Y))
+
+
+def count_chunk_selection(selection, layers, blocks, data=None):
+    """
+    Count the selected blocks of a chunk.
+
+    @param selection: Look up table from block_type_mask().
+    @param layers: Lowest and one past the highest layer to count, or None for
+    all.
+    @param data: Data values, only needed if some block ID is partly selected.
+    """
+
+    if layers is not None:
+        blocks = blocks.reshape(-1, CHUNK_SIZE_Y)[:, layers[0]:layers[1]]
+        if data is not None:
+            data = data.reshape(-1, CHUNK_SIZE_Y)[:, layers[0]:layers[1]]
+    if data is None:
+        return int(np.count_nonzero(selection[blocks, 0]))
+    return int(np.count_nonzero(selection[blocks, data]))
+
+
+def count_region_selection(mcr_file, selection, layers=None,
+    chunk_indexes=None):
+    """
+    Count the selected blocks in every chunk of a region file.
+
+    @param selection: Look up table from block_type_mask().
+    @param layers: See count_chunk_selection().
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @return: Generator of chunk index and count pairs, in file order.
+    """
+
+    # Data values only matter if some block ID is partly selected
+    data_values = (selection != selection[:, :1]).any()
+    for index, blocks, data in extract_region_blocks(
+        mcr_file, data_values, chunk_indexes):
+        yield index, count_chunk_selection(selection, layers, blocks, data)
+
+
+def count_chunk_blocks(mcr_files, chunkXZ, block_type):
+    """ Takes the region files from find_region_files(), the global
+    chunk coordinates and the block type for count.
+
+    Returns the count of block or -1 if the chunk, or the
+    region file doesn't exist.
+    """
+
+    # Determine the propper region file.
+    mcr_files = catalog.from_paths(mcr_files)
+    file_index = mcr_files.find(
+        (chunkXZ[0] // REGION_SIZE, chunkXZ[1] // REGION_SIZE))
+    if file_index is None:
+        return -1
+
+    # Determine chunk coords in region file.
+    local_chunkXZ = (chunkXZ[0] % REGION_SIZE, chunkXZ[1] % REGION_SIZE)
+
+    chunk_blocks = extract_region_chunk_blocks(
+        mcr_files[file_index], local_chunkXZ, needs_data_values([block_type]))
+
+    if chunk_blocks == None:
+        return -1
+
+    return count_block_type(block_type, *chunk_blocks)
+
+
+def count_block_type(block_type, blocks, data=None):
+    """
+    Count a single block type.
+
+    @param block_type: Hex ID, optionally followed by a data value, or a
+    BlockCategory.
+    @param blocks: uint8 array of block IDs.
+    @param data: uint8 array of data values, needed if block_type has one.
+    """
+
+    if isinstance(block_type, BlockCategory):
+        selection = block_type_mask([block_type])
+        if data is None:
+            return int(np.count_nonzero(np.take(selection[:, 0], blocks)))
+        return int(np.count_nonzero(selection[blocks, data]))
+
+    matches = blocks == ord(block_type[0])
+    if len(block_type) > 1:
+        matches &= data == ord(block_type[1])
+
+    return int(np.count_nonzero(matches))
+
+
+def count_region_chunks(mcr_file, block_type, chunk_cache=None,
+    chunk_indexes=None):
+    """
+    Count a single block type in every chunk of a region file.
+
+    @param mcr_file: Path to the region file.
+    @param block_type: Hex ID, optionally followed by a data value.
+    @param chunk_cache: LRUCache of counts by compressed chunk, or None to
+    count every chunk.
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @return: REGION_SIZE x REGION_SIZE array of counts, indexed by local
+    chunk Z and X coordinates. Chunks missing from the region, or not read,
+    are -1.
+    """
+
+    counts = np.empty(REGION_SIZE * REGION_SIZE, dtype=np.int64)
+    counts.fill(-1)
+    data_values = needs_data_values([block_type])
+
+    if chunk_cache is not None:
+        for index, chunk_compression, chunk_raw in read_region_chunks(
+            mcr_file, chunk_indexes):
+            key = chunk_key(chunk_compression, chunk_raw)
+            count = chunk_cache.get(key)
+            if count is None:
+                count = count_block_type(block_type, *extract_chunk_blocks(
+                    decompress(chunk_raw, chunk_compression), data_values))
+                chunk_cache.put(key, count)
+            counts[index] = count
+        return counts.reshape(REGION_SIZE, REGION_SIZE)
+
+    for index, blocks, data in extract_region_blocks(
+        mcr_file, data_values, chunk_indexes):
+        counts[index] = count_block_type(block_type, blocks, data)
+
+    return counts.reshape(REGION_SIZE, REGION_SIZE)
+
+
+def count_blocks(blocks, data=None, depth=False, groups=None):
+    """
+    This function counts blocks per layer.
+
+    @param blocks: uint8 array of block IDs from one or more whole chunks.
+    @param data: uint8 array of the matching data values, or None to count
+    block IDs only.
+    @param depth: Count per depth below the surface of each column instead of
+    per layer, see surface_depths().
+    @param groups: Table from block_group_table() to count rows of block types
+    instead of block IDs, or None.
+    @return: Histogram with shape (256, 128), or (256, 16, 128) when data
+    values are given, of how many of each block are in each layer. With
+    groups, the shape is (1 + rows, 128) and the first row counts the
+    unselected blocks.
+    """
+
+    bins, shape = block_bins(blocks, data, depth, groups)
+    offset = CHUNK_SIZE_Y if depth else 0
+
+    return np.bincount(
+        bins,
+        minlength=offset + np.prod(shape))[offset:].reshape(shape)
+
+
+def block_bins(blocks, data=None, depth=False, groups=None):
+    """
+    Get the flat histogram index of every block, see count_blocks().
+
+    @return: intp array of indexes and the histogram shape. With depth, the
+    indexes start at CHUNK_SIZE_Y, below which the air above the surface of
+    each column is counted.
+    """
+
+    # Within a chunk the layer is the fastest changing index, so every row
+    # is one column of blocks
+    layers = np.arange(CHUNK_SIZE_Y)
+    bins = blocks.reshape(-1, CHUNK_SIZE_Y).astype(np.intp)
+    shape = histogram_shape(data is not None, groups)
+
+    if groups is not None:
+        # Air is unselected, so with depth it still lands in the leading bins
+        if data is not None:
+            bins *= DATA_VALUES
+            bins += data.reshape(-1, CHUNK_SIZE_Y)
+        bins = np.take(groups, bins)
+    elif data is not None:
+        if depth:
+            # Keep the air above the surface in the leading bins
+            data = np.where(blocks == 0, 0, data)
+        bins *= DATA_VALUES
+        bins += data.reshape(-1, CHUNK_SIZE_Y)
+
+    bins *= CHUNK_SIZE_Y
+
+    if depth:
+        # Only air is above the surface, so the negative depths there fall
+        # in the leading bins without masking anything
+        bins -= layers
+        bins += (surface_layers(blocks) + CHUNK_SIZE_Y)[:, np.newaxis]
+    else:
+        bins += layers
+
+    return bins.ravel(), shape
+
+
+def surface_layers(blocks):
+    """
+    Find the top non-air block of each column.
+
+    @param blocks: uint8 array of block IDs from one or more whole chunks.
+    @return: Layer of the surface of each column, -1 if it is only air.
+
+    >>> column = np.zeros(CHUNK_SIZE_Y, dtype=np.uint8)
+    >>> column[:3] = 1
+    >>> surface_layers(np.concatenate((column, column * 0)))
+    array([ 2, -1])
+    """
+
+    solid = blocks.reshape(-1, CHUNK_SIZE_Y) != 0
+    # Index of the last True in each row
+    surface = CHUNK_SIZE_Y - 1 - np.argmax(solid[:, ::-1], axis=1)
+    surface[~solid.any(axis=1)] = -1
+
+    return surface
+
+
+def count_biome_blocks(blocks, biomes, data=None, groups=None):
+    """
+    Count blocks per biome and layer.
+
+    @param blocks: uint8 array of block IDs from one or more whole chunks.
+    @param biomes: Biome ID of every column of blocks, see
+    extract_chunk_biomes().
+    @param data: See count_blocks().
+    @param groups: See count_blocks().
+    @return: Dictionary of the biome IDs present to histograms as from
+    count_blocks().
+    """
+
+    bins, shape = block_bins(blocks, data, groups=groups)
+    size = np.prod(shape)
+
+    # Only the biomes present get bins, so one bincount covers them all
+    present, biome_indexes = np.unique(biomes, return_inverse=True)
+    bins += np.repeat(biome_indexes * size, CHUNK_SIZE_Y)
+    histograms = np.bincount(bins, minlength=len(present) * size).reshape(
+        (len(present),) + tuple(shape))
+
+    return dict(zip(present.tolist(), histograms))
+
+
+def count_region_exposure(mcr_file, region, selection, counter,
+    data_values=False, chunk_indexes=None, groups=None):
+    """
+    Add the chunks of a region file to an exposure count.
+
+    @param mcr_file: Path to the region file.
+    @param region: Region coordinates, see catalog.RegionCatalog.
+    @param selection: Look up table from block_type_mask() of the blocks
+    whose neighbors in other chunks are checked.
+    @param counter: exposure.ExposureCounter.
+    @param data_values: Whether to count per data value, see count_blocks().
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @param groups: Table from block_group_table(), or None.
+    """
+
+    region_x, region_z = region
+    shape = (CHUNK_SIZE_Z, CHUNK_SIZE_Z, CHUNK_SIZE_Y)
+    # Taking from a flat table is faster
+    id_selection = selection[:, 0].copy()
+
+    for index, blocks, data in extract_region_blocks(
+        mcr_file, data_values, chunk_indexes):
+        if data_values:
+            selected = selection[blocks, data]
+        else:
+            selected = id_selection.take(blocks)
+        local_z, local_x = divmod(index, REGION_SIZE)
+        counter.add_chunk(
+            (region_x * REGION_SIZE + local_x, region_z * REGION_SIZE + local_z),
+            TRANSPARENT_TABLE[blocks].reshape(shape),
+            selected.reshape(shape),
+            block_bins(blocks, data, groups=groups)[0].reshape(shape))
+    counter.flush()
+
+
+def count_region_biomes(mcr_file, data_values=False, chunk_indexes=None,
+    groups=None, batch=CHUNK_BATCH):
+    """
+    Count the blocks per biome and layer in all the chunks of a region file.
+
+    The block IDs and biomes come from the same decompressed chunk, so this
+    reads and decompresses no more than counting the blocks alone.
+
+    @param mcr_file: Path to the region file.
+    @param data_values: Whether to count per data value, see count_blocks().
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @param groups: Table from block_group_table(), or None.
+    @param batch: Chunks counted at a time.
+    @return: Dictionary of biome IDs to histograms from count_blocks().
+    """
+
+    histograms = {}
+
+    def add(batch_blocks, batch_data, batch_biomes):
+        for biome, histogram in count_biome_blocks(
+            np.concatenate(batch_blocks), np.concatenate(batch_biomes),
+            np.concatenate(batch_data) if data_values else None,
+            groups).iteritems():
+            if biome in histograms:
+                histograms[biome] += histogram
+            else:
+                histograms[biome] = histogram
+
+    batch_blocks = []
+    batch_data = []
+    batch_biomes = []
+    for index, chunk_compression, chunk_raw in read_region_chunks(
+        mcr_file, chunk_indexes):
+        chunk = decompress(chunk_raw, chunk_compression)
+        blocks, data = extract_chunk_blocks(chunk, data_values)
+        batch_blocks.append(blocks)
+        batch_data.append(data)
+        batch_biomes.append(extract_chunk_biomes(chunk))
+        if len(batch_blocks) == batch:
+            add(batch_blocks, batch_data, batch_biomes)
+            batch_blocks = []
+            batch_data = []
+            batch_biomes = []
+
+    if batch_blocks:
+        add(batch_blocks, batch_data, batch_biomes)
+
+    return histograms
+
+
+def count_region_blocks(mcr_file, data_values=False, chunk_cache=None,
+    depth=False, points=None, chunk_indexes=None, groups=None,
+    batch=CHUNK_BATCH, region=None):
+    """
+    Count the blocks per layer in all the chunks of a region file.
+
+    @param mcr_file: Path to the region file.
+    @param data_values: Whether to count per data value, see count_blocks().
+    @param chunk_cache: LRUCache of chunk histograms by compressed chunk, or
+    None to count every chunk.
+    @param depth: Count per depth below the surface instead of per layer.
+    @param points: PointWriter for the coordinates of the selected blocks, or
+    None.
+    @param chunk_indexes: Indexes of the chunks to read, or None for all.
+    @param groups: Table from block_group_table(), or None.
+    @param batch: Chunks counted at a time.
+    @param region: Region coordinates, see catalog.RegionCatalog. Only
+    needed for points.
+    @return: Histogram from count_blocks().
+    """
+
+    histogram = np.zeros(histogram_shape(data_values, groups), dtype=np.int64)
+
+    if chunk_cache is not None:
+        for index, chunk_compression, chunk_raw in read_region_chunks(
+            mcr_file, chunk_indexes):
+            key = chunk_key(chunk_compression, chunk_raw)
+            chunk_histogram = chunk_cache.get(key)
+            if chunk_histogram is None:
+                blocks, data = extract_chunk_blocks(
+                    decompress(chunk_raw, chunk_compression), data_values)
+                # Sparse, since most chunks only have a few block types
+                bins, counts = np.unique(
+                    block_bins(blocks, data, depth, groups)[0],
+                    return_counts=True)
+                if depth:
+                    # See block_bins()
+                    bins -= CHUNK_SIZE_Y
+                    counts = counts[bins >= 0]
+                    bins = bins[bins >= 0]
+                chunk_points = None
+                if points is not None:
+                    chunk_points = points.chunk_points(blocks, data)
+                chunk_histogram = bins, counts, chunk_points
+                chunk_cache.put(key, chunk_histogram, bins.nbytes + counts.nbytes
+                    + (0 if chunk_points is None else chunk_points.nbytes))
+            bins, counts, chunk_points = chunk_histogram
+            histogram.flat[bins] += counts
+            if points is not None:
+                points.write(chunk_points, region, index)
+        return histogram
+
+    batch_blocks = []
+    batch_data = []
+    for index, blocks, data in extract_region_blocks(
+        mcr_file, data_values, chunk_indexes):
+        if points is not None:
+            points.write(points.chunk_points(blocks, data), region, index)
+        batch_blocks.append(blocks)
+        batch_data.append(data)
+        if len(batch_blocks) == batch:
+            histogram += count_blocks(
+                np.concatenate(batch_blocks),
+                np.concatenate(batch_data) if data_values else None,
+                depth, groups)
+            batch_blocks = []
+            batch_data = []
+
+    if batch_blocks:
+        histogram += count_blocks(
+            np.concatenate(batch_blocks),
+            np.concatenate(batch_data) if data_values else None,
+            depth, groups)
+
+    return histogram
+
+
+def chunk_key(chunk_compression, chunk_raw):
+    """Identify byte identical chunks."""
+
+    return chr(chunk_compression) + sha1(chunk_raw).digest()
+
+
+def block_type_mask(block_type_hexes):
+    """
+    Look up table of block types.
+
+    @param block_type_hexes: Hex IDs, optionally followed by a data value, and
+    BlockCategory instances.
+    @return: (256, 16) boolean array, True for every selected block ID and data
+    value pair.
+    """
+
+    selection = np.zeros((BLOCK_IDS, DATA_VALUES), dtype=bool)
+    for bt_hex in block_type_hexes:
+        if isinstance(bt_hex, BlockCategory):
+            selection |= block_type_mask(bt_hex)
+        elif len(bt_hex) > 1:
+            selection[ord(bt_hex[0]), ord(bt_hex[1])] = True
+        else:
+            selection[ord(bt_hex[0])] = True
+
+    return selection
+
+
+def block_group_table(block_type_hexes):
+    """
+    Look up table of the row of every block, for counting categories.
+
+    With it count_blocks() counts one row per block type or category instead
+    of every block ID.
+
+    @param block_type_hexes: Hex IDs, optionally followed by a data value, and
+    BlockCategory instances.
+    @return: intp array of 1 + the row of each block type, 0 for the rest,
+    indexed by block ID, or by block ID * 16 + data value if any block type
+    has one. None if there are no categories, or if a block is in more than
+    one row, in which case the full histogram is needed.
+    """
+
+    if not any(
+        isinstance(bt_hex, BlockCategory) for bt_hex in block_type_hexes):
+        return None
+
+    rows = np.zeros((BLOCK_IDS, DATA_VALUES), dtype=np.intp)
+    for row, bt_hex in enumerate(block_type_hexes, 1):
+        selection = block_type_mask([bt_hex])
+        if (rows[selection] > 0).any():
+            return None
+        rows[selection] = row
+
+    if needs_data_values(block_type_hexes):
+        return rows.ravel()
+    return rows[:, 0].copy()
+
+
+def histogram_shape(data_values=False, groups=None):
+    """Shape of the histogram from count_blocks()."""
+    if groups is not None:
+        return (groups.max() + 1, CHUNK_SIZE_Y)
+    elif data_values:
+        return (BLOCK_IDS, DATA_VALUES, CHUNK_SIZE_Y)
+    return (BLOCK_IDS, CHUNK_SIZE_Y)
+
+
+def select_counts(histogram, block_type_hexes, groups=None):
+    """
+    Pick the per layer counts of some block types out of a histogram.
+
+    @param histogram: Histogram from count_blocks().
+    @param block_type_hexes: Hex IDs, optionally followed by a data value, and
+    BlockCategory instances.
+    @param groups: Table from block_group_table() if the histogram was counted
+    with it.
+    @return: Array with one row of 128 layer counts per block type.
+    """
+
+    if groups is not None:
+        return histogram[1:].copy()
+
+    counts = np.zeros((len(block_type_hexes), CHUNK_SIZE_Y), dtype=np.int64)
+
+    for block_type_index, bt_hex in enumerate(block_type_hexes):
+        if isinstance(bt_hex, BlockCategory):
+            counts[block_type_index] = select_counts(histogram, bt_hex).sum(
+                axis=0)
+            continue
+        block_counts = histogram[ord(bt_hex[0])]
+        if len(bt_hex) > 1:
+            block_counts = block_counts[ord(bt_hex[1])]
+        elif block_counts.ndim > 1:
+            block_counts = block_counts.sum(axis=0)
+        counts[block_type_index] = block_counts
+
+    return counts
+
+
+def read_chunk_locations(file_pointer):
+    """
+    Read the location table of a region file.
+
+    @param file_pointer: Region file opened in binary mode.
+    @return: List of (sector offset, chunk index) of the existing chunks,
+    sorted by offset.
+    """
+
+    offsets = read_location_table(file_pointer)[0]
+    indexes = np.flatnonzero(offsets)
+
+    return sorted(zip(offsets[indexes].tolist(), indexes.tolist()))
+
+
+def read_location_table(file_pointer):
+    """
+    Read the location and timestamp tables of a region file.
+
+    @param file_pointer: Region file opened in binary mode.
+    @return: Sector offsets, sector counts and timestamps of the
+    REGION_SIZE * REGION_SIZE chunks, as arrays indexed by chunk index. The
+    offset of missing chunks is 0.
+    """
+
+    file_pointer.seek(0)
+    header = file_pointer.read(2 * SECTOR_BYTES)
+    header += '\x00' * (2 * SECTOR_BYTES - len(header))
+    tables = np.frombuffer(header, dtype='>u4')
+    locations = tables[:SECTOR_INTS]
+
+    return locations >> 8, locations & 0xff, tables[SECTOR_INTS:]
+
+
+def read_chunk_manifest(mcr_files):
+    """
+    List every chunk of a world without reading the chunks.
+
+    Only the header of each region file is read.
+
+    @param mcr_files: Region file paths or catalog.RegionCatalog.
+    @return: Array of CHUNK_MANIFEST_DTYPE, in region file and then location
+    table order.
+    """
+
+    mcr_files = catalog.from_paths(mcr_files)
+    regions = []
+    for file_index, mcr_file in enumerate(mcr_files):
+        with storage.open_file(mcr_file) as file_pointer:
+            offsets, sectors, timestamps = read_location_table(file_pointer)
+        indexes = np.flatnonzero(offsets)
+        region = np.empty(len(indexes), dtype=CHUNK_MANIFEST_DTYPE)
+        region['file'] = file_index
+        region['region_x'], region['region_z'] = mcr_files.coords(file_index)
+        region['index'] = indexes
+        region['offset'] = offsets[indexes]
+        region['sectors'] = sectors[indexes]
+        region['timestamp'] = timestamps[indexes]
+        regions.append(region)
+
+    if not regions:
+        return np.empty(0, dtype=CHUNK_MANIFEST_DTYPE)
+    return np.concatenate(regions)
+
+
+def split_chunk_manifest(manifest, parts):
+    """
+    Split a chunk manifest into parts of about the same compressed size.
+
+    The chunks of each part are sorted by file and offset, so they are read
+    sequentially.
+
+    @param manifest: From read_chunk_manifest().
+    @param parts: Maximum number of parts.
+    @return: List of non-empty manifest arrays.
+
+    >>> manifest = np.zeros(4, dtype=CHUNK_MANIFEST_DTYPE)
+    >>> manifest['offset'] = [2, 3, 5, 6]
+    >>> manifest['sectors'] = [1, 2, 1, 1]
+    >>> [part['offset'].tolist() for part in split_chunk_manifest(manifest, 2)]
+    [[2, 3], [5, 6]]
+    """
+
+    ordered = manifest[np.lexsort((manifest['offset'], manifest['file']))]
+    if not len(ordered):
+        return []
+    # Each chunk goes to the part its middle sector falls in
+    ends = np.cumsum(ordered['sectors'], dtype=np.int64)
+    middles = ends - ordered['sectors'] / 2.0
+    bounds = np.searchsorted(
+        middles, ends[-1] * np.arange(1, parts) / float(parts))
+
+    return [part for part in np.split(ordered, bounds) if len(part)]
+
+
+def split_by_file(manifest):
+    """
+    Find the chunks of each region file in a manifest sorted by file.
+
+    @param manifest: From read_chunk_manifest() or split_chunk_manifest(),
+    or a selection of it.
+    @return: List of the file positions and the slices of their chunks, in
+    manifest order.
+
+    >>> manifest = np.zeros(5, dtype=CHUNK_MANIFEST_DTYPE)
+    >>> manifest['file'] = [0, 0, 2, 2, 2]
+    >>> split_by_file(manifest)
+    [(0, slice(0, 2, None)), (2, slice(2, 5, None))]
+    """
+
+    files = manifest['file']
+    if not len(files):
+        return []
+    # The first chunk of each file
+    starts = np.flatnonzero(np.diff(files)) + 1
+    starts = [0] + starts.tolist()
+    ends = starts[1:] + [len(files)]
+    return [
+        (int(files[start]), slice(start, end))
+        for start, end in zip(starts, ends)]
+
+
+def plan_memory(manifest, max_bytes=None, jobs=None, histogram_bytes=0,
+    data_values=False):
+    """
+    Fit a scan in a memory budget.
+
+    Reading a chunk costs about the same for every chunk, except for the
+    compressed size in the location tables, so the largest chunk sets the
+    cost of each chunk in a batch. Every process also holds its histogram and
+    the one being counted, and the main process holds the results waiting to
+    be summed up, one per part. Processes are dropped until all this fits,
+    down to counting in the main process only.
+
+    >>> manifest = np.zeros(10, dtype=CHUNK_MANIFEST_DTYPE)
+    >>> manifest['sectors'] = 2
+    >>> plan_memory(manifest, None, 4)
+    MemoryPlan(jobs=4, parts=16, batch=64)
+    >>> plan_memory(manifest, 100 * MEBIBYTE, 4, 256 * KIBIBYTE)
+    MemoryPlan(jobs=2, parts=4, batch=2)
+    >>> plan_memory(manifest, 40 * MEBIBYTE, 4, 256 * KIBIBYTE)
+    MemoryPlan(jobs=1, parts=4, batch=20)
+
+    @param manifest: Chunks to read, from read_chunk_manifest().
+    @param max_bytes: Budget of all the processes together, or None for no
+    limit.
+    @param jobs: Number of processes wanted, None for one.
+    @param histogram_bytes: Size of the histogram of each process.
+    @param data_values: Whether the data values are unpacked too.
+    @return: MemoryPlan.
+    @raise Usage: If the budget is too small for even one chunk at a time.
+    """
+
+    jobs = jobs or 1
+    if max_bytes is None:
+        return MemoryPlan(jobs, jobs * JOB_PARTS, CHUNK_BATCH)
+
+    largest = int(manifest['sectors'].max()) if len(manifest) else 1
+    # Compressed and uncompressed, and the block IDs, data values and
+    # histogram indexes as concatenated for a batch
+    chunk_bytes = largest * SECTOR_BYTES + UNCOMPRESSED_CHUNK_BYTES + \
+        CHUNK_BLOCKS * (1 + np.dtype(np.intp).itemsize)
+    if data_values:
+        chunk_bytes += 2 * CHUNK_BLOCKS
+    process_bytes = PROCESS_BYTES + 2 * histogram_bytes
+
+    while jobs > 1:
+        # One chunk per worker and one waiting result each
+        left = max_bytes - process_bytes - jobs * (
+            process_bytes + chunk_bytes + histogram_bytes)
+        if left >= 0:
+            break
+        jobs -= 1
+
+    if jobs == 1:
+        left = max_bytes - process_bytes - chunk_bytes
+        if left < 0:
+            raise Usage('{0} MiB of memory is not enough, at least {1} MiB '\
+                'is needed.'.format(max_bytes / MEBIBYTE,
+                    -(-(process_bytes + chunk_bytes) // MEBIBYTE)))
+        batch = min(CHUNK_BATCH, 1 + left // chunk_bytes)
+        return MemoryPlan(1, JOB_PARTS, batch)
+
+    batch = min(CHUNK_BATCH, 1 + left // (jobs * chunk_bytes))
+    left -= jobs * (batch - 1) * chunk_bytes
+    parts = jobs * JOB_PARTS
+    if histogram_bytes:
+        parts = min(parts, jobs + left // histogram_bytes)
+    return MemoryPlan(jobs, parts, batch)
+
+
+def region_key(region):
+    """
+    Single number for region coordinates.
+
+    >>> region_key((0, -1)) < region_key((0, 0)) < region_key((1, -1))
+    True
+    """
+
+    return (region[0] + 2 ** 21) * 2 ** 22 + region[1] + 2 ** 21
+
+
+def manifest_keys(manifest):
+    """
+    Identify the chunks of a manifest across runs.
+
+    @return: int64 array of region_key() * REGION_SIZE ** 2 + chunk index.
+    """
+
+    regions = region_key((
+        manifest['region_x'].astype(np.int64),
+        manifest['region_z'].astype(np.int64)))
+
+    return regions * REGION_SIZE * REGION_SIZE + manifest['index']
+
+
+def format_progress(chunks_done, total_chunks, elapsed):
+    """
+    Describe how far a scan is.
+
+    >>> format_progress(250, 1000, 5.0)
+    '250 / 1000 chunks, 50 chunks/s, ETA 0:00:15'
+    """
+
+    progress = '%u / %u chunks' % (chunks_done, total_chunks)
+    if not chunks_done or not elapsed > 0:
+        return progress
+
+    rate = chunks_done / elapsed
+    minutes, seconds = divmod(int(round((total_chunks - chunks_done) / rate)), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return progress + ', %.0f chunks/s, ETA %d:%02d:%02d' % (
+        rate, hours, minutes, seconds)
+
+
+def parse_layers(layers):
+    """
+    Convert a layer range like 0:16, from the first up to the last layer.
+
+    >>> parse_layers('0:16')
+    (0, 16)
+    >>> parse_layers('64:')
+    (64, 128)
+    """
+
+    try:
+        low, high = layers.split(':')
+        low = int(low) if low else 0
+        high = int(high) if high else CHUNK_SIZE_Y
+    except ValueError:
+        raise ValueError('Unknown layer range: %s' % layers)
+    if not 0 <= low < high <= CHUNK_SIZE_Y:
+        raise ValueError('Layer range outside 0:%d: %s' % (CHUNK_SIZE_Y, layers))
+    return low, high
+
+
+def parse_date(date):
+    """
+    Convert a UTC date, or date and time, to Unix time.
+
+    >>> parse_date('2012-02-03')
+    1328227200
+    >>> parse_date('2012-02-03 12:30')
+    1328272200
+    """
+
+    for date_format in DATE_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(date, date_format))
+        except ValueError:
+            pass
+    raise ValueError('Unknown date format: %s' % date)
+
+
+def world_stats(manifest, mcr_files):
+    """
+    Summarize a world from its chunk manifest.
+
+    @return: List of (name, value) pairs.
+    """
+
+    file_bytes = int(catalog.from_paths(mcr_files).regions['size'].sum())
+    chunk_sectors = int(manifest['sectors'].sum(dtype=np.int64))
+    region_chunks = np.bincount(manifest['file'], minlength=len(mcr_files))
+    # Everything but the two header sectors and the chunks
+    free_sectors = file_bytes / SECTOR_BYTES - 2 * len(mcr_files) - chunk_sectors
+
+    stats = [
+        ('Regions', len(mcr_files)),
+        ('Chunks', len(manifest)),
+        ('Chunks per region', '%d - %d, mean %.1f' % (
+            region_chunks.min(), region_chunks.max(), region_chunks.mean())),
+        ('File bytes', file_bytes),
+        ('Chunk bytes', chunk_sectors * SECTOR_BYTES),
+        ('Free bytes', max(0, free_sectors) * SECTOR_BYTES)]
+
+    timestamps = manifest['timestamp'][manifest['timestamp'] > 0]
+    if len(timestamps):
+        stats += [
+            (name, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp)))
+            for name, timestamp in (
+                ('Oldest chunk', timestamps.min()),
+                ('Newest chunk', timestamps.max()))]
+
+    return stats
+
+
+def ignore_interrupts():
+    """
+    Leave Ctrl-C to the main process, as a process pool initializer.
+
+    A worker stopped by KeyboardInterrupt would never return its part.
+    """
+    if SUPPORT_SIGNALS:
+        signal(SIGINT, SIG_IGN)
+
+
+def count_manifest_chunks(job):
+    """
+    Count the blocks per layer in part of a chunk manifest.
+
+    Runs in a worker process.
+
+    @param job: Tuple of a dictionary of file positions in the manifest to
+    region file paths, a part from split_chunk_manifest(), the
+    data_values, depth and groups options of count_blocks(), and the chunks
+    to count at a time.
+    @return: Histogram from count_blocks() and the part.
+    """
+
+    mcr_files, chunks, data_values, depth, groups, batch = job
+    histogram = np.zeros(histogram_shape(data_values, groups), dtype=np.int64)
+
+    batch_blocks = []
+    batch_data = []
+    for file_index, file_slice in split_by_file(chunks):
+        file_pointer = storage.open_file(mcr_files[file_index])
+        for offset in chunks['offset'][file_slice]:
+            chunk_compression, chunk_raw = read_chunk(file_pointer, offset)
+            blocks, data = extract_chunk_blocks(
+                decompress(chunk_raw, chunk_compression), data_values)
+            batch_blocks.append(blocks)
+            batch_data.append(data)
+            if len(batch_blocks) == batch:
+                histogram += count_blocks(
+                    np.concatenate(batch_blocks),
+                    np.concatenate(batch_data) if data_values else None,
+                    depth, groups)
+                batch_blocks = []
+                batch_data = []
+        file_pointer.close()
+
+    if batch_blocks:
+        histogram += count_blocks(
+            np.concatenate(batch_blocks),
+            np.concatenate(batch_data) if data_values else None,
+            depth, groups)
+
+    return histogram, chunks
+
+
+def rank_manifest_chunks(job):
+    """
+    Rank the chunks in part of a chunk manifest for the top engine.
+
+    Runs in a worker process.
+
+    @param job: Tuple of a dictionary of file positions in the manifest to
+    region file paths, a part from split_chunk_manifest(), the look up table
+    from block_type_mask(), the layers and the size of TopQuery.
+    @return: TopList of the chunks in the part by global chunk coordinates,
+    dictionary of region coordinates to counts, and the part.
+    """
+
+    mcr_files, chunks, selection, layers, size = job
+    data_values = (selection != selection[:, :1]).any()
+    top = TopList(size)
+    regions = {}
+
+    for file_index, file_slice in split_by_file(chunks):
+        file_chunks = chunks[file_slice]
+        region = (
+            int(file_chunks['region_x'][0]), int(file_chunks['region_z'][0]))
+        file_pointer = storage.open_file(mcr_files[file_index])
+        for offset, index in zip(file_chunks['offset'], file_chunks['index']):
+            chunk_compression, chunk_raw = read_chunk(file_pointer, offset)
+            count = count_chunk_selection(selection, layers, *extract_chunk_blocks(
+                decompress(chunk_raw, chunk_compression), data_values))
+            chunk_z, chunk_x = divmod(int(index), REGION_SIZE)
+            top.add(count, (
+                region[0] * REGION_SIZE + chunk_x,
+                region[1] * REGION_SIZE + chunk_z))
+            regions[region] = regions.get(region, 0) + count
+        file_pointer.close()
+
+    return top, regions, chunks
+
+
+def read_chunk(file_pointer, offset):
+    """
+    Read the compressed payload of a chunk.
+
+    @param file_pointer: Region file opened in binary mode.
+    @param offset: Sector offset of the chunk.
+    @return: Compression method and compressed chunk data.
+    """
+
+    file_pointer.seek(offset * SECTOR_BYTES)
+    chunk_length = struct.unpack(
+        UNSIGNED_LONG_FORMAT,
+        file_pointer.read(CHUNK_LENGTH_BYTES))[0]
+    chunk_compression = struct.unpack(
+        UNSIGNED_CHAR_FORMAT,
+        file_pointer.read(COMPRESSION_BYTES))[0]
+    # The length includes the compression byte
+    chunk_raw = file_pointer.read(chunk_length - COMPRESSION_BYTES)
+
+    return chunk_compression, chunk_raw
+
+
+def extract_byte_array(chunk, tag_name):
+    """
+    Find a named byte array in an uncompressed chunk.
+
+    @param chunk: Uncompressed NBT data.
+    @param tag_name: Name of the TAG_Byte_Array.
+    @return: uint8 array sharing memory with chunk, or None if not found.
+    """
+
+    header = TAG_BYTE_ARRAY + struct.pack(
+        TAG_NAME_LENGTH_FORMAT, len(tag_name)) + tag_name
+    index = chunk.find(header)
+    if index == -1:
+        return None
+
+    index += len(header)
+    length = struct.unpack(
+        TAG_LENGTH_FORMAT,
+        chunk[index:index + TAG_LENGTH_BYTES])[0]
+
+    return np.frombuffer(
+        chunk,
+        dtype=np.uint8,
+        count=length,
+        offset=index + TAG_LENGTH_BYTES)
+
+
+def unpack_nibbles(packed):
+    """
+    Split every byte into two 4 bit values, low nibble first.
+
+    >>> unpack_nibbles(np.array([0x21, 0xf0], dtype=np.uint8))
+    array([ 1,  2,  0, 15], dtype=uint8)
+    """
+
+    nibbles = np.empty(packed.size * 2, dtype=np.uint8)
+    nibbles[0::2] = packed & 0x0f
+    nibbles[1::2] = packed >> 4
+    return nibbles
+
+
+def extract_chunk_blocks(chunk, data_values=False):
+    """
+    Get the block IDs and optionally data values of an uncompressed chunk.
+
+    @return: Tuple of uint8 arrays of block IDs and data values (or None),
+    one element per block.
+    """
+
+    blocks = extract_byte_array(chunk, BLOCKS_NBT_TAG)
+    data = None
+    if data_values:
+        data = unpack_nibbles(extract_byte_array(chunk, DATA_NBT_TAG))
+
+    return blocks, data
+
+
+def extract_chunk_biomes(chunk):
+    """
+    Get the biome of every column of an uncompressed chunk.
+
+    @return: uint8 array of biome IDs in the column order of the blocks, that
+    is indexed by local X * 16 + Z. UNKNOWN_BIOME if the chunk has no Biomes
+    array.
+    """
+
+    columns = CHUNK_BLOCKS / CHUNK_SIZE_Y
+    biomes = extract_byte_array(chunk, BIOMES_NBT_TAG)
+    if biomes is None or biomes.size != columns:
+        biomes = np.empty(columns, dtype=np.uint8)
+        biomes.fill(UNKNOWN_BIOME)
+        return biomes
+
+    # Stored indexed by Z * 16 + X
+    return biomes.reshape(CHUNK_SIZE_Z, -1).T.ravel()
+
+
+def extract_region_blocks(mcr_file, data_values=False, chunk_indexes=None):
+    """
+    This function reads all the chunks in a given region file.
+
+    Data values are only unpacked if data_values is set, so block ID only
+    queries don't pay for them. Only the chunks in chunk_indexes are read,
+    unless it is None.
+
+    Yields a tuple of the chunk index within the region and the arrays from
+    extract_chunk_blocks() for each chunk, in file order.
+    """
+
+    for index, chunk_compression, chunk_raw in read_region_chunks(
+        mcr_file, chunk_indexes):
+        chunk = decompress(chunk_raw, chunk_compression)
+
+        blocks, data = extract_chunk_blocks(chunk, data_values)
+        yield index, blocks, data
+
+
+def read_region_chunks(mcr_file, chunk_indexes=None):
+    """
+    Read the compressed chunks of a region file.
+
+    Only the chunks in chunk_indexes are read, unless it is None.
+
+    Yields a tuple of the chunk index within the region, the compression
+    method and the compressed chunk data for each chunk, in file order.
+    """
+
+    # Unpack block format
+    # <http://www.minecraftwiki.net/wiki/Beta_Level_Format>
+
+    file_pointer = storage.open_file(mcr_file)
+
+    for offset, index in read_chunk_locations(file_pointer):
+        if chunk_indexes is not None and index not in chunk_indexes:
+            continue
+        chunk_compression, chunk_raw = read_chunk(file_pointer, offset)
+        yield index, chunk_compression, chunk_raw
+
+    file_pointer.close()
+
+
+def decompress(string, method):
+    """
+    Decompress the given string with either of the
+    """
+
+    assert(method in (COMPRESSION_GZIP, COMPRESSION_DEFLATE))
+    if method == COMPRESSION_GZIP:
+        with GzipFile(fileobj=StringIO(string)) as gzip_file:
+            return gzip_file.read()
+
+    if method == COMPRESSION_DEFLATE:
+        return zlib.decompress(string)
+
+
+class PointWriter(object):
+    """
+    Stream the world coordinates of some block types to a .npy file.
+
+    The records have the POINT_DTYPE fields. The array length in the header is
+    only filled in by close(), so the file can be written one chunk at a time.
+    """
+
+    def __init__(self, path, block_type_hexes):
+        """
+        @param path: Output file path.
+        @param block_type_hexes: Hex IDs, optionally followed by a data value.
+        """
+        self.selection = block_type_mask(block_type_hexes)
+        self.data_values = needs_data_values(block_type_hexes)
+        self.length = 0
+        self.file_pointer = open(path, 'wb')
+        self.write_header()
+
+    def write_header(self):
+        """Write the .npy header, padded to a fixed size."""
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+            np.lib.format.dtype_to_descr(POINT_DTYPE), self.length)
+        header = header.ljust(NPY_HEADER_BYTES - len(NPY_MAGIC) - 3) + '\n'
+        self.file_pointer.write(
+            NPY_MAGIC + struct.pack('<H', len(header)) + header)
+
+    def chunk_points(self, blocks, data):
+        """
+        Find the selected blocks of a chunk.
+
+        @return: POINT_DTYPE array with coordinates within the chunk.
+        """
+        if self.data_values:
+            selected = self.selection.ravel()[
+                blocks.astype(np.intp) * DATA_VALUES + data]
+        else:
+            selected = self.selection[:, 0][blocks]
+        indexes = np.nonzero(selected)[0]
+
+        chunk_points = np.zeros(len(indexes), dtype=POINT_DTYPE)
+        x, z = np.divmod(indexes // CHUNK_SIZE_Y, CHUNK_SIZE_Z)
+        chunk_points['x'] = x
+        chunk_points['y'] = indexes % CHUNK_SIZE_Y
+        chunk_points['z'] = z
+        chunk_points['id'] = blocks[indexes]
+        if self.data_values:
+            chunk_points['data'] = data[indexes]
+        return chunk_points
+
+    def write(self, chunk_points, region_xz, index):
+        """
+        Append the points of a chunk.
+
+        @param chunk_points: From chunk_points().
+        @param region_xz: Region coordinates.
+        @param index: Chunk index within the region.
+        """
+        if not len(chunk_points):
+            return
+        world_points = chunk_points.copy()
+        world_points['x'] += (
+            region_xz[0] * REGION_SIZE + index % REGION_SIZE) * CHUNK_SIZE_Z
+        world_points['z'] += (
+            region_xz[1] * REGION_SIZE + index // REGION_SIZE) * CHUNK_SIZE_Z
+        world_points.tofile(self.file_pointer)
+        self.length += len(world_points)
+
+    def close(self):
+        """Fill in the array length and close the file."""
+        self.file_pointer.seek(0)
+        self.write_header()
+        self.file_pointer.close()
+
+
+class LRUCache(object):
+    """Least recently used cache, counting hits and misses."""
+
+    def __init__(self, size, max_bytes=None):
+        """
+        @param size: Maximum number of entries, or None for no limit.
+        @param max_bytes: Maximum total size of the entries as given to put(),
+        or None for no limit. The newest entry is kept even if it is larger.
+        """
+        self.size = size
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.entry_bytes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        """Whether a key is cached, without counting or reordering."""
+        return key in self.entries
+
+    def get(self, key):
+        """Get a value and mark it as recently used, or None if missing."""
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value, nbytes=0):
+        """
+        Add a value, evicting the least recently used ones if full.
+
+        @param nbytes: Size of the value, for max_bytes.
+        """
+        if key in self.entries:
+            del self.entries[key]
+            self.bytes -= self.entry_bytes.pop(key)
+        self.entries[key] = value
+        self.entry_bytes[key] = nbytes
+        self.bytes += nbytes
+        while len(self.entries) > 1 and (
+            (self.size is not None and len(self.entries) > self.size)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            old_key = self.entries.popitem(last=False)[0]
+            self.bytes -= self.entry_bytes.pop(old_key)
+
+    def stats(self):
+        """Hit rate summary."""
+        lookups = self.hits + self.misses
+        return '%d hits, %d misses (%.1f%% hit rate)' % (
+            self.hits,
+            self.misses,
+            self.hits * 100.0 / lookups if lookups else 0)
+
+
+class ChunkBrowser(object):
+    """
+    Per layer counts of single chunks, for clicking around a map.
+
+    Decompressed chunks and open region files share one LRUCache with a
+    memory cap. Region files are memory mapped, or kept in memory when they
+    are in an archive.
+    """
+
+    def __init__(self, mcr_files, block_type_hexes, max_bytes):
+        """
+        @param mcr_files: Region file paths or catalog.RegionCatalog.
+        @param block_type_hexes: Block types to count.
+        @param max_bytes: Memory cap of the cache.
+        """
+        self.mcr_files = catalog.from_paths(mcr_files)
+        self.block_type_hexes = block_type_hexes
+        self.data_values = needs_data_values(block_type_hexes)
+        self.cache = LRUCache(None, max_bytes)
+
+    def region_file(self, region):
+        """Open region file, or None if there is no such region."""
+
+        key = ('region', region)
+        region_file = self.cache.get(key)
+        file_index = self.mcr_files.find(region)
+        if region_file is None and file_index is not None:
+            file_pointer = storage.open_file(self.mcr_files[file_index])
+            if isinstance(file_pointer, file):
+                region_file = mmap.mmap(
+                    file_pointer.fileno(), 0, access=mmap.ACCESS_READ)
+                file_pointer.close()
+                nbytes = len(region_file)
+            else:
+                region_file = file_pointer
+                nbytes = file_pointer.size
+            self.cache.put(key, region_file, nbytes)
+        return region_file
+
+    def chunk_blocks(self, chunk_xz):
+        """
+        Block IDs and data values of a chunk.
+
+        @param chunk_xz: Global chunk coordinates.
+        @return: As from extract_chunk_blocks(), or None if there is no such
+        chunk.
+        """
+
+        key = ('chunk', chunk_xz)
+        if key in self.cache:
+            return self.cache.get(key)
+
+        region = (chunk_xz[0] // REGION_SIZE, chunk_xz[1] // REGION_SIZE)
+        region_file = self.region_file(region)
+        chunk_blocks = None
+        if region_file is not None:
+            chunk_blocks = extract_region_chunk_blocks(
+                self.mcr_files[self.mcr_files.find(region)], chunk_xz,
+                self.data_values, region_file)
+        nbytes = 0
+        if chunk_blocks is not None:
+            # Copies, so that the decompressed chunk isn't kept as well
+            chunk_blocks = tuple(
+                None if array is None else array.copy()
+                for array in chunk_blocks)
+            nbytes = sum(
+                array.nbytes for array in chunk_blocks if array is not None)
+        self.cache.put(key, chunk_blocks, nbytes)
+        return chunk_blocks
+
+    def chunk_counts(self, chunk_xz):
+        """
+        Count the block types per layer in a chunk.
+
+        @return: Array with one row of 128 layer counts per block type, or None
+        if there is no such chunk.
+        """
+
+        chunk_blocks = self.chunk_blocks(chunk_xz)
+        if chunk_blocks is None:
+            return None
+        return select_counts(count_blocks(*chunk_blocks), self.block_type_hexes)
+
+    def prefetch(self, chunk_xz):
+        """Read the neighbors of a chunk into the cache."""
+        for dx, dz in clusters.CHUNK_NEIGHBORS:
+            self.chunk_blocks((chunk_xz[0] + dx, chunk_xz[1] + dz))
+
+
+class Checkpoint(object):
+    """Scan state saved now and then, to resume an interrupted scan."""
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        """
+        @param path: Checkpoint file path.
+        @param interval: Minimum seconds between saves.
+        """
+        self.path = path
+        self.interval = interval
+        self.saved = time.time()
+        #: Chunks done by the run which saved the checkpoint
+        self.resumed = 0
+
+    def load(self, arguments):
+        """
+        Read the checkpoint, if any.
+
+        @param arguments: Everything the saved state depends on, which must
+        be the same as when it was saved.
+        @return: Dictionary with the signatures of the region files, the done
+        chunk keys and the engine state, or None if there is no checkpoint.
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+        if checkpoint['arguments'] != arguments:
+            raise Usage('The checkpoint {0} is from a scan with other '\
+                'arguments.'.format(self.path))
+        return checkpoint
+
+    def due(self):
+        """Whether the interval has passed since the last save."""
+        return time.time() - self.saved >= self.interval
+
+    def save(self, arguments, signatures, done, state):
+        """Replace the checkpoint, see storage.replace_file()."""
+        storage.replace_file(self.path, lambda checkpoint_file: pickle.dump({
+            'arguments': arguments,
+            'signatures': signatures,
+            'done': done,
+            'state': state}, checkpoint_file, pickle.HIGHEST_PROTOCOL))
+        self.saved = time.time()
+
+
+class TopList(object):
+    """The items with the largest counts so far, in a fixed size heap."""
+
+    def __init__(self, size):
+        self.size = size
+        #: Smallest count first
+        self.heap = []
+
+    def add(self, count, key):
+        """Keep an item if it is among the largest, and not zero."""
+        if not count:
+            return
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (count, key))
+        elif (count, key) > self.heap[0]:
+            heapq.heapreplace(self.heap, (count, key))
+
+    def update(self, other):
+        """Merge another TopList, like one from a worker process."""
+        for count, key in other.heap:
+            self.add(count, key)
+
+    def items(self):
+        """Count and key pairs, largest count first."""
+        return sorted(self.heap, reverse=True)
+
+
+class BlockCategory(tuple):
+    """Named block types, counted together."""
+
+    def __new__(cls, name, block_type_hexes):
+        """
+        @param name: Category name, see load_categories().
+        @param block_type_hexes: Hex IDs, optionally followed by a data value.
+        """
+        category = super(BlockCategory, cls).__new__(cls, block_type_hexes)
+        category.name = name
+        return category
+
+    def __getnewargs__(self):
+        # For pickle, which would otherwise pass only the block types
+        return self.name, tuple(self)
+
+
+class Usage(Exception):
+    """Command-line usage error"""
+
+    def __init__(self, msg):
+        super(Usage, self).__init__(msg)
+        self.msg = msg + '\nSee --help for more information.'
+
+
+def main(argv=None):
+    """Argument handling."""
+
+    # things for --help and --version options
+    prog = os.path.basename(__file__)
+    description = 'mian: Mine analysis - Graph block types to altitude ' \
+        'in a Minecraft save game <http://github.com/l0b0/mian>'
+    usage = 'usage: %prog [options] <World directory>\n' \
+        '       %prog [options] diff <Old world directory> <New world directory>\n' \
+        '       %prog [options] top <World directory>\n' \
+        '%prog --help for options.'
+    version = __version__
+
+    # populating the parser
+    parser = OptionParser(usage = usage, version = version,
+        description = description, prog = prog)
+
+    parser.add_option("-b", "--blocks", dest="block_type_names", default = None,
         help="Specify block types to include as a comma-separated list, using "\
         "either the block types or hex values from the list. Specify ALL to include "\
-        "all block types.")
+        "all block types. Append :<data value> to count a single variant, like "\
+        "wool:14, or :* for all of them. ALL:* counts every variant. "\
+        "@<category> counts a category of block types together, like @ores, "\
+        "see --list and --categories.")
+    parser.add_option("--categories", default = None, dest = "categories_path",
+        help = "Read more block categories for --blocks from this file. "\
+        "Default: %s if it exists" % CATEGORIES_PATH)
     parser.add_option("-l", "--list", action = "store_true", dest = "print_blocks",
         help = "List available block types and their names "\
         "(from <http://www.minecraftwiki.net/wiki/Data_values>)")
@@ -689,24 +3572,135 @@ def main(argv=None):
         help = "The resolution in dots per inch for the --output option. "\
         "Default = 100 (800x600).")
     parser.add_option("--plot-mode", "-p", type = 'string', default = 'normal', dest = 'plot_mode',
-        help = "The plot modes are: normal, colormap, wireframe (3D) and table. "\
-        "Warning! Wireframe can be really resource hungry with big maps")
+        help = "The plot modes are: normal, heatmap (log scaled block types "\
+        "by layer, fast with -b ALL), colormap, wireframe (3D), table and tiles "\
+        "(zoomable z/x/y PNG map tiles of the colormap, written to the --output "\
+        "directory and updated incrementally). "\
+        "surface, surface-table and surface-map show the terrain height from "\
+        "the chunk height maps instead of counting blocks. "\
+        "entities, entities-table and entities-map count the entities and "\
+        "tile entities, like mobs, items, chests and spawners, by ID. "\
+        "biomes and biomes-table count the block types in each biome, for "\
+        "worlds with biomes saved in the chunks. "\
+        "exposure and exposure-table count the blocks next to air, liquids "\
+        "or other transparent blocks separately from the enclosed ones. "\
+        "stats shows the number of chunks and bytes without reading any "\
+        "chunks. "\
+        "clusters lists how many veins of each size the selected block types "\
+        "form, counting diagonal neighbors, and where the largest ones are. "\
+        "Wireframe is resource hungry, so big maps are reduced, see "\
+        "--max-cells.")
+    parser.add_option("-k", "--top", type = 'int', default = 10, dest = "top_size",
+        help = "Number of chunks listed by the top command, which ranks the "\
+        "chunks by how many blocks of the selected types they have. "\
+        "Default: 10")
+    parser.add_option("--top-regions", action = "store_true", default = False,
+        dest = "top_regions", help = "Rank regions instead of chunks in the "\
+        "top command.")
+    parser.add_option("--layers", default = None, dest = "layers",
+        help = "Only count the layers from LOW up to HIGH in the top command, "\
+        "as LOW:HIGH like 0:16. Either can be left out.")
+    parser.add_option("--json", action = "store_true", default = False, dest = "json",
+        help = "Write the top command result as JSON.")
+    parser.add_option("--max-cells", type = 'int', default = MAX_CELLS,
+        dest = "max_cells",
+        help = "Most cells to draw in the colormap and wireframe plot modes. "\
+        "Larger maps are reduced by pooling 2x2, 4x4 and so on chunks into "\
+        "each cell. 0 draws every chunk. Default: %d" % MAX_CELLS)
+    parser.add_option("--pool", type = 'choice', choices = ['sum', 'max'],
+        default = 'sum', dest = 'pool',
+        help = "How --max-cells reduces the chunks of a cell: sum or max. "\
+        "Default: sum")
+    parser.add_option("--depth", action = "store_true", default = False, dest = "depth",
+        help = "Count blocks per depth below the top non-air block of their "\
+        "column instead of per layer. Works with the normal, heatmap and "\
+        "table plot modes.")
+    parser.add_option("--export-points", default = None, dest = "points_path",
+        help = "Write the x, y, z, id and data value of every block of the "\
+        "selected types to this .npy file while counting. Works with the normal, "\
+        "heatmap and table plot modes.")
+    parser.add_option("--surface-stat", type = 'choice', choices = ['mean', 'max'],
+        default = 'mean', dest = 'surface_stat',
+        help = "Height per chunk in the surface-map plot mode: mean or max. "\
+        "Default: mean")
+    parser.add_option("--entity-ids", default = None, dest = "entity_ids",
+        help = "Only count these entity and tile entity IDs in the entities "\
+        "plot modes, as a comma-separated list like MobSpawner,Chest,Creeper. "\
+        "Default: all")
+    parser.add_option("--chunk-cache", type = 'int', default = 0, dest = "chunk_cache",
+        help = "Remember the counts of this many distinct chunks, so that byte "\
+        "identical chunks like in superflat or pre-generated worlds are only "\
+        "decompressed once. Default: 0 (off)")
+    parser.add_option("--browse-memory", type = 'int', default = 64, dest = "browse_memory",
+        help = "Clicking a chunk in the colormap plot mode shows its layers. "\
+        "Keep up to this many MiB of chunks and region files around for that, "\
+        "including the neighbors of the clicked chunk. Default: 64")
+    parser.add_option("--max-memory", type = 'int', default = None, dest = "max_memory",
+        help = "Fit the scan in this many MiB of memory by using fewer --jobs "\
+        "and counting fewer chunks at a time, estimated from the region "\
+        "headers. A quarter goes to --chunk-cache if used. Default: no limit")
+    parser.add_option("--since", default = None, dest = "since",
+        help = "Only read chunks saved at or after this UTC date, like "\
+        "2012-02-03 or '2012-02-03 12:30'. Region files last modified "\
+        "before it are skipped.")
+    parser.add_option("--until", default = None, dest = "until",
+        help = "Only read chunks saved before this UTC date.")
+    parser.add_option("--checkpoint", default = None, dest = "checkpoint_path",
+        help = "Save the progress to this file now and then, and resume from "\
+        "it if it exists. Rerun with the same arguments to resume.")
+    parser.add_option("--checkpoint-interval", type = 'int', default = CHECKPOINT_INTERVAL,
+        dest = "checkpoint_interval",
+        help = "Seconds between checkpoints. Default: %d" % CHECKPOINT_INTERVAL)
+    parser.add_option("-j", "--jobs", type = 'int', default = None, dest = "jobs",
+        help = "Number of worker processes. Default: one per CPU for the "\
+        "tiles plot mode, otherwise 1. The normal, heatmap and table plot "\
+        "modes split the chunks between the processes by compressed size.")
     parser.add_option("--xticks", type = 'int', default = 8, dest = 'xticks',
         help = "X axis ticks interval. Default: 8")
     parser.add_option("--no-totals", action = "store_false", default = True, dest = "totals",
         help = "Don't show totals for each graph")
 
-    (options, args) = parser.parse_args()
+    (options, args) = parser.parse_args(argv)
+
+    # Avoid 'Broken pipe' message when canceling piped command
+    if SUPPORT_SIGNALS:
+        signal(SIGPIPE, SIG_DFL)
+
+    try:
+        categories = load_categories(options.categories_path)
+    except Usage as error:
+        parser.error(str(error))
 
     # print block types if asked for
     if options.print_blocks:
-        print_block_types()
+        print_block_types(categories)
         return 0
 
     # check things
     if len(args) == 0:
         parser.error('need to specify a save directory')
 
+    options.old_world_dir = None
+    if args[0] == 'diff' and len(args) == 3:
+        options.old_world_dir = args[1]
+        args = args[2:]
+
+    options.top = None
+    if args[0] == 'top' and len(args) == 2:
+        if not options.top_size > 0:
+            parser.error('top should be an integer greater than 0, given \'%s\'' % options.top_size)
+        layers = None
+        if options.layers is not None:
+            try:
+                layers = parse_layers(options.layers)
+            except ValueError as error:
+                parser.error(str(error))
+        options.top = TopQuery(options.top_size, options.top_regions, layers)
+        options.plot_mode = 'top'
+        args = args[1:]
+    elif options.top_regions or options.layers is not None or options.json:
+        parser.error('--top-regions, --layers and --json only work with top')
+
     if len(args) != 1:
         parser.error('need to specify exactly one save directory')
 
@@ -716,32 +3710,91 @@ def main(argv=None):
     if not options.dpi > 0:
         parser.error('dpi should be an interger greater than 0, given \'%s\'' % options.dpi)
 
-    plot_modes = ["normal", "table", "colormap", "wireframe"]
-    if options.plot_mode not in plot_modes:
+    plot_modes = ["normal", "table", "heatmap", "colormap", "wireframe", "tiles",
+        "surface", "surface-table", "surface-map", "entities",
+        "entities-table", "entities-map", "biomes", "biomes-table",
+        "exposure", "exposure-table", "clusters", "stats"]
+    if options.plot_mode not in plot_modes and options.top is None:
         parser.error('The plot mode \'{0}\' is not recognized'.format(options.plot_mode))
 
+    if options.depth and options.plot_mode not in ('normal', 'table', 'heatmap'):
+        parser.error('--depth only works with the normal, heatmap and table plot modes')
+
+    if options.points_path and options.plot_mode not in ('normal', 'table', 'heatmap'):
+        parser.error('--export-points only works with the normal, heatmap and table plot modes')
+
+    if options.entity_ids is not None:
+        if not options.plot_mode.startswith('entities'):
+            parser.error('--entity-ids only works with the entities plot modes')
+        options.entity_ids = [
+            entity_id.strip() for entity_id in options.entity_ids.split(',')
+            if entity_id.strip()]
+
+    if options.plot_mode == 'tiles' and options.save_path is None:
+        parser.error('The tiles plot mode needs an --output directory')
+
+    if options.chunk_cache < 0:
+        parser.error('chunk cache size should not be negative, given \'%s\'' % options.chunk_cache)
+
+    if options.max_cells < 0:
+        parser.error('max cells should not be negative, given \'%s\'' % options.max_cells)
+
+    if options.max_memory is not None and not options.max_memory > 0:
+        parser.error('max memory should be an integer greater than 0, given \'%s\'' % options.max_memory)
+
+    if options.browse_memory < 0:
+        parser.error('browse memory should not be negative, given \'%s\'' % options.browse_memory)
+
+    if options.jobs is not None and not options.jobs > 0:
+        parser.error('jobs should be an integer greater than 0, given \'%s\'' % options.jobs)
+
+    if options.jobs > 1 and options.plot_mode in ('normal', 'table', 'heatmap') \
+        and (options.chunk_cache or options.points_path):
+        parser.error('--chunk-cache and --export-points only work with one job')
+
+    if options.checkpoint_path and (options.points_path
+        or options.plot_mode in ('tiles', 'stats')):
+        parser.error('--checkpoint doesn\'t work with --export-points or the tiles and stats plot modes')
+
+    for option in ('since', 'until'):
+        if getattr(options, option) is not None:
+            try:
+                setattr(options, option, parse_date(getattr(options, option)))
+            except ValueError as error:
+                parser.error(str(error))
+
+    if (options.since is not None or options.until is not None) \
+        and options.plot_mode == 'tiles':
+        parser.error('--since and --until don\'t work with the tiles plot mode')
+
+    if options.old_world_dir is not None:
+        if options.plot_mode not in ('normal', 'table', 'colormap', 'wireframe'):
+            parser.error('diff only works with the normal, table, colormap and wireframe plot modes')
+        if options.log or options.chunk_cache or options.points_path \
+            or options.checkpoint_path or options.jobs > 1 \
+            or options.since is not None or options.until is not None:
+            parser.error('--log, --chunk-cache, --export-points, --checkpoint, --jobs, --since and --until don\'t work with diff')
+
+    if options.checkpoint_interval < 0:
+        parser.error('checkpoint interval should not be negative, given \'%s\'' % options.checkpoint_interval)
+
     world_dir = args[0]
 
     # Look up block_types
     if options.block_type_names == None:
         block_type_names = DEFAULT_BLOCK_TYPES
-    elif options.block_type_names.upper() == 'ALL':
-        # FIXME ugly: we now add names of known block, only to later convert them back to hex codes.
-        block_type_names = [BLOCK_TYPES[chr(i)][0] for i in xrange(0,256) if BLOCK_TYPES[chr(i)] != [UNUSED_NAME]]
     else:
         block_type_names = options.block_type_names.split(',')
 
-    block_type_hexes = []
-    for block_type_name in block_type_names:
-        found_hexes = lookup_block_type(block_type_name)
-        for found_hex in found_hexes:
-            if found_hex not in block_type_hexes:  # Avoid duplicates
-                block_type_hexes.append(found_hex)
+    block_type_hexes = lookup_block_types(block_type_names, categories)
 
     if block_type_hexes == []:
         parser.error('No proper blocks given!')
 
-    mian(world_dir, block_type_hexes, options)
+    try:
+        mian(world_dir, block_type_hexes, options)
+    except Usage as error:
+        parser.error(str(error))
 
 
 if __name__ == '__main__':
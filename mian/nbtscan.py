@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming NBT scanner for compressed chunks
+<http://www.minecraftwiki.net/wiki/NBT_Format>
+
+Only the requested tags are read. Everything else is skipped using the length
+prefixes, and decompression stops as soon as all the requested tags are found.
+"""
+
+import struct
+import zlib
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+#: Struct formats of the fixed size payloads
+SCALAR_FORMATS = {
+    TAG_BYTE: '>b',
+    TAG_SHORT: '>h',
+    TAG_INT: '>i',
+    TAG_LONG: '>q',
+    TAG_FLOAT: '>f',
+    TAG_DOUBLE: '>d',
+}
+
+#: Element sizes of the array payloads
+ARRAY_ELEMENT_BYTES = {
+    TAG_BYTE_ARRAY: 1,
+    TAG_INT_ARRAY: 4,
+    TAG_LONG_ARRAY: 8,
+}
+
+#: Same as in mian.py
+COMPRESSION_GZIP = 1
+COMPRESSION_DEFLATE = 2
+
+#: Compressed bytes inflated at a time
+INFLATE_BYTES = 4096
+
+
+class ChunkStream(object):
+    """Compressed chunk data, inflated on demand."""
+
+    def __init__(self, chunk_raw, compression):
+        """
+        @param chunk_raw: Compressed chunk data.
+        @param compression: COMPRESSION_GZIP or COMPRESSION_DEFLATE.
+        """
+        assert(compression in (COMPRESSION_GZIP, COMPRESSION_DEFLATE))
+        if compression == COMPRESSION_GZIP:
+            self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.inflater = zlib.decompressobj()
+        self.chunk_raw = chunk_raw
+        self.raw_position = 0
+        self.buffer = ''
+        self.position = 0
+        #: Uncompressed bytes produced so far
+        self.inflated = 0
+
+    def fill(self, size):
+        """Inflate until at least size bytes are buffered."""
+        pieces = [self.buffer[self.position:]]
+        available = len(pieces[0])
+        while available < size:
+            if self.raw_position >= len(self.chunk_raw):
+                raise EOFError('Truncated chunk')
+            piece = self.inflater.decompress(
+                self.chunk_raw[
+                    self.raw_position:self.raw_position + INFLATE_BYTES])
+            self.raw_position += INFLATE_BYTES
+            self.inflated += len(piece)
+            pieces.append(piece)
+            available += len(piece)
+        self.buffer = ''.join(pieces)
+        self.position = 0
+
+    def read(self, size):
+        """Read exactly size bytes."""
+        if len(self.buffer) - self.position < size:
+            self.fill(size)
+        data = self.buffer[self.position:self.position + size]
+        self.position += size
+        return data
+
+    def skip(self, size):
+        """Skip size bytes without keeping them."""
+        available = len(self.buffer) - self.position
+        while size > available:
+            size -= available
+            self.buffer = ''
+            self.position = 0
+            self.fill(1)
+            available = len(self.buffer)
+        self.position += size
+
+    def unpack(self, format):
+        """Read and unpack a struct."""
+        return struct.unpack(format, self.read(struct.calcsize(format)))
+
+
+def read_tag_header(stream):
+    """
+    Read the type and name of the next tag.
+
+    @return: Tag type and name, name is None for TAG_End.
+    """
+
+    tag_type = ord(stream.read(1))
+    if tag_type == TAG_END:
+        return tag_type, None
+    name_length = stream.unpack('>H')[0]
+    return tag_type, stream.read(name_length)
+
+
+def skip_payload(stream, tag_type):
+    """Skip a tag payload without materializing it."""
+
+    if tag_type in SCALAR_FORMATS:
+        stream.skip(struct.calcsize(SCALAR_FORMATS[tag_type]))
+    elif tag_type in ARRAY_ELEMENT_BYTES:
+        length = stream.unpack('>i')[0]
+        stream.skip(length * ARRAY_ELEMENT_BYTES[tag_type])
+    elif tag_type == TAG_STRING:
+        stream.skip(stream.unpack('>H')[0])
+    elif tag_type == TAG_LIST:
+        element_type = ord(stream.read(1))
+        length = stream.unpack('>i')[0]
+        if element_type in SCALAR_FORMATS:
+            stream.skip(length * struct.calcsize(SCALAR_FORMATS[element_type]))
+        else:
+            for index in xrange(length):
+                skip_payload(stream, element_type)
+    elif tag_type == TAG_COMPOUND:
+        while True:
+            child_type, child_name = read_tag_header(stream)
+            if child_type == TAG_END:
+                break
+            skip_payload(stream, child_type)
+    else:
+        raise ValueError('Unknown tag type %d' % tag_type)
+
+
+def read_payload(stream, tag_type):
+    """
+    Read a tag payload.
+
+    Arrays are returned as strings, lists as lists and compounds as
+    dictionaries.
+    """
+
+    if tag_type in SCALAR_FORMATS:
+        return stream.unpack(SCALAR_FORMATS[tag_type])[0]
+    elif tag_type in ARRAY_ELEMENT_BYTES:
+        length = stream.unpack('>i')[0]
+        return stream.read(length * ARRAY_ELEMENT_BYTES[tag_type])
+    elif tag_type == TAG_STRING:
+        return stream.read(stream.unpack('>H')[0])
+    elif tag_type == TAG_LIST:
+        element_type = ord(stream.read(1))
+        length = stream.unpack('>i')[0]
+        return [read_payload(stream, element_type) for index in xrange(length)]
+    elif tag_type == TAG_COMPOUND:
+        compound = {}
+        while True:
+            child_type, child_name = read_tag_header(stream)
+            if child_type == TAG_END:
+                return compound
+            compound[child_name] = read_payload(stream, child_type)
+    raise ValueError('Unknown tag type %d' % tag_type)
+
+
+def read_list_fields(stream, tag_type, names):
+    """
+    Read some fields of every compound in a list, skipping everything else.
+
+    @param names: Names of the fields to read, like ('id', 'y').
+    @return: List with a dictionary of the fields found in each compound,
+    empty if it isn't a list of compounds.
+    """
+
+    if tag_type != TAG_LIST:
+        skip_payload(stream, tag_type)
+        return []
+
+    element_type = ord(stream.read(1))
+    length = stream.unpack('>i')[0]
+    if element_type != TAG_COMPOUND:
+        for index in xrange(length):
+            skip_payload(stream, element_type)
+        return []
+
+    elements = []
+    for index in xrange(length):
+        fields = {}
+        while True:
+            child_type, child_name = read_tag_header(stream)
+            if child_type == TAG_END:
+                break
+            if child_name in names:
+                fields[child_name] = read_payload(stream, child_type)
+            else:
+                skip_payload(stream, child_type)
+        elements.append(fields)
+
+    return elements
+
+
+def find_tags(stream, paths, read=read_payload):
+    """
+    Read some tags, skipping everything else.
+
+    Stops reading as soon as all the tags are found.
+
+    @param stream: ChunkStream positioned at the root tag.
+    @param paths: Tuples of compound tag names below the root tag, like
+    ('Level', 'HeightMap').
+    @param read: Function of the stream and the tag type which reads the
+    payload of a found tag.
+    @return: Dictionary of the paths found to their payloads, as from
+    read_payload() or read.
+    """
+
+    wanted = set(paths)
+    # Compounds on the way to a wanted tag
+    parents = set(path[:length] for path in wanted for length in range(len(path)))
+    found = {}
+
+    root_type, root_name = read_tag_header(stream)
+    if root_type != TAG_COMPOUND:
+        return found
+
+    # Walk the tree as a stack of the names of the open compounds
+    path = ()
+    while len(found) < len(wanted):
+        tag_type, tag_name = read_tag_header(stream)
+        if tag_type == TAG_END:
+            if not path:
+                break
+            path = path[:-1]
+            continue
+
+        tag_path = path + (tag_name,)
+        if tag_path in wanted:
+            found[tag_path] = read(stream, tag_type)
+        elif tag_type == TAG_COMPOUND and tag_path in parents:
+            path = tag_path
+        else:
+            skip_payload(stream, tag_type)
+
+    return found
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Read world files from directories and from zip and tar backups alike.
+
+A file in an archive has the path of the archive followed by the member name,
+like backups/World1.zip/World1/region/r.0.0.mcr, so paths can be joined,
+split and globbed as usual without extracting anything.
+
+Zip members and the members of uncompressed tar files are read in place.
+Compressed tar files can only be read front to back, so they are listed in one
+pass which keeps the start of every member, where region files have their
+headers. Reading the members in archive order, like glob() returns them, then
+takes one more pass.
+"""
+
+from collections import OrderedDict
+import fnmatch
+from glob import glob as glob_paths
+import os
+import posixpath
+from StringIO import StringIO
+import struct
+import tarfile
+import time
+import zipfile
+
+#: Archive file name endings
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+
+#: Bytes kept from the start of every member of a compressed tar file, enough
+#: for the location and timestamp tables of a region file
+PREFIX_BYTES = 8192
+
+#: Opened archives by path
+_archives = {}
+
+
+def is_archive(path):
+    """Whether a path is a zip or tar file."""
+    return path.lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS) \
+        and os.path.isfile(path)
+
+
+def split_path(path):
+    """
+    Split a path at the archive it is in, if any.
+
+    @return: Archive path and member name with / separators, empty for the
+    archive itself, or None and the path.
+    """
+
+    head = os.path.normpath(path)
+    names = []
+    while True:
+        if is_archive(head):
+            return head, '/'.join(reversed(names))
+        parent, name = os.path.split(head)
+        if not name or parent == head:
+            return None, path
+        names.append(name)
+        head = parent
+
+
+def get_archive(archive_path):
+    """ZipArchive or TarArchive, opened once per process."""
+    if archive_path not in _archives:
+        if archive_path.lower().endswith(ZIP_EXTENSIONS):
+            _archives[archive_path] = ZipArchive(archive_path)
+        else:
+            _archives[archive_path] = TarArchive(archive_path)
+    return _archives[archive_path]
+
+
+def open_file(path):
+    """
+    Open a file for binary reading.
+
+    @raise IOError: If there is no such file.
+    """
+
+    archive_path, name = split_path(path)
+    if archive_path is None:
+        return open(path, 'rb')
+    return get_archive(archive_path).open(name)
+
+
+def stat(path):
+    """
+    Size and modification time of a file.
+
+    @raise OSError: If there is no such file.
+    """
+
+    archive_path, name = split_path(path)
+    if archive_path is None:
+        result = os.stat(path)
+        return result.st_size, result.st_mtime
+    return get_archive(archive_path).stat(name)
+
+
+def replace_file(path, write):
+    """
+    Write a file which other runs may be reading.
+
+    The new file is written next to it first, so an interruption leaves
+    either the old or the new file.
+
+    @param path: File path, not in an archive.
+    @param write: Function writing the contents to an open binary file.
+    """
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as new_file:
+        write(new_file)
+        new_file.flush()
+        os.fsync(new_file.fileno())
+    if os.name == 'nt' and os.path.exists(path):
+        # Windows can't rename over an existing file
+        os.remove(path)
+    os.rename(temporary_path, path)
+
+
+def isdir(path):
+    """Whether a path is a directory, or the root of an archive."""
+
+    archive_path, name = split_path(path)
+    if archive_path is None:
+        return os.path.isdir(path)
+    return not name or name in get_archive(archive_path).directories
+
+
+def glob(pattern):
+    """
+    Find the files matching a pattern.
+
+    @return: Paths in archive order in archives, otherwise as from glob.glob().
+    """
+
+    archive_path, name_pattern = split_path(pattern)
+    if archive_path is None:
+        return glob_paths(pattern)
+
+    # Unlike fnmatch, * doesn't cross directories
+    name_depth = name_pattern.count('/')
+    return [
+        os.path.join(archive_path, *name.split('/'))
+        for name in get_archive(archive_path).members
+        if name.count('/') == name_depth
+        and fnmatch.fnmatchcase(name, name_pattern)]
+
+
+def member_name(member):
+    """Tar member name without any leading ./ as from tar -C world ."""
+    return posixpath.normpath(member.name).lstrip('/')
+
+
+class MemberFile(object):
+    """Read only view of part of a file."""
+
+    def __init__(self, file_pointer, start, size, prefix=''):
+        """
+        @param file_pointer: File containing the member, closed with it.
+        @param start: Offset of the member in the file.
+        @param size: Member size.
+        @param prefix: Start of the member, read from memory instead.
+        """
+        self.file_pointer = file_pointer
+        self.start = start
+        self.size = size
+        self.prefix = prefix
+        self.position = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.size - self.position
+        size = max(0, min(size, self.size - self.position))
+        if self.position + size <= len(self.prefix):
+            data = self.prefix[self.position:self.position + size]
+        else:
+            self.file_pointer.seek(self.start + self.position)
+            data = self.file_pointer.read(size)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.file_pointer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ZipArchive(object):
+    """Members of a zip file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.zip_file = zipfile.ZipFile(path)
+        self.members = OrderedDict(
+            (info.filename, info) for info in self.zip_file.infolist()
+            if not info.filename.endswith('/'))
+        self.directories = set(
+            name.rsplit('/', depth)[0]
+            for name in self.members
+            for depth in xrange(1, name.count('/') + 1))
+
+    def stat(self, name):
+        if name not in self.members:
+            raise OSError('No such file in {0}: {1}'.format(self.path, name))
+        info = self.members[name]
+        return info.file_size, time.mktime(info.date_time + (0, 0, -1))
+
+    def open(self, name):
+        if name not in self.members:
+            raise IOError('No such file in {0}: {1}'.format(self.path, name))
+        info = self.members[name]
+
+        if info.compress_type != zipfile.ZIP_STORED:
+            # Not seekable, so inflated into memory
+            data = self.zip_file.read(info)
+            return MemberFile(StringIO(data), 0, len(data))
+
+        file_pointer = open(self.path, 'rb')
+        file_pointer.seek(info.header_offset)
+        header = struct.unpack(
+            zipfile.structFileHeader,
+            file_pointer.read(zipfile.sizeFileHeader))
+        # The name and extra field lengths of the local header
+        start = info.header_offset + zipfile.sizeFileHeader + \
+            header[10] + header[11]
+        return MemberFile(file_pointer, start, info.file_size)
+
+
+class TarArchive(object):
+    """Members of a tar file, optionally compressed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.members = OrderedDict()
+        self.prefixes = {}
+        try:
+            with tarfile.open(path, 'r:') as tar_file:
+                for member in tar_file:
+                    if member.isreg():
+                        self.members[member_name(member)] = member
+            self.compressed = False
+        except tarfile.ReadError:
+            self.compressed = True
+            self.members.clear()
+            with tarfile.open(path, 'r|*') as tar_file:
+                for member in tar_file:
+                    if member.isreg():
+                        self.members[member_name(member)] = member
+                        self.prefixes[member_name(member)] = tar_file.extractfile(
+                            member).read(PREFIX_BYTES)
+        self.directories = set(
+            name.rsplit('/', depth)[0]
+            for name in self.members
+            for depth in xrange(1, name.count('/') + 1))
+        self.tar_file = None
+
+    def stat(self, name):
+        if name not in self.members:
+            raise OSError('No such file in {0}: {1}'.format(self.path, name))
+        member = self.members[name]
+        return member.size, member.mtime
+
+    def open(self, name):
+        if name not in self.members:
+            raise IOError('No such file in {0}: {1}'.format(self.path, name))
+        member = self.members[name]
+
+        if not self.compressed:
+            return MemberFile(
+                open(self.path, 'rb'), member.offset_data, member.size)
+
+        if self.tar_file is None:
+            # Seeking forward only decompresses up to the member, so reading
+            # in archive order doesn't start over
+            self.tar_file = tarfile.open(self.path)
+        return MemberFile(
+            SharedFile(self.tar_file.fileobj), member.offset_data,
+            member.size, self.prefixes[name])
+
+
+class SharedFile(object):
+    """File which is left open for the next member when closed."""
+
+    def __init__(self, file_pointer):
+        self.file_pointer = file_pointer
+
+    def seek(self, offset):
+        if self.file_pointer.tell() != offset:
+            self.file_pointer.seek(offset)
+
+    def read(self, size):
+        return self.file_pointer.read(size)
+
+    def close(self):
+        pass
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Zoomable map tile pyramid of chunk counts, in the z/x/y PNG layout of web map
+viewers like Leaflet and OpenLayers.
+
+At the highest zoom level every pixel is a chunk. Each lower level is built by
+averaging 2x2 pixels of the level above, so the region files are only read
+once. The manifest in the output directory records the layout, the region
+file signatures and the color scale, so reruns only render tiles which cover
+changed region files.
+"""
+
+import json
+import os.path
+from multiprocessing import Pool
+
+import numpy as np
+
+#: Pixels per tile side
+TILE_SIZE = 256
+
+#: Chunks per region side
+REGION_SIZE = 32
+
+#: Regions per tile side at the highest zoom level
+TILE_REGIONS = TILE_SIZE / REGION_SIZE
+
+#: Layout, color scale and region signatures of the previous run
+MANIFEST_NAME = 'mian-tiles.json'
+
+#: Chunk counts of the previous run, to avoid rescanning unchanged regions
+GRID_NAME = 'mian-tiles.npz'
+
+#: Tiles rendered per worker task
+RENDER_BATCH = 16
+
+
+def load_state(tiles_dir):
+    """
+    Read the manifest and chunk grid of a previous run.
+
+    @param tiles_dir: Tile output directory.
+    @return: Manifest dictionary and grid dictionary, both empty if there is
+    no previous run.
+    """
+
+    manifest_path = os.path.join(tiles_dir, MANIFEST_NAME)
+    grid_path = os.path.join(tiles_dir, GRID_NAME)
+    if not (os.path.isfile(manifest_path) and os.path.isfile(grid_path)):
+        return {}, {}
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    grid = {}
+    with np.load(grid_path) as grid_file:
+        for key in grid_file.files:
+            region_x, region_z = key.split('_')
+            grid[(int(region_x), int(region_z))] = grid_file[key]
+
+    return manifest, grid
+
+
+def save_state(tiles_dir, manifest, grid):
+    """Write the manifest and chunk grid for the next run."""
+
+    np.savez(
+        os.path.join(tiles_dir, GRID_NAME),
+        **dict(('%d_%d' % region, tile) for region, tile in grid.iteritems()))
+
+    # Written last, so an interrupted run is redone from scratch
+    with open(os.path.join(tiles_dir, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+
+def pyramid_layout(regions):
+    """
+    Place a set of regions in a tile pyramid.
+
+    @param regions: Region coordinates.
+    @return: Dictionary with the region coordinates of the top left tile
+    corner and the highest zoom level, at which a pixel is a chunk.
+
+    >>> pyramid_layout([(0, 0), (-1, 3)])
+    {'origin': [-8, 0], 'max_zoom': 1}
+    """
+
+    regions = np.array(list(regions))
+    origin = regions.min(axis=0) // TILE_REGIONS * TILE_REGIONS
+    span = (regions.max(axis=0) - origin).max() // TILE_REGIONS + 1
+    max_zoom = int(np.ceil(np.log2(span)))
+
+    return {'origin': origin.tolist(), 'max_zoom': max_zoom}
+
+
+def region_tile(region, layout):
+    """Highest zoom level tile containing a region."""
+
+    return tuple(
+        (coordinate - origin) // TILE_REGIONS
+        for coordinate, origin in zip(region, layout['origin']))
+
+
+def tile_path(tiles_dir, zoom, tile_x, tile_y):
+    """Path of a tile in the z/x/y layout."""
+
+    return os.path.join(tiles_dir, str(zoom), str(tile_x), '%d.png' % tile_y)
+
+
+def tile_pixels(grid, layout):
+    """
+    Average chunk counts per pixel of every tile at the highest zoom level.
+
+    @return: Dictionary of tile coordinates to TILE_SIZE x TILE_SIZE float
+    arrays, NaN where there is no chunk.
+    """
+
+    tiles = {}
+    for region, counts in grid.iteritems():
+        tile = region_tile(region, layout)
+        if tile not in tiles:
+            tiles[tile] = np.empty((TILE_SIZE, TILE_SIZE), dtype=np.float32)
+            tiles[tile].fill(np.nan)
+        column, row = [
+            (coordinate - origin) % TILE_REGIONS * REGION_SIZE
+            for coordinate, origin in zip(region, layout['origin'])]
+        tiles[tile][row:row + REGION_SIZE, column:column + REGION_SIZE] = \
+            np.where(counts < 0, np.nan, counts)
+
+    return tiles
+
+
+def downsample(tiles):
+    """
+    Build the next lower zoom level.
+
+    Each pixel is the mean of the existing chunks in the 2x2 pixels it covers.
+
+    @param tiles: Tiles from tile_pixels() or a previous downsample().
+    @return: Tiles of the lower zoom level.
+    """
+
+    half = TILE_SIZE / 2
+    parents = {}
+    for (tile_x, tile_y), pixels in tiles.iteritems():
+        parent = (tile_x // 2, tile_y // 2)
+        if parent not in parents:
+            parents[parent] = np.empty(
+                (TILE_SIZE, TILE_SIZE), dtype=np.float32)
+            parents[parent].fill(np.nan)
+
+        blocks = pixels.reshape(half, 2, half, 2)
+        present = np.isfinite(blocks)
+        count = present.sum(axis=(1, 3))
+        total = np.where(present, blocks, 0).sum(axis=(1, 3))
+        mean = np.empty((half, half), dtype=np.float32)
+        mean.fill(np.nan)
+        np.divide(total, count, out=mean, where=count > 0)
+
+        column = tile_x % 2 * half
+        row = tile_y % 2 * half
+        parents[parent][row:row + half, column:column + half] = mean
+
+    return parents
+
+
+def render_tiles(jobs):
+    """
+    Write a batch of tiles as PNG files.
+
+    Runs in a worker process.
+
+    @param jobs: List of (path, pixels, maximum) tuples.
+    """
+
+    from matplotlib import cm
+    from matplotlib.colors import Normalize
+    from matplotlib.image import imsave
+
+    for path, pixels, maximum in jobs:
+        colors = cm.jet(Normalize(0, maximum)(np.ma.masked_invalid(pixels)))
+        colors[np.isnan(pixels)] = 0
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another worker
+                pass
+        imsave(path, colors)
+
+
+def write_pyramid(tiles_dir, grid, layout, maximum, dirty_regions, processes):
+    """
+    Render the tiles of all zoom levels which cover changed regions.
+
+    @param tiles_dir: Output directory.
+    @param grid: Dictionary of region coordinates to chunk counts, as from
+    mian.count_region_chunks().
+    @param layout: From pyramid_layout().
+    @param maximum: Count at the top of the color scale.
+    @param dirty_regions: Coordinates of the regions to render tiles for, or
+    None to render everything.
+    @param processes: Number of rendering processes.
+    @return: Number of tiles written.
+    """
+
+    tiles = tile_pixels(grid, layout)
+    dirty = None
+    if dirty_regions is not None:
+        dirty = set(region_tile(region, layout) for region in dirty_regions)
+
+    jobs = []
+    for zoom in xrange(layout['max_zoom'], -1, -1):
+        for (tile_x, tile_y), pixels in tiles.iteritems():
+            if dirty is None or (tile_x, tile_y) in dirty:
+                jobs.append((
+                    tile_path(tiles_dir, zoom, tile_x, tile_y),
+                    pixels,
+                    maximum))
+        if dirty is not None:
+            # Tiles of removed regions
+            for tile_x, tile_y in dirty.difference(tiles):
+                path = tile_path(tiles_dir, zoom, tile_x, tile_y)
+                if os.path.isfile(path):
+                    os.remove(path)
+        if zoom > 0:
+            tiles = downsample(tiles)
+            if dirty is not None:
+                dirty = set((tile_x // 2, tile_y // 2) for tile_x, tile_y in dirty)
+
+    batches = [
+        jobs[index:index + RENDER_BATCH]
+        for index in xrange(0, len(jobs), RENDER_BATCH)]
+    pool = Pool(processes)
+    try:
+        pool.map(render_tiles, batches)
+    finally:
+        pool.close()
+        pool.join()
+
+    return len(jobs)
@@ -16,9 +16,139 @@ __email__ = 'victor.engmark@gmail.com'
 __license__ = 'GPL v3 or newer'
 
 from doctest import testmod
+from glob import glob
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import time
 import unittest
+import zipfile
+import zlib
 
+import numpy as np
+
+from mian import catalog
+from mian import clusters
+from mian import exposure
 from mian import mian
+from mian import nbtscan
+from mian import tiles
+
+
+def nbt_byte_array(name, payload):
+    """Serialize a named TAG_Byte_Array."""
+    return '\x07' + struct.pack('>H', len(name)) + name + \
+        struct.pack('>l', len(payload)) + payload
+
+
+def nbt_name(tag_type, name):
+    """Serialize the header of a named tag."""
+    return chr(tag_type) + struct.pack('>H', len(name)) + name
+
+
+def nbt_entities(name, entities):
+    """
+    Serialize a named TAG_List of entities.
+
+    @param entities: ID and height pairs. Integer heights make tile entities,
+    with a chest inventory to skip, and float heights make mobs.
+    """
+    payload = chr(nbtscan.TAG_COMPOUND) + struct.pack('>i', len(entities))
+    for entity_id, y in entities:
+        payload += nbt_name(nbtscan.TAG_STRING, 'id') + \
+            struct.pack('>H', len(entity_id)) + entity_id
+        if isinstance(y, int):
+            payload += nbt_name(nbtscan.TAG_INT, 'y') + struct.pack('>i', y) + \
+                nbt_name(nbtscan.TAG_LIST, 'Items') + \
+                chr(nbtscan.TAG_COMPOUND) + struct.pack('>i', 1) + \
+                nbt_name(nbtscan.TAG_SHORT, 'id') + struct.pack('>h', 264) + \
+                '\x00'
+        else:
+            payload += nbt_name(nbtscan.TAG_LIST, 'Pos') + \
+                chr(nbtscan.TAG_DOUBLE) + struct.pack('>i', 3) + \
+                struct.pack('>ddd', 0.5, y, 0.5)
+        payload += '\x00'
+    return nbt_name(nbtscan.TAG_LIST, name) + payload
+
+
+def make_chunk(blocks, data=None, entities=(), tile_entities=(), biomes=None):
+    """
+    Serialize a minimal chunk.
+
+    @param blocks: uint8 array with 32768 block IDs in (x, z, y) order.
+    @param data: uint8 array with 32768 data values, or None for all zero.
+    @param entities, tile_entities: Entities as for nbt_entities().
+    @param biomes: uint8 array with 256 biome IDs in (z, x) order, or None for
+    no Biomes array like in McRegion.
+    """
+    if data is None:
+        data = np.zeros(mian.CHUNK_BLOCKS, dtype=np.uint8)
+    packed = (data[0::2] | (data[1::2] << 4)).astype(np.uint8)
+    # One above the highest non-air block, indexed by Z, X
+    solid = blocks.reshape(16, 16, 128) != 0
+    heightmap = np.where(
+        solid.any(axis=2), 128 - np.argmax(solid[:, :, ::-1], axis=2), 0)
+    level = nbt_byte_array(
+            'HeightMap', heightmap.T.astype(np.uint8).tostring()) + \
+        nbt_byte_array('Data', packed.tostring()) + \
+        nbt_byte_array('Blocks', blocks.astype(np.uint8).tostring()) + \
+        nbt_entities('Entities', list(entities)) + \
+        nbt_entities('TileEntities', list(tile_entities))
+    if biomes is not None:
+        level += nbt_byte_array('Biomes', biomes.astype(np.uint8).tostring())
+    return '\x0a\x00\x00' + '\x0a\x00\x05Level' + level + '\x00\x00'
+
+
+def write_region(path, chunks, timestamps=None):
+    """
+    Write a region file.
+
+    @param chunks: Dictionary of chunk index to uncompressed chunk data.
+    @param timestamps: Dictionary of chunk index to timestamp, or None for all
+    zero.
+    """
+    header = ['\x00' * 4] * 1024
+    timestamp_table = np.zeros(1024, dtype='>u4')
+    for index, timestamp in (timestamps or {}).items():
+        timestamp_table[index] = timestamp
+    body = ''
+    sector = 2
+    for index, chunk in sorted(chunks.items()):
+        payload = zlib.compress(chunk)
+        payload = struct.pack('>LB', len(payload) + 1, 2) + payload
+        payload += '\x00' * (-len(payload) % mian.SECTOR_BYTES)
+        sectors = len(payload) / mian.SECTOR_BYTES
+        header[index] = struct.pack('>L', sector << 8 | sectors)
+        body += payload
+        sector += sectors
+    with open(path, 'wb') as region:
+        region.write(''.join(header))
+        region.write(timestamp_table.tostring())
+        region.write(body)
+
+
+#: Seconds each part takes in slow_count_manifest_chunks()
+SLOW_PART_SECONDS = 2
+
+
+def slow_count_manifest_chunks(job):
+    """mian.count_manifest_chunks() which takes a while, for stopping early."""
+    time.sleep(SLOW_PART_SECONDS)
+    return COUNT_MANIFEST_CHUNKS(job)
+
+
+COUNT_MANIFEST_CHUNKS = mian.count_manifest_chunks
+
+
+def column_chunk(column, layer, block_id, data_value=0):
+    """Chunk of stone with one block replaced."""
+    blocks = np.ones(mian.CHUNK_BLOCKS, dtype=np.uint8)
+    data = np.zeros(mian.CHUNK_BLOCKS, dtype=np.uint8)
+    blocks[column * mian.CHUNK_SIZE_Y + layer] = block_id
+    data[column * mian.CHUNK_SIZE_Y + layer] = data_value
+    return make_chunk(blocks, data)
 
 
 class TestLookup(unittest.TestCase):
@@ -55,11 +185,749 @@ class TestLookup(unittest.TestCase):
             [])
 
 
+    def test_data_value(self):
+        """Data value qualified match."""
+        self.assertEquals(
+            mian.lookup_block_type('wool:14'),
+            ['\x23\x0e'])
+
+    def test_data_value_wildcard(self):
+        """All data values."""
+        self.assertEquals(
+            mian.lookup_block_type('23:*'),
+            ['\x23' + chr(value) for value in range(16)])
+
+    def test_invalid_data_value(self):
+        """Data values are 4 bit."""
+        self.assertEquals(
+            mian.lookup_block_type('wool:16'),
+            [])
+
+    def test_categories(self):
+        """Categories from the configuration file."""
+        config_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(config_dir, 'mian.cfg')
+            with open(path, 'w') as config_file:
+                config_file.write(
+                    '[categories]\nred = wool:14, 49\nores = diamond ore\n')
+            categories = mian.load_categories(path)
+        finally:
+            shutil.rmtree(config_dir)
+        self.assertEquals(categories['red'], ['\x23\x0e', '\x49'])
+        self.assertEquals(categories['ores'], ['\x38'])
+        self.assertEquals(categories['liquids'], ['\x08', '\x09', '\x0a', '\x0b'])
+
+        block_type_hexes = mian.lookup_block_types(
+            ['@red', 'dirt', '@RED'], categories)
+        self.assertEquals(len(block_type_hexes), 2)
+        self.assertEquals(mian.block_type_name(block_type_hexes[0]), '@red')
+        self.assertTrue(mian.needs_data_values(block_type_hexes))
+
+
+class TestRegion(unittest.TestCase):
+    """Framework for testing counting of region files."""
+
+    def setUp(self):
+        self.world_dir = tempfile.mkdtemp()
+        self.region_dir = os.path.join(self.world_dir, 'region')
+        os.mkdir(self.region_dir)
+        self.mcr_file = os.path.join(self.region_dir, 'r.0.-1.mcr')
+        write_region(self.mcr_file, {
+            0: column_chunk(3, 10, 0x23, 14),
+            33: column_chunk(200, 12, 0x23, 4)})
+
+    def tearDown(self):
+        shutil.rmtree(self.world_dir)
+
+    def test_count_layers(self):
+        """Block IDs per layer."""
+        histogram = mian.count_region_blocks(self.mcr_file)
+        self.assertEquals(histogram.shape, (256, 128))
+        self.assertEquals(histogram[0x23, 10], 1)
+        self.assertEquals(histogram[0x23, 12], 1)
+        self.assertEquals(histogram[1].sum(), 2 * mian.CHUNK_BLOCKS - 2)
+
+    def test_count_data_values(self):
+        """Block IDs and data values per layer."""
+        histogram = mian.count_region_blocks(self.mcr_file, True)
+        self.assertEquals(histogram.shape, (256, 16, 128))
+        counts = mian.select_counts(
+            histogram, ['\x23', '\x23\x0e', '\x23\x04'])
+        self.assertEquals(counts[0].sum(), 2)
+        self.assertEquals(counts[1][10], 1)
+        self.assertEquals(counts[1].sum(), 1)
+        self.assertEquals(counts[2][12], 1)
+
+    def test_count_chunk(self):
+        """Single chunk counts."""
+        mcr_files = mian.find_region_files(self.world_dir)[1]
+        self.assertEquals(
+            mian.count_chunk_blocks(mcr_files, (0, -32), '\x23\x0e'),
+            1)
+        self.assertEquals(
+            mian.count_chunk_blocks(mcr_files, (0, -32), '\x23\x04'),
+            0)
+        self.assertEquals(
+            mian.count_chunk_blocks(mcr_files, (2, -32), '\x23'),
+            -1)
+        # No such region
+        self.assertEquals(
+            mian.count_chunk_blocks(mcr_files, (0, 0), '\x23'), -1)
+
+    def test_region_chunks(self):
+        """Counts per chunk of a region."""
+        counts = mian.count_region_chunks(self.mcr_file, '\x23\x04')
+        self.assertEquals(counts.shape, (32, 32))
+        self.assertEquals(counts[0, 0], 0)
+        self.assertEquals(counts[1, 1], 1)
+        self.assertEquals((counts == -1).sum(), 1022)
+
+    def test_count_categories(self):
+        """Categories are counted with a look up table."""
+        for block_types, rows, overlap in [
+            (['@ores', '01'], [['\x38', '\x0e'], ['\x01']], False),
+            (['@red', '23:4'], [['\x23\x0e', '\x01'], ['\x23\x04']], False),
+            (['@red', '23'], [['\x23\x0e', '\x01'], ['\x23']], True)]:
+            block_type_hexes = mian.lookup_block_types(block_types, {
+                'ores': ['\x38', '\x0e'], 'red': ['\x23\x0e', '\x01']})
+            # Overlapping rows need the full histogram
+            groups = mian.block_group_table(block_type_hexes)
+            self.assertEquals(groups is None, overlap)
+            for depth in (False, True):
+                for jobs in (None, 2):
+                    counts = mian.scan_events(
+                        [self.mcr_file], block_type_hexes, 'layers',
+                        depth=depth, jobs=jobs)
+                    counts = list(counts)[-1].result
+                    histogram = mian.count_region_blocks(
+                        self.mcr_file, True, depth=depth)
+                    for row, row_hexes in zip(counts, rows):
+                        self.assertTrue(np.array_equal(
+                            row, mian.select_counts(histogram, row_hexes).sum(
+                                axis=0)))
+
+        grid = mian.count_region_chunks(
+            self.mcr_file, mian.BlockCategory('red', ['\x23\x0e', '\x23\x04']))
+        self.assertEquals(grid[0, 0], 1)
+        self.assertEquals(grid[1, 1], 1)
+
+    def test_chunk_browser(self):
+        """Layers of single chunks from a memory capped cache."""
+        browser = mian.ChunkBrowser(
+            [self.mcr_file], ['\x23\x0e', '\x01'], 100 * mian.KIBIBYTE)
+        counts = browser.chunk_counts((0, -32))
+        self.assertEquals(counts[0, 10], 1)
+        self.assertEquals(counts[1].sum(), mian.CHUNK_BLOCKS - 1)
+        self.assertEquals(browser.chunk_counts((5, 5)), None)
+        self.assertEquals(browser.chunk_counts((2, -32)), None)
+
+        browser.prefetch((0, -32))
+        self.assertTrue(('chunk', (1, -31)) in browser.cache)
+        self.assertTrue(browser.cache.bytes <= 100 * mian.KIBIBYTE)
+        # Two chunks with data values and the region file don't fit
+        self.assertFalse(('chunk', (0, -32)) in browser.cache)
+
+    def test_manifest(self):
+        """Chunk manifest from the location tables."""
+        manifest = mian.read_chunk_manifest([self.mcr_file])
+        self.assertEquals(manifest['index'].tolist(), [0, 33])
+        self.assertEquals(manifest['region_z'].tolist(), [-1, -1])
+        self.assertEquals(manifest['offset'].tolist(), [2, 3])
+        stats = dict(mian.world_stats(manifest, [self.mcr_file]))
+        self.assertEquals(stats['Chunks'], 2)
+        self.assertEquals(stats['Free bytes'], 0)
+
+    def test_parallel(self):
+        """Chunks split between processes count the same."""
+        mcr_files = [self.mcr_file]
+        serial = mian.generate_graph_data(
+            self.world_dir, mcr_files, ['\x23', '\x01'], 'table')
+        parallel = mian.generate_graph_data(
+            self.world_dir, mcr_files, ['\x23', '\x01'], 'table', jobs=2)
+        self.assertTrue(np.array_equal(serial, parallel))
+
+    def test_parallel_stop(self):
+        """Stopping a parallel scan doesn't wait for the remaining parts."""
+        write_region(self.mcr_file, dict(
+            (index, column_chunk(index, 10, 0x23)) for index in range(16)))
+        mian.count_manifest_chunks = slow_count_manifest_chunks
+        try:
+            events = mian.scan_events(
+                [self.mcr_file], ['\x23'], 'layers', jobs=2)
+            next(events)
+            self.assertEquals(next(events).total_steps, 8)
+            start = time.time()
+            events.close()
+            self.assertTrue(time.time() - start < SLOW_PART_SECONDS)
+        finally:
+            mian.count_manifest_chunks = COUNT_MANIFEST_CHUNKS
+
+    def test_max_memory(self):
+        """Scans fit a memory budget by counting less at a time."""
+        mcr_files = [self.mcr_file]
+        serial = mian.generate_graph_data(
+            self.world_dir, mcr_files, ['\x23', '\x01'], 'table')
+        budgeted = mian.generate_graph_data(
+            self.world_dir, mcr_files, ['\x23', '\x01'], 'table', jobs=2,
+            max_memory=mian.PROCESS_BYTES + mian.MEBIBYTE)
+        self.assertTrue(np.array_equal(serial, budgeted))
+        self.assertRaises(
+            mian.Usage, mian.generate_graph_data, self.world_dir, mcr_files,
+            ['\x23'], 'table', max_memory=mian.MEBIBYTE)
+
+    def test_time_window(self):
+        """Only chunks saved in the window are read."""
+        write_region(self.mcr_file, {
+            0: column_chunk(3, 10, 0x23, 14),
+            33: column_chunk(200, 12, 0x23, 4)}, {0: 1000, 33: 2000})
+        os.utime(self.mcr_file, (2000, 2000))
+
+        def layers(since=None, until=None):
+            events = list(mian.scan_events(
+                [self.mcr_file], ['\x23'], 'layers', since=since, until=until))
+            return events[0].total_chunks, events[-1].result[0]
+
+        chunks, counts = layers(since=1500)
+        self.assertEquals(chunks, 1)
+        self.assertEquals(counts[12], 1)
+        self.assertEquals(counts.sum(), 1)
+
+        chunks, counts = layers(until=1500)
+        self.assertEquals(chunks, 1)
+        self.assertEquals(counts[10], 1)
+
+        # The file is older than the window
+        start = next(mian.scan_events([self.mcr_file], ['\x23'], 'layers',
+            since=2001))
+        self.assertEquals(start.total_steps, 0)
+        self.assertRaises(mian.Usage, layers, since=2001)
+
+    def test_sparse_grid(self):
+        """Only existing regions are in the chunk grid."""
+        write_region(os.path.join(self.region_dir, 'r.500.-500.mcr'), {
+            5: column_chunk(0, 0, 0x23)})
+        mcr_files = [
+            os.path.join(self.region_dir, name)
+            for name in sorted(os.listdir(self.region_dir))]
+        grid = mian.generate_graph_data(
+            self.world_dir, mcr_files, ['\x23'], 'colormap')
+        self.assertEquals(sorted(grid.keys()), [(0, -1), (500, -500)])
+        self.assertEquals(grid[(500, -500)][0, 5], 1)
+
+    def test_plot_all(self):
+        """All block types as one line artist or one image."""
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+
+        image_path = os.path.join(self.world_dir, 'plot.png')
+        for plot_mode in ('normal', 'heatmap'):
+            mian.main([
+                '-p', plot_mode, '-b', 'ALL', '-o', image_path,
+                self.world_dir])
+            self.assertTrue(os.path.isfile(image_path))
+            ax = plt.gcf().axes[0]
+            if plot_mode == 'normal':
+                self.assertEquals(
+                    [type(artist) for artist in ax.collections],
+                    [LineCollection])
+                self.assertEquals(
+                    len(ax.get_legend().get_texts()), mian.MAX_LEGEND_ROWS)
+            else:
+                self.assertEquals(len(ax.images), 1)
+            plt.close('all')
+            os.remove(image_path)
+
+    def test_pool_grid(self):
+        """Reduced colormap cells, within and across regions."""
+        tile = np.ma.masked_less(np.arange(1024).reshape(32, 32) % 3 - 1, 0)
+        missing = np.ma.masked_less(-np.ones((32, 32)), 0)
+        grid = {(0, 0): tile, (1, 0): tile.copy(), (0, 1): missing}
+
+        pooled, span = mian.pool_grid(grid, 2, 'sum')
+        self.assertEquals(span, 32)
+        self.assertEquals(pooled[(0, 0)].shape, (16, 16))
+        self.assertEquals(pooled[(0, 0)].sum(), tile.sum())
+        self.assertTrue(pooled[(0, 1)].mask.all())
+
+        pooled, span = mian.pool_grid(grid, 64, 'max')
+        self.assertEquals(span, 64)
+        self.assertEquals(pooled.keys(), [(0, 0)])
+        self.assertEquals(pooled[(0, 0)].tolist(), [[1]])
+
+    def test_chunk_cache(self):
+        """Identical chunks are counted once."""
+        write_region(self.mcr_file, dict(
+            (index, column_chunk(0, 5, 0x23, 2)) for index in range(100)))
+        chunk_cache = mian.LRUCache(10)
+        histogram = mian.count_region_blocks(self.mcr_file, True, chunk_cache)
+        self.assertTrue(np.array_equal(
+            histogram, mian.count_region_blocks(self.mcr_file, True)))
+        self.assertEquals(histogram[0x23, 2, 5], 100)
+        self.assertEquals((chunk_cache.hits, chunk_cache.misses), (99, 1))
+
+        counts = mian.count_region_chunks(
+            self.mcr_file, '\x23', mian.LRUCache(10))
+        self.assertEquals(counts[3, 3], 1)
+
+    def test_depth(self):
+        """Blocks per depth below the surface of their column."""
+        blocks = np.ones((16, 16, 128), dtype=np.uint8)
+        blocks[:, :, 64:] = 0
+        blocks[0, 0, 64:80] = 3
+        blocks[0, 0, 60] = 0x38
+        blocks[5, 5, 50] = 0x38
+        blocks[9, 9, :] = 0
+        write_region(self.mcr_file, {0: make_chunk(blocks.ravel())})
+        histogram = mian.count_region_blocks(self.mcr_file, depth=True)
+        self.assertEquals(histogram[0x38, 19], 1)
+        self.assertEquals(histogram[0x38, 13], 1)
+        self.assertEquals(histogram[3].sum(), 16)
+        self.assertEquals(histogram[0].sum(), 0)
+        self.assertEquals(histogram.sum(), 255 * 64 + 16)
+        self.assertTrue(np.array_equal(histogram, mian.count_region_blocks(
+            self.mcr_file, True, mian.LRUCache(1), True).sum(axis=1)))
+
+    def test_export_points(self):
+        """World coordinates of the selected blocks."""
+        path = os.path.join(self.world_dir, 'points.npy')
+        for chunk_cache in (None, mian.LRUCache(10)):
+            points = mian.PointWriter(path, ['\x23\x0e', '\x38'])
+            mian.count_region_blocks(
+                self.mcr_file, True, chunk_cache, points=points,
+                region=(0, -1))
+            points.close()
+            exported = np.load(path)
+            self.assertEquals(len(exported), 1)
+            # Region 0, -1, chunk 0, 0, column 3 is x 0, z 3
+            self.assertEquals(
+                exported[0].tolist(), (0, 10, -512 + 3, 0x23, 14))
+
+    def test_surface(self):
+        """Surface heights from the height maps."""
+        blocks = np.ones((16, 16, 128), dtype=np.uint8)
+        blocks[:, :, 64:] = 0
+        blocks[2, 3, 64:70] = 1
+        write_region(self.mcr_file, {
+            0: make_chunk(blocks.ravel()),
+            1: make_chunk(np.ones(mian.CHUNK_BLOCKS, dtype=np.uint8))})
+        histogram, heights = mian.count_region_surface(self.mcr_file, 'max')
+        self.assertEquals(histogram[64], 255)
+        self.assertEquals(histogram[70], 1)
+        # Full columns have their own bin above the top layer
+        self.assertEquals(histogram[127], 0)
+        self.assertEquals(histogram[128], 256)
+        self.assertEquals(heights[0, 0], 70)
+        self.assertEquals(heights[0, 1], 128)
+        self.assertEquals(heights[0, 2], -1)
+
+    def test_biomes(self):
+        """Blocks per biome from the same chunks."""
+        blocks = np.ones((16, 16, 128), dtype=np.uint8)
+        blocks[2, 0, 10] = blocks[9, 0, 10] = blocks[9, 5, 11] = 0x38
+        # Desert in the west half, plains in the east
+        biomes = np.ones((16, 16), dtype=np.uint8)
+        biomes[:, :8] = 2
+        write_region(self.mcr_file, {
+            0: make_chunk(blocks.ravel(), biomes=biomes),
+            1: make_chunk(blocks.ravel())})
+        histograms = mian.count_region_biomes(self.mcr_file)
+        self.assertEquals(sorted(histograms), [1, 2, mian.UNKNOWN_BIOME])
+        self.assertEquals(histograms[2][0x38, 10], 1)
+        self.assertEquals(histograms[1][0x38].nonzero()[0].tolist(), [10, 11])
+        self.assertEquals(histograms[mian.UNKNOWN_BIOME][0x38].sum(), 3)
+        self.assertEquals(
+            sum(histogram.sum() for histogram in histograms.values()),
+            2 * mian.CHUNK_BLOCKS)
+
+        block_type_hexes = mian.lookup_block_types(['diamond ore', 'stone'])
+        groups = mian.block_group_table(block_type_hexes)
+        grouped = mian.count_region_biomes(self.mcr_file, groups=groups)
+        names, rows = mian.biome_rows(
+            dict((biome, mian.select_counts(histogram, block_type_hexes, groups))
+                for biome, histogram in grouped.items()),
+            block_type_hexes)
+        self.assertEquals(names[:2], ['Diamond Ore in Plains', 'Stone in Plains'])
+        self.assertEquals(rows[0].sum(), 2)
+
+    def test_entities(self):
+        """Entities and tile entities by ID and layer."""
+        blocks = np.ones(mian.CHUNK_BLOCKS, dtype=np.uint8)
+        write_region(self.mcr_file, {
+            0: make_chunk(blocks, entities=[('Creeper', 12.9), ('Pig', 200.0)],
+                tile_entities=[('Chest', 12), ('MobSpawner', 20)]),
+            1: make_chunk(blocks, tile_entities=[('Chest', 30)])})
+        histogram, counts = mian.count_region_entities(self.mcr_file)
+        self.assertEquals(
+            sorted(histogram), ['Chest', 'Creeper', 'MobSpawner', 'Pig'])
+        self.assertEquals(histogram['Creeper'][12], 1)
+        self.assertEquals(histogram['Pig'][127], 1)
+        self.assertEquals(histogram['Chest'].nonzero()[0].tolist(), [12, 30])
+        self.assertEquals(counts[0, :3].tolist(), [4, 1, -1])
+
+        histogram, counts = mian.count_region_entities(
+            self.mcr_file, ['chest'])
+        self.assertEquals(histogram.keys(), ['Chest'])
+        self.assertEquals(counts[0, :3].tolist(), [1, 1, -1])
+
+        names, rows = mian.entity_rows(mian.count_region_entities(
+            self.mcr_file)[0])
+        self.assertEquals(names, ['Chest', 'Creeper', 'MobSpawner', 'Pig'])
+        self.assertEquals(rows.sum(axis=1).tolist(), [2, 1, 1, 1])
+
+
+class TestAPI(unittest.TestCase):
+    """Framework for testing the library interface."""
+
+    def setUp(self):
+        self.world_dir = tempfile.mkdtemp()
+        region_dir = os.path.join(self.world_dir, 'region')
+        os.mkdir(region_dir)
+        write_region(os.path.join(region_dir, 'r.0.0.mcr'), {
+            0: column_chunk(3, 10, 0x38)})
+        write_region(os.path.join(region_dir, 'r.1.0.mcr'), {
+            0: column_chunk(3, 20, 0x38),
+            1: column_chunk(3, 20, 0x38)})
+
+    def tearDown(self):
+        shutil.rmtree(self.world_dir)
+
+    def test_scan_world(self):
+        """Counts per layer."""
+        counts = mian.scan_world(self.world_dir, block_types='diamond ore')
+        self.assertEquals(counts.shape, (1, 128))
+        self.assertEquals(counts[0, 10], 1)
+        self.assertEquals(counts[0, 20], 2)
+
+    def test_events(self):
+        """Progress and partial results per region."""
+        events = list(mian.scan_world_events(
+            self.world_dir, block_types=['38'], engine='chunks'))
+        self.assertEquals(
+            [event.kind for event in events],
+            [mian.EVENT_START, mian.EVENT_PROGRESS, mian.EVENT_PROGRESS,
+                mian.EVENT_DONE])
+        self.assertEquals(events[0].total_chunks, 3)
+        self.assertEquals(events[2].chunks_done, 3)
+        for event in events[1:3]:
+            self.assertTrue(np.array_equal(
+                event.result, events[-1].result[event.region]))
+
+
+    def test_top(self):
+        """Chunks and regions with the most blocks, in one or more jobs."""
+        for jobs in (None, 2):
+            self.assertEquals(
+                mian.scan_world(self.world_dir, block_types='diamond ore',
+                    engine='top', jobs=jobs, top=mian.TopQuery(2, False, None)),
+                [(1, (33, 0)), (1, (32, 0))])
+            self.assertEquals(
+                mian.scan_world(self.world_dir, block_types='diamond ore',
+                    engine='top', jobs=jobs, top=mian.TopQuery(5, True, None)),
+                [(2, (1, 0)), (1, (0, 0))])
+            self.assertEquals(
+                mian.scan_world(self.world_dir, block_types='diamond ore',
+                    engine='top', jobs=jobs,
+                    top=mian.TopQuery(5, False, (0, 16))),
+                [(1, (0, 0))])
+
+    def test_checkpoint(self):
+        """Resuming an interrupted scan gives the same result."""
+        checkpoint_path = os.path.join(self.world_dir, 'checkpoint')
+        for engine, jobs in [
+            ('layers', None), ('layers', 2), ('chunks', None),
+            ('clusters', None)]:
+            expected = mian.scan_world(
+                self.world_dir, block_types='38', engine=engine, jobs=jobs)
+
+            events = mian.scan_world_events(
+                self.world_dir, block_types='38', engine=engine, jobs=jobs,
+                checkpoint=mian.Checkpoint(checkpoint_path, 0))
+            while next(events).kind != mian.EVENT_PROGRESS:
+                pass
+            events.close()
+
+            checkpoint = mian.Checkpoint(checkpoint_path, 0)
+            events = list(mian.scan_world_events(
+                self.world_dir, block_types='38', engine=engine, jobs=jobs,
+                checkpoint=checkpoint))
+            self.assertTrue(checkpoint.resumed > 0)
+            self.assertTrue(events[0].total_chunks < 3)
+            result = events[-1].result
+            if engine == 'chunks':
+                self.assertEquals(sorted(result), sorted(expected))
+                result = [result[region] for region in sorted(result)]
+                expected = [expected[region] for region in sorted(expected)]
+            self.assertTrue(np.array_equal(result[0], expected[0]))
+
+            self.assertRaises(
+                mian.Usage, mian.scan_world, self.world_dir, block_types='39',
+                engine=engine, jobs=jobs,
+                checkpoint=mian.Checkpoint(checkpoint_path))
+            os.remove(checkpoint_path)
+
+    def test_archives(self):
+        """Worlds read from backups without extracting them."""
+        expected = mian.scan_world(self.world_dir, block_types='38')
+        archive_dir = tempfile.mkdtemp()
+        try:
+            for name, compression in [
+                ('world.zip', zipfile.ZIP_STORED),
+                ('deflated.zip', zipfile.ZIP_DEFLATED)]:
+                path = os.path.join(archive_dir, name)
+                with zipfile.ZipFile(path, 'w', compression) as zip_file:
+                    for region in os.listdir(os.path.join(self.world_dir, 'region')):
+                        zip_file.write(
+                            os.path.join(self.world_dir, 'region', region),
+                            'World1/region/' + region)
+                counts = mian.scan_world(path, block_types='38')
+                self.assertTrue(np.array_equal(counts, expected))
+
+            for name, mode in [('world.tar', 'w'), ('world.tar.gz', 'w:gz')]:
+                path = os.path.join(archive_dir, name)
+                with tarfile.open(path, mode) as tar_file:
+                    tar_file.add(self.world_dir, '.')
+                counts = mian.scan_world(path, block_types='38')
+                self.assertTrue(np.array_equal(counts, expected))
+                stats = dict(mian.scan_world(path, engine='stats'))
+                self.assertEquals(stats['Chunks'], 3)
+        finally:
+            shutil.rmtree(archive_dir)
+
+    def test_catalog(self):
+        """Region files listed once, with coordinates, sizes and times."""
+        region_dir = os.path.join(self.world_dir, 'region')
+        region_path = os.path.join(region_dir, 'r.0.0.mcr')
+        write_region(os.path.join(region_dir, 'r.-1.0.mcr'), {
+            0: column_chunk(3, 10, 0x38)})
+        open(os.path.join(region_dir, 'r.0.0.mcr.tmp'), 'w').close()
+
+        regions = catalog.read_catalog(region_dir)
+        self.assertEquals(regions.coordinates(), [(-1, 0), (0, 0), (1, 0)])
+        self.assertEquals(regions.find((1, 0)), 2)
+        self.assertEquals(regions.find((2, 0)), None)
+        self.assertEquals(
+            regions.signatures()[(0, 0)], mian.storage.stat(region_path))
+        self.assertEquals(
+            regions.select(regions.regions['x'] >= 0).paths,
+            [region_path, os.path.join(region_dir, 'r.1.0.mcr')])
+
+    def test_diff(self):
+        """Changes between two copies of a world."""
+        new_dir = os.path.join(self.world_dir, 'new')
+        shutil.copytree(self.world_dir, new_dir)
+        region_dir = os.path.join(new_dir, 'region')
+        write_region(os.path.join(region_dir, 'r.1.0.mcr'), {
+            0: column_chunk(3, 20, 0x38),
+            2: column_chunk(3, 30, 0x38)})
+        write_region(os.path.join(region_dir, 'r.0.1.mcr'), {
+            5: column_chunk(3, 40, 0x38)})
+
+        counts = mian.diff_worlds(self.world_dir, new_dir, block_types='38')
+        self.assertEquals(counts[0, 20], -1)
+        self.assertEquals(counts[0, 30], 1)
+        self.assertEquals(counts[0, 40], 1)
+        self.assertEquals(np.count_nonzero(counts), 3)
+
+        grid = mian.diff_worlds(
+            self.world_dir, new_dir, block_types='38', engine='chunks')
+        self.assertEquals(sorted(grid), [(0, 0), (0, 1), (1, 0)])
+        self.assertEquals(grid[(0, 0)][0, 0], 0)
+        self.assertEquals(grid[(1, 0)][0, :3].tolist(), [0, -1, 1])
+        self.assertEquals(grid[(0, 1)][0, 5], 1)
+        self.assertEquals(np.isfinite(grid[(0, 1)]).sum(), 1)
+
+
+class TestNBTScan(unittest.TestCase):
+    """Framework for testing the streaming NBT scanner."""
+
+    def test_early_stop(self):
+        """Decompression stops after the wanted tags."""
+        chunk = make_chunk(np.random.randint(
+            0, 256, mian.CHUNK_BLOCKS).astype(np.uint8))
+        stream = nbtscan.ChunkStream(zlib.compress(chunk), 2)
+        tags = nbtscan.find_tags(stream, [('Level', 'HeightMap')])
+        self.assertEquals(len(tags[('Level', 'HeightMap')]), 256)
+        self.assertTrue(stream.inflated < len(chunk) / 2)
+
+    def test_skip(self):
+        """Tags after skipped ones are found."""
+        chunk = make_chunk(np.ones(mian.CHUNK_BLOCKS, dtype=np.uint8))
+        stream = nbtscan.ChunkStream(zlib.compress(chunk), 2)
+        tags = nbtscan.find_tags(
+            stream, [('Level', 'Blocks'), ('Level', 'Missing')])
+        self.assertEquals(tags.keys(), [('Level', 'Blocks')])
+        self.assertEquals(tags[('Level', 'Blocks')], '\x01' * 32768)
+
+
+class TestTiles(unittest.TestCase):
+    """Framework for testing the map tile pyramid."""
+
+    def test_downsample(self):
+        """Lower zoom levels average the existing chunks."""
+        grid = {(0, 0): np.full((32, 32), -1), (9, 0): np.full((32, 32), 4)}
+        grid[(0, 0)][0, 0:2] = [2, 3]
+        layout = tiles.pyramid_layout(grid.keys())
+        self.assertEquals(layout['max_zoom'], 1)
+
+        pixels = tiles.tile_pixels(grid, layout)
+        self.assertEquals(sorted(pixels.keys()), [(0, 0), (1, 0)])
+
+        parents = tiles.downsample(pixels)
+        self.assertEquals(parents.keys(), [(0, 0)])
+        self.assertEquals(parents[(0, 0)][0, 0], 2.5)
+        self.assertTrue(np.isnan(parents[(0, 0)][0, 1]))
+        self.assertEquals(parents[(0, 0)][0, 128 + 16], 4)
+
+
+class TestClusters(unittest.TestCase):
+    """Framework for testing the connected component search."""
+
+    def test_region_border(self):
+        """Diagonal neighbors in different regions are one cluster."""
+        world_dir = tempfile.mkdtemp()
+        try:
+            region_dir = os.path.join(world_dir, 'region')
+            os.mkdir(region_dir)
+            write_region(os.path.join(region_dir, 'r.0.0.mcr'), {
+                31: column_chunk(15 * 16 + 5, 20, 0x38)})
+            write_region(os.path.join(region_dir, 'r.1.0.mcr'), {
+                0: column_chunk(6, 21, 0x38),
+                1: column_chunk(6, 21, 0x38)})
+            size_counts, largest = mian.generate_graph_data(
+                world_dir, glob(os.path.join(region_dir, '*.mcr')),
+                ['\x38'], 'clusters')
+        finally:
+            shutil.rmtree(world_dir)
+
+        self.assertEquals(size_counts, {1: 1, 2: 1})
+        self.assertEquals([size for size, _ in largest], [2, 1])
+        self.assertTrue(largest[0][1] in [(511, 20, 5), (512, 21, 6)])
+        self.assertEquals(largest[1][1], (528, 21, 6))
+
+    def test_chunk_merge(self):
+        """Merging chunks matches labeling them as a whole."""
+        random = np.random.RandomState(0)
+        world = random.rand(48, 48, 128) < 0.05
+
+        finder = clusters.ClusterFinder()
+        chunks = [(x, z) for x in range(3) for z in range(3)]
+        random.shuffle(chunks)
+        for x, z in chunks:
+            finder.add_chunk(
+                (x - 1, z - 1), world[x * 16:x * 16 + 16, z * 16:z * 16 + 16])
+        # All the neighbors of the middle chunk were added
+        self.assertTrue((0, 0) not in finder.sides)
+        size_counts, largest = finder.components()
+
+        labels, count = clusters.label_components(world)
+        expected = np.bincount(labels.ravel())[1:]
+        self.assertEquals(
+            size_counts, dict(zip(*np.unique(expected, return_counts=True))))
+        self.assertEquals(
+            [size for size, _ in largest], sorted(expected, reverse=True)[:10])
+
+    def test_final_components(self):
+        """Components which can't grow anymore are forgotten."""
+        finder = clusters.ClusterFinder(largest=2)
+        empty = np.zeros((16, 16, 128), dtype=bool)
+        mask = empty.copy()
+        # One component on a side and one inside each chunk
+        mask[5, 0, 5] = mask[5, 1, 5] = mask[5, 5, 5] = True
+        # The components on the edges of the world stay until the end
+        for z in range(3):
+            finder.add_chunk((-1, z), empty)
+        for x in range(100):
+            for z, chunk in enumerate([empty, mask, empty]):
+                finder.add_chunk((x, z), chunk)
+            # Only the component of the last chunk can still grow
+            self.assertEquals(len(finder.parents), 1)
+            self.assertEquals(sum(finder.size_counts.values()), 2 * x + 1)
+        size_counts, largest = finder.components()
+
+        self.assertEquals(size_counts, {1: 100, 2: 100})
+        self.assertEquals(
+            largest, [(2, (1589, 5, 16)), (2, (1573, 5, 16))])
+
+    def test_full_chunk(self):
+        """A chunk without any unselected block keeps its location."""
+        finder = clusters.ClusterFinder()
+        finder.add_chunk((0, 0), np.ones((16, 16, 128), dtype=bool))
+        single = np.zeros((16, 16, 128), dtype=bool)
+        single[5, 5, 5] = True
+        finder.add_chunk((10, 10), single)
+        size_counts, largest = finder.components()
+
+        self.assertEquals(size_counts, {1: 1, 16 * 16 * 128: 1})
+        self.assertEquals(
+            largest, [(16 * 16 * 128, (0, 0, 0)), (1, (165, 5, 165))])
+
+
+class TestExposure(unittest.TestCase):
+    """Framework for testing exposed block counts."""
+
+    def test_chunk_sides(self):
+        """Adding chunks in any order matches checking the world as a whole."""
+        random = np.random.RandomState(0)
+        transparent = random.rand(48, 48, 128) < 0.3
+        selected = ~transparent & (random.rand(48, 48, 128) < 0.2)
+        # Row 1 is the selected blocks
+        bins = selected * 128 + np.arange(128)
+
+        counter = exposure.ExposureCounter((2, 128))
+        chunks = [(x, z) for x in range(3) for z in range(3)]
+        random.shuffle(chunks)
+        for x, z in chunks:
+            area = np.s_[x * 16:x * 16 + 16, z * 16:z * 16 + 16]
+            counter.add_chunk(
+                (x, z), transparent[area], selected[area], bins[area])
+        counter.flush()
+
+        exposed = exposure.exposed_mask(transparent)
+        self.assertTrue(np.array_equal(
+            counter.histogram[exposure.EXPOSED, 1],
+            np.bincount(np.nonzero(selected & exposed)[2], minlength=128)))
+        self.assertTrue(np.array_equal(
+            counter.histogram[exposure.ENCLOSED, 1],
+            np.bincount(np.nonzero(selected & ~exposed)[2], minlength=128)))
+        self.assertEquals(counter.histogram.sum(), 48 * 48 * 128)
+        # All the neighbors of the middle chunk were added
+        self.assertTrue((1, 1) not in counter.sides)
+
+    def test_region(self):
+        """Ore next to a cave in the same region."""
+        world_dir = tempfile.mkdtemp()
+        try:
+            mcr_file = os.path.join(world_dir, 'r.0.0.mcr')
+            first = np.ones((16, 16, 128), dtype=np.uint8)
+            first[15, 0, 10] = first[15, 0, 20] = 0x38
+            second = np.ones((16, 16, 128), dtype=np.uint8)
+            second[0, 0, 10] = 0
+            write_region(mcr_file, {
+                0: make_chunk(first.ravel()), 1: make_chunk(second.ravel())})
+            block_type_hexes = mian.lookup_block_types(['diamond ore'])
+            events = list(mian.scan_events(
+                [mcr_file], block_type_hexes, 'exposure'))
+            result = events[-1].result
+            self.assertEquals(
+                result[exposure.EXPOSED][0].nonzero()[0].tolist(), [10])
+            self.assertEquals(
+                result[exposure.ENCLOSED][0].nonzero()[0].tolist(), [20])
+        finally:
+            shutil.rmtree(world_dir)
+
+
 class TestDoc(unittest.TestCase):
     """Test Python documentation strings."""
     def test_doc(self):
         """Documentation tests."""
         self.assertEqual(testmod(mian)[0], 0)
+        self.assertEqual(testmod(tiles)[0], 0)
+        self.assertEqual(testmod(clusters)[0], 0)
+        self.assertEqual(testmod(exposure)[0], 0)
+        self.assertEqual(testmod(catalog)[0], 0)
 
 
 def main():